@@ -8,30 +8,98 @@ try:
     from .nodes_direct import (
         PopoImageSizeNode,
         PopoImageDimensionsNode, 
+        PopoImageDimensionsListNode,
         PopoImageAspectRatioNode,
-        PopoMathExpressionNode
+        PopoImageFileDimensionsNode,
+        PopoImageDirectoryScanNode,
+        PopoAspectBucketNode,
+        PopoResolutionPlannerNode,
+        PopoLatentDimensionsNode,
+        PopoMaskDimensionsNode,
+        PopoVideoDimensionsNode,
+        PopoImageStatisticsNode,
+        PopoImageFingerprintNode,
+        PopoImageGroupBySizeNode,
+        PopoImageRestoreOrderNode,
+        PopoContentBoundingBoxNode,
+        PopoMathExpressionNode,
+        PopoMathProgramNode,
+        PopoMathExpressionBatchNode,
+        PopoSweepNode,
+        PopoImageExpressionNode
     )
 except ImportError:
     from nodes_direct import (
         PopoImageSizeNode,
         PopoImageDimensionsNode, 
+        PopoImageDimensionsListNode,
         PopoImageAspectRatioNode,
-        PopoMathExpressionNode
+        PopoImageFileDimensionsNode,
+        PopoImageDirectoryScanNode,
+        PopoAspectBucketNode,
+        PopoResolutionPlannerNode,
+        PopoLatentDimensionsNode,
+        PopoMaskDimensionsNode,
+        PopoVideoDimensionsNode,
+        PopoImageStatisticsNode,
+        PopoImageFingerprintNode,
+        PopoImageGroupBySizeNode,
+        PopoImageRestoreOrderNode,
+        PopoContentBoundingBoxNode,
+        PopoMathExpressionNode,
+        PopoMathProgramNode,
+        PopoMathExpressionBatchNode,
+        PopoSweepNode,
+        PopoImageExpressionNode
     )
 
 # ComfyUI需要的映射
 NODE_CLASS_MAPPINGS = {
     "PopoImageSizeNode": PopoImageSizeNode,
     "PopoImageDimensionsNode": PopoImageDimensionsNode,
+    "PopoImageDimensionsListNode": PopoImageDimensionsListNode,
     "PopoImageAspectRatioNode": PopoImageAspectRatioNode,
+    "PopoImageFileDimensionsNode": PopoImageFileDimensionsNode,
+    "PopoImageDirectoryScanNode": PopoImageDirectoryScanNode,
+    "PopoAspectBucketNode": PopoAspectBucketNode,
+    "PopoResolutionPlannerNode": PopoResolutionPlannerNode,
+    "PopoLatentDimensionsNode": PopoLatentDimensionsNode,
+    "PopoMaskDimensionsNode": PopoMaskDimensionsNode,
+    "PopoVideoDimensionsNode": PopoVideoDimensionsNode,
+    "PopoImageStatisticsNode": PopoImageStatisticsNode,
+    "PopoImageFingerprintNode": PopoImageFingerprintNode,
+    "PopoImageGroupBySizeNode": PopoImageGroupBySizeNode,
+    "PopoImageRestoreOrderNode": PopoImageRestoreOrderNode,
+    "PopoContentBoundingBoxNode": PopoContentBoundingBoxNode,
     "PopoMathExpressionNode": PopoMathExpressionNode,
+    "PopoMathProgramNode": PopoMathProgramNode,
+    "PopoMathExpressionBatchNode": PopoMathExpressionBatchNode,
+    "PopoSweepNode": PopoSweepNode,
+    "PopoImageExpressionNode": PopoImageExpressionNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "PopoImageSizeNode": "Popo Image Size",
     "PopoImageDimensionsNode": "Popo Image Dimensions", 
+    "PopoImageDimensionsListNode": "Popo Image Dimensions (List)",
     "PopoImageAspectRatioNode": "Popo Image Aspect Ratio",
+    "PopoImageFileDimensionsNode": "Popo Image File Dimensions",
+    "PopoImageDirectoryScanNode": "Popo Image Directory Scan",
+    "PopoAspectBucketNode": "Popo Aspect Bucket",
+    "PopoResolutionPlannerNode": "Popo Resolution Planner",
+    "PopoLatentDimensionsNode": "Popo Latent Dimensions",
+    "PopoMaskDimensionsNode": "Popo Mask Dimensions",
+    "PopoVideoDimensionsNode": "Popo Video Dimensions",
+    "PopoImageStatisticsNode": "Popo Image Statistics",
+    "PopoImageFingerprintNode": "Popo Image Fingerprint",
+    "PopoImageGroupBySizeNode": "Popo Image Group By Size",
+    "PopoImageRestoreOrderNode": "Popo Image Restore Order",
+    "PopoContentBoundingBoxNode": "Popo Content Bounding Box",
     "PopoMathExpressionNode": "Popo Math Expression",
+    "PopoMathProgramNode": "Popo Math Program",
+    "PopoMathExpressionBatchNode": "Popo Math Expression (Batch)",
+    "PopoSweepNode": "Popo Sweep",
+    "PopoImageExpressionNode": "Popo Image Expression",
 }
 
 # 版本信息
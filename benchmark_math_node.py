@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+数学表达式节点性能基准
+测量PopoMathExpressionNode在真实表达式语料上的单次调用耗时和内存分配，
+并与仓库中的基准文件比较，超过阈值时以非零状态码退出
+
+用法:
+    python benchmark_math_node.py                      # 运行并与基准比较
+    python benchmark_math_node.py --threshold 0.5      # 放宽回归阈值
+    python benchmark_math_node.py --update-baseline    # 在当前机器上重新生成基准
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# 默认回归阈值：比基准慢30%以上视为回归
+DEFAULT_THRESHOLD = 0.30
+
+# 按指标的回归阈值，冷启动和缓存命中的耗时更易受系统噪声影响
+DEFAULT_THRESHOLDS = {"default": DEFAULT_THRESHOLD, "cold_ns": 0.5, "memo_ns": 0.5}
+
+# 参与比较的指标
+METRICS = ("cold_ns", "warm_ns", "memo_ns", "peak_bytes")
+
+# 基准语料: (名称, 表达式, (a, b, c))
+CORPUS: List[Tuple[str, str, Tuple[float, float, float]]] = [
+    # 算术
+    ("arith_sum", "a + b + c", (10.0, 5.0, 3.0)),
+    ("arith_snap", "a // 8 * 8", (1023.0, 0.0, 0.0)),
+    ("arith_scale", "a * 0.75 + b / 2 - c", (1920.0, 1080.0, 3.0)),
+    ("arith_ratio", "round(a / b, 3)", (1920.0, 1080.0, 0.0)),
+    # 三角/对数
+    ("trig_sin", "sin(radians(a))", (30.0, 0.0, 0.0)),
+    ("trig_atan2", "degrees(atan2(b, a))", (3.0, 4.0, 0.0)),
+    ("log_mix", "log10(a) + log(b, 2) + exp(c / 10)", (1000.0, 64.0, 5.0)),
+    # 嵌套调用
+    ("nested_hypot", "sqrt(a*a + b*b)", (3.0, 4.0, 0.0)),
+    ("nested_fit", "max(ceil(a / 64) * 64, min(b, c) * 2)", (1000.0, 512.0, 768.0)),
+    ("nested_cond", "a * 2 if a > b else max(b, c) / 2", (5.0, 7.0, 9.0)),
+    ("nested_cse", "sqrt(a*a + b*b) / sqrt(a*a + b*b) * pi * 2", (3.0, 4.0, 0.0)),
+    # 病态输入
+    ("patho_long_chain", " + ".join(["a * b"] * 100), (1.5, 2.0, 0.0)),
+    ("patho_deep_nesting", "(" * 60 + "a" + " + 1)" * 60, (1.0, 0.0, 0.0)),
+    ("patho_factorial", "factorial(int(a))", (170.0, 0.0, 0.0)),
+    ("patho_rejected", "().__class__.__bases__", (0.0, 0.0, 0.0)),
+    ("patho_budget", "int(a) ** int(b) ** int(c)", (9.0, 9.0, 9.0)),
+]
+
+
+def _time_per_call(func: Callable[[], Any], number: int, repeat: int, setup: Optional[Callable[[], None]] = None) -> float:
+    """返回多轮测量中每次调用耗时（纳秒）的最小值，最小值受系统噪声影响最小"""
+    # 与timeit一致，测量期间关闭垃圾回收
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        samples = _collect_samples(func, number, repeat, setup)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return min(samples)
+
+
+def _collect_samples(func: Callable[[], Any], number: int, repeat: int, setup: Optional[Callable[[], None]]) -> List[float]:
+    """每轮的平均单次耗时（纳秒）"""
+    samples = []
+    for _ in range(repeat):
+        if setup is None:
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                func()
+            samples.append((time.perf_counter_ns() - start) / number)
+        else:
+            # 每次调用前都需要准备时，只统计调用本身的耗时
+            total = 0
+            for _ in range(number):
+                setup()
+                start = time.perf_counter_ns()
+                func()
+                total += time.perf_counter_ns() - start
+            samples.append(total / number)
+    return samples
+
+
+def _peak_bytes(func: Callable[[], Any]) -> int:
+    """单次调用期间由Python分配的峰值内存（字节）"""
+    tracemalloc.start()
+    try:
+        func()  # 预热，排除一次性分配
+        tracemalloc.clear_traces()
+        baseline, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        return max(peak - baseline, 0)
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(number: int = 200, repeat: int = 7, name_filter: str = "") -> Dict[str, Dict[str, float]]:
+    """
+    运行基准语料
+
+    每个表达式测量三种情况:
+        cold_ns: 清空编译缓存和结果缓存后的首次调用（解析、检查、优化、编译、求值）
+        warm_ns: 编译缓存命中、结果缓存关闭时的调用（仅求值）
+        memo_ns: 结果缓存命中时的调用
+    以及 peak_bytes: 缓存命中后单次求值的峰值内存分配
+    """
+    # 屏蔽导入时的注册日志，以及病态表达式触发的节点错误输出
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        import nodes_direct
+    from nodes import expression_engine
+
+    node = nodes_direct.PopoMathExpressionNode()
+    memo = nodes_direct._expression_result_memo
+    memo_size = memo.maxsize
+    results: Dict[str, Dict[str, float]] = {}
+
+    def reset_caches() -> None:
+        expression_engine.clear_expression_cache()
+        memo.clear()
+
+    with quiet:
+        try:
+            for name, expression, (a, b, c) in CORPUS:
+                if name_filter and name_filter not in name:
+                    continue
+
+                call = lambda: node.calculate_expression(a, b, c, expression)
+
+                # 冷启动的准备开销较大，减少调用次数
+                cold_ns = _time_per_call(call, max(number // 10, 1), repeat, setup=reset_caches)
+
+                memo.resize(0)
+                call()
+                warm_ns = _time_per_call(call, number, repeat)
+                peak_bytes = _peak_bytes(call)
+
+                memo.resize(memo_size)
+                call()
+                memo_ns = _time_per_call(call, number, repeat)
+
+                results[name] = {
+                    "cold_ns": round(cold_ns, 1),
+                    "warm_ns": round(warm_ns, 1),
+                    "memo_ns": round(memo_ns, 1),
+                    "peak_bytes": peak_bytes,
+                }
+        finally:
+            memo.resize(memo_size)
+            reset_caches()
+
+    return results
+
+
+def compare_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Any],
+    threshold: Optional[float] = None,
+) -> List[str]:
+    """
+    与基准比较，返回回归描述列表（为空表示没有回归）
+
+    阈值优先级: 参数threshold > 基准文件中按指标配置的thresholds > DEFAULT_THRESHOLD
+    """
+    thresholds = baseline.get("thresholds", {})
+    regressions = []
+    for name, metrics in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if not reference:
+            continue
+        for metric in METRICS:
+            if metric not in metrics or not reference.get(metric):
+                continue
+            limit = threshold if threshold is not None else thresholds.get(
+                metric, thresholds.get("default", DEFAULT_THRESHOLD)
+            )
+            ratio = metrics[metric] / reference[metric]
+            if ratio > 1 + limit:
+                regressions.append(
+                    f"{name}.{metric}: {metrics[metric]:.0f} vs 基准 {reference[metric]:.0f} "
+                    f"(+{(ratio - 1) * 100:.0f}%, 阈值 +{limit * 100:.0f}%)"
+                )
+    return regressions
+
+
+def _print_table(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any]) -> None:
+    reference = baseline.get("results", {})
+    print(f"{'表达式':<20}{'cold ns':>12}{'warm ns':>12}{'memo ns':>12}{'peak B':>10}{'warm Δ':>10}")
+    print("-" * 76)
+    for name, metrics in results.items():
+        delta = ""
+        base = reference.get(name, {}).get("warm_ns")
+        if base:
+            delta = f"{(metrics['warm_ns'] / base - 1) * 100:+.0f}%"
+        print(
+            f"{name:<20}{metrics['cold_ns']:>12.0f}{metrics['warm_ns']:>12.0f}"
+            f"{metrics['memo_ns']:>12.0f}{metrics['peak_bytes']:>10}{delta:>10}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="PopoMathExpressionNode 性能基准")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准文件路径")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基准文件")
+    parser.add_argument("--threshold", type=float, default=None, help="回归阈值，例如0.3表示慢30%%")
+    parser.add_argument("--number", type=int, default=200, help="每轮调用次数")
+    parser.add_argument("--repeat", type=int, default=7, help="测量轮数，取最小值")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的表达式")
+    parser.add_argument("--json", dest="json_path", help="把本次结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    print("⚡ PopoMathExpressionNode 性能基准")
+    print("=" * 76)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(args.number, args.repeat, args.filter)
+    _print_table(results, baseline)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.update_baseline:
+        baseline = {
+            "machine": f"{platform.system()} {platform.machine()} / Python {platform.python_version()}",
+            "thresholds": baseline.get("thresholds", DEFAULT_THRESHOLDS),
+            "results": results,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\n📝 基准已更新: {args.baseline}")
+        return 0
+
+    if not baseline:
+        print("\n⚠️ 未找到基准文件，使用 --update-baseline 生成")
+        return 0
+
+    regressions = compare_results(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ 发现 {len(regressions)} 项性能回归:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+
+    print(f"\n✅ 没有性能回归（基准机器: {baseline.get('machine', '未知')}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+ComfyUI Popo Utility - 宽高比分桶
+把图片分配到一组固定分辨率的桶中（如SDXL训练和生成常用的1024²面积桶）
+
+桶表按对数宽高比预先排序，分配时用二分查找找到对数比最接近的桶，
+然后计算等比缩放到覆盖目标尺寸的大小和居中裁剪的偏移
+"""
+
+import bisect
+import math
+from typing import Any, List, NamedTuple, Sequence, Tuple
+
+from .base_node import ImageProcessingNode
+from .cache_utils import LRUCache
+from .image_utils import gather_sizes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# SDXL 官方训练分辨率（约1024²像素）
+SDXL_BUCKETS: Tuple[Tuple[int, int], ...] = (
+    (1024, 1024),
+    (1152, 896), (896, 1152),
+    (1216, 832), (832, 1216),
+    (1344, 768), (768, 1344),
+    (1536, 640), (640, 1536),
+)
+
+# 预设桶表：名称 -> 面积，sdxl 使用上面的固定列表，custom 解析用户输入的列表
+BUCKET_PRESETS = {
+    "sdxl": None,
+    "area_1024": 1024 * 1024,
+    "area_768": 768 * 768,
+    "area_512": 512 * 512,
+    "custom": None,
+}
+
+# 生成面积桶时允许的最大长宽比
+MAX_BUCKET_RATIO = 4.0
+
+# 超过这个数量时使用numpy批量二分查找
+VECTORIZE_MIN_ITEMS = 64
+
+
+class BucketAssignment(NamedTuple):
+    """
+    一张图片的分桶结果
+    先把图片等比缩放到 (resize_width, resize_height)，再从 (crop_x, crop_y) 裁剪出桶尺寸
+    """
+
+    bucket_id: int
+    width: int
+    height: int
+    resize_width: int
+    resize_height: int
+    crop_x: int
+    crop_y: int
+
+
+def generate_area_buckets(area: int, step: int = 64, max_ratio: float = MAX_BUCKET_RATIO) -> List[Tuple[int, int]]:
+    """
+    生成面积不超过area、边长为step倍数的桶
+    对每个短边取不超过面积的最大长边，横竖两个方向对称；长宽比超过max_ratio的桶被排除
+    """
+    if area <= 0 or step <= 0:
+        raise ValueError(f"面积和步长必须为正数: area={area}, step={step}")
+    side = int(math.isqrt(area) // step * step)
+    if side < step:
+        raise ValueError(f"面积 {area} 小于一个步长的正方形")
+    buckets = {(side, side)}
+    short = step
+    while short < side:
+        long = area // short // step * step
+        if long / short <= max_ratio:
+            buckets.update(((long, short), (short, long)))
+        short += step
+    return sorted(buckets, key=lambda bucket: (bucket[0] / bucket[1], bucket[0]))
+
+
+def parse_bucket_list(text: str) -> List[Tuple[int, int]]:
+    """解析 "1024x1024, 1152x896" 形式的桶列表，支持逗号、分号和换行分隔"""
+    buckets = []
+    for item in text.replace(";", ",").replace("\n", ",").split(","):
+        item = item.strip().lower().replace("×", "x").replace("*", "x")
+        if not item:
+            continue
+        try:
+            width, height = (int(part) for part in item.split("x"))
+        except ValueError:
+            raise ValueError(f"无效的桶尺寸: {item!r}，格式应为 宽x高") from None
+        if width <= 0 or height <= 0:
+            raise ValueError(f"桶尺寸必须为正数: {item!r}")
+        buckets.append((width, height))
+    if not buckets:
+        raise ValueError("桶列表为空")
+    return buckets
+
+
+class BucketTable:
+    """
+    按对数宽高比排序的桶表
+
+    Args:
+        buckets: [(宽, 高), ...]，bucket_id 为桶在这个列表中的位置
+    """
+
+    def __init__(self, buckets: Sequence[Tuple[int, int]]):
+        if not buckets:
+            raise ValueError("桶列表为空")
+        self.buckets = [(int(width), int(height)) for width, height in buckets]
+        order = sorted(range(len(self.buckets)), key=lambda i: math.log(self.buckets[i][0] / self.buckets[i][1]))
+        self._order = order
+        self._log_ratios = [math.log(self.buckets[i][0] / self.buckets[i][1]) for i in order]
+        # 相邻两个桶对数比的中点，落在第k个中点之前的宽高比属于第k个桶
+        self._edges = [(a + b) / 2 for a, b in zip(self._log_ratios, self._log_ratios[1:])]
+        if np is not None:
+            self._np_edges = np.asarray(self._edges, dtype=np.float64)
+            self._np_order = np.asarray(order, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    def find(self, width: int, height: int) -> int:
+        """返回对数宽高比最接近的桶的bucket_id"""
+        if width <= 0 or height <= 0:
+            raise ValueError(f"图片尺寸必须为正数: {width}x{height}")
+        return self._order[bisect.bisect_left(self._edges, math.log(width / height))]
+
+    def _assignment(self, bucket_id: int, width: int, height: int) -> BucketAssignment:
+        target_width, target_height = self.buckets[bucket_id]
+        # 等比缩放到恰好覆盖桶尺寸，多出的部分居中裁剪
+        scale = max(target_width / width, target_height / height)
+        resize_width = max(target_width, round(width * scale))
+        resize_height = max(target_height, round(height * scale))
+        return BucketAssignment(
+            bucket_id,
+            target_width,
+            target_height,
+            resize_width,
+            resize_height,
+            (resize_width - target_width) // 2,
+            (resize_height - target_height) // 2,
+        )
+
+    def assign(self, width: int, height: int) -> BucketAssignment:
+        """为单张图片分桶"""
+        return self._assignment(self.find(width, height), width, height)
+
+    def assign_many(self, sizes: Sequence[Tuple[int, int]]) -> List[BucketAssignment]:
+        """
+        批量分桶，数量较多时用numpy一次完成所有二分查找
+        尺寸无效（宽或高不为正）的项抛出ValueError
+        """
+        sizes = [(int(width), int(height)) for width, height in sizes]
+        if any(width <= 0 or height <= 0 for width, height in sizes):
+            raise ValueError("图片尺寸必须为正数")
+        if np is None or len(sizes) < VECTORIZE_MIN_ITEMS:
+            return [self.assign(width, height) for width, height in sizes]
+
+        dims = np.asarray(sizes, dtype=np.float64)
+        positions = np.searchsorted(self._np_edges, np.log(dims[:, 0] / dims[:, 1]), side="left")
+        bucket_ids = self._np_order[positions].tolist()
+        # 同一尺寸只计算一次缩放和裁剪
+        memo = {}
+        results = []
+        for bucket_id, size in zip(bucket_ids, sizes):
+            key = (bucket_id, size)
+            assignment = memo.get(key)
+            if assignment is None:
+                assignment = memo[key] = self._assignment(bucket_id, *size)
+            results.append(assignment)
+        return results
+
+
+_tables = LRUCache(32)
+
+
+def get_bucket_table(preset: str = "sdxl", custom_buckets: str = "", step: int = 64) -> BucketTable:
+    """
+    获取预设或自定义的桶表，相同参数的桶表只构建一次
+
+    Args:
+        preset: BUCKET_PRESETS 中的名称
+        custom_buckets: preset 为 "custom" 时的桶列表文本
+        step: 面积预设的边长步长
+    """
+    if preset not in BUCKET_PRESETS:
+        raise ValueError(f"未知的桶预设: {preset}")
+    key = (preset, custom_buckets if preset == "custom" else "", step)
+
+    def build() -> BucketTable:
+        if preset == "sdxl":
+            return BucketTable(SDXL_BUCKETS)
+        if preset == "custom":
+            return BucketTable(parse_bucket_list(custom_buckets))
+        return BucketTable(generate_area_buckets(BUCKET_PRESETS[preset], step))
+
+    return _tables.get_or_create(key, build)
+
+
+def _first(value: Any, default: Any) -> Any:
+    """INPUT_IS_LIST 时标量输入以单元素列表传入"""
+    if isinstance(value, list):
+        return value[0] if value else default
+    return value
+
+
+class AspectBucketNode(ImageProcessingNode):
+    """
+    宽高比分桶节点
+    一次为整个图片列表（或宽高列表）分配分辨率桶，输出目标尺寸、缩放尺寸和裁剪偏移
+    """
+
+    DESCRIPTION = "按宽高比把图片分配到分辨率桶（SDXL、面积桶或自定义列表），输出目标尺寸和裁剪参数"
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("bucket_id", "width", "height", "resize_width", "resize_height", "crop_x", "crop_y")
+    FUNCTION = "assign_buckets"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True,) * 7
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "preset": (list(BUCKET_PRESETS), {"default": "sdxl"}),
+                "step": ("INT", {"default": 64, "min": 8, "max": 512, "step": 8}),
+                "custom_buckets": ("STRING", {"default": "1024x1024, 1152x896, 896x1152", "multiline": True}),
+            },
+            "optional": {
+                "image": ("IMAGE",),
+                "widths": ("INT", {"forceInput": True}),
+                "heights": ("INT", {"forceInput": True}),
+            }
+        }
+
+    def assign_buckets(self, preset, step, custom_buckets, image=None, widths=None, heights=None):
+        """
+        为每张图片分配桶
+
+        Returns:
+            tuple: 与输入一一对应的 (桶ID, 桶宽, 桶高, 缩放宽, 缩放高, 裁剪X, 裁剪Y) 七个列表
+        """
+        try:
+            table = get_bucket_table(_first(preset, "sdxl"), _first(custom_buckets, ""), _first(step, 64))
+            assignments = table.assign_many(gather_sizes(image, widths, heights))
+            return tuple(list(column) for column in zip(*assignments)) or ([],) * 7
+
+        except Exception as e:
+            self.log_error(e, "assign_buckets")
+            return ([0], [0], [0], [0], [0], [0], [0])
+
+
+NODE_CLASSES = [
+    AspectBucketNode,
+]
@@ -0,0 +1,146 @@
+"""
+ComfyUI Popo Utility - 宽高比命名
+为任意宽高找到误差容许范围内最简单的整数比（Stern–Brocot树上的最简分数），
+代替固定的常见比例表，相近的比例（如16:10和3:2）不会被混淆
+
+结果按 (宽, 高, 分母上限, 误差) 缓存，大量重复尺寸的图片列表每次查询都是常数时间
+"""
+
+import math
+from fractions import Fraction
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from .cache_utils import LRUCache
+
+
+# 分母（较小一项）的默认上限，超出时改用小数表示
+DEFAULT_MAX_DENOMINATOR = 10
+
+# 默认允许的相对误差
+DEFAULT_TOLERANCE = 0.01
+
+# 常见比例，误差范围内优先匹配，即使范围内存在更简单的整数比（如 1920x1088 命名为16:9而不是7:4）
+COMMON_RATIOS: Tuple[Tuple[int, int], ...] = (
+    (1, 1), (5, 4), (4, 3), (3, 2), (8, 5), (16, 9), (2, 1), (7, 3), (32, 9),
+    (4, 5), (3, 4), (2, 3), (5, 8), (9, 16), (1, 2), (3, 7), (9, 32),
+)
+
+# 习惯上不约分的写法
+DISPLAY_ALIASES: Dict[Tuple[int, int], Tuple[int, int]] = {
+    (8, 5): (16, 10),
+    (5, 8): (10, 16),
+    (7, 3): (21, 9),
+    (3, 7): (9, 21),
+}
+
+
+class RatioInfo(NamedTuple):
+    """
+    宽高比的近似结果
+    numerator:denominator 为显示用的整数比，error 为它与实际比例的相对误差；
+    rational 为False时表示没有找到足够简单的整数比，此时只有 value 有意义
+    """
+
+    numerator: int
+    denominator: int
+    value: float
+    error: float
+    rational: bool
+
+    @property
+    def text(self) -> str:
+        """整数比如 16:9，没有简单整数比时为 2.45:1 或 1:2.45"""
+        if self.rational:
+            return f"{self.numerator}:{self.denominator}"
+        if self.value >= 1:
+            return f"{self.value:.2f}:1"
+        return f"1:{1 / self.value:.2f}"
+
+
+def simplest_between(low: Fraction, high: Fraction) -> Fraction:
+    """
+    闭区间 [low, high]（0 < low <= high）中分母最小的分数
+    按连分数逐项展开，等价于在Stern–Brocot树上从根向下查找
+    """
+    integer = math.ceil(low)
+    if integer <= high:
+        return Fraction(integer)
+    floor = math.floor(low)
+    # low 和 high 位于同一个整数区间 (floor, floor+1) 内，对小数部分取倒数继续展开
+    return floor + 1 / simplest_between(1 / (high - floor), 1 / (low - floor))
+
+
+def _approximate(width: int, height: int, max_denominator: int, tolerance: float) -> RatioInfo:
+    ratio = Fraction(width, height)
+    value = width / height
+    if min(ratio.numerator, ratio.denominator) <= max_denominator or tolerance == 0:
+        # 精确比例本身足够简单时直接使用，如 1:1000 不会被近似成 1:991
+        best = ratio
+    else:
+        log_value = math.log(value)
+        nearest = min(COMMON_RATIOS, key=lambda common: abs(math.log(common[0] / common[1]) - log_value))
+        if abs(nearest[0] / nearest[1] / value - 1) <= tolerance:
+            best = Fraction(*nearest)
+        else:
+            best = simplest_between(ratio * Fraction(1 - tolerance), ratio * Fraction(1 + tolerance))
+    # 上限作用于较小的一项，横竖屏一致
+    if min(best.numerator, best.denominator) > max_denominator:
+        return RatioInfo(0, 0, value, 0.0, False)
+    numerator, denominator = DISPLAY_ALIASES.get((best.numerator, best.denominator), (best.numerator, best.denominator))
+    return RatioInfo(numerator, denominator, value, abs(float(best) / value - 1), True)
+
+
+_ratio_cache = LRUCache(4096)
+
+
+def describe_ratio(
+    width: int,
+    height: int,
+    max_denominator: int = DEFAULT_MAX_DENOMINATOR,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> RatioInfo:
+    """
+    找到宽高比在相对误差tolerance内最简单的整数比
+
+    Args:
+        width, height: 图片尺寸，必须为正数
+        max_denominator: 整数比中较小一项的上限
+        tolerance: 允许的相对误差，0表示只接受精确的比例
+
+    Raises:
+        ValueError: 尺寸不为正数或参数无效
+    """
+    width, height = int(width), int(height)
+    if width <= 0 or height <= 0:
+        raise ValueError(f"图片尺寸必须为正数: {width}x{height}")
+    if max_denominator < 1 or not 0 <= tolerance < 1:
+        raise ValueError(f"参数无效: max_denominator={max_denominator}, tolerance={tolerance}")
+    # 按约分后的比例缓存，1920x1080 和 3840x2160 共用同一条目
+    divisor = math.gcd(width, height)
+    key = (width // divisor, height // divisor, int(max_denominator), float(tolerance))
+    return _ratio_cache.get_or_create(key, lambda: _approximate(key[0], key[1], key[2], key[3]))
+
+
+def format_ratio_name(
+    width: int,
+    height: int,
+    labels: Dict[str, str],
+    orientation: Tuple[str, str, str],
+    template: str = "{ratio} {label}",
+    max_denominator: int = DEFAULT_MAX_DENOMINATOR,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> str:
+    """
+    生成比例名称，如 "16:9 Widescreen"
+
+    Args:
+        labels: 常见比例的说明，键为 "16:9" 形式的比例
+        orientation: 没有说明时使用的 (横屏, 竖屏, 正方形) 文字
+        template: 名称格式，可用 {ratio} 和 {label}
+    """
+    info = describe_ratio(width, height, max_denominator, tolerance)
+    label: Optional[str] = labels.get(info.text) if info.rational else None
+    if label is None:
+        landscape, portrait, square = orientation
+        label = landscape if width > height else portrait if width < height else square
+    return template.format(ratio=info.text, label=label)
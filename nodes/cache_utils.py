@@ -0,0 +1,214 @@
+"""
+ComfyUI Popo Utility - 缓存工具
+为节点提供有界的LRU缓存、结果记忆化和稳定的输入指纹
+"""
+
+import functools
+import hashlib
+import math
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    线程安全的有界LRU缓存
+    记录命中/未命中次数，超出容量时淘汰最久未使用的条目
+    """
+
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 0:
+            raise ValueError(f"缓存容量不能为负数: {maxsize}")
+        self._maxsize = int(maxsize)
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        _instances.add(self)
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """查找条目，命中时将其移到最近使用位置"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """写入条目，必要时淘汰最旧的条目"""
+        if self._maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        查找条目，未命中时调用factory创建并写入
+        factory抛出的异常不会被缓存
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def resize(self, maxsize: int) -> None:
+        """调整缓存容量，缩容时立即淘汰多余条目"""
+        if maxsize < 0:
+            raise ValueError(f"缓存容量不能为负数: {maxsize}")
+        with self._lock:
+            self._maxsize = int(maxsize)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self, reset_stats: bool = True) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+            if reset_stats:
+                self.hits = 0
+                self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self._maxsize,
+            "hit_rate": (self.hits / total) if total else None,
+        }
+
+
+# 所有缓存实例，fork后在子进程中重建锁
+_instances: "weakref.WeakSet[LRUCache]" = weakref.WeakSet()
+
+
+def _reinit_locks_after_fork() -> None:
+    # fork时其他线程可能正持有锁，子进程中的锁永远不会被释放
+    for cache in list(_instances):
+        cache._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_locks_after_fork)
+
+
+def make_fingerprint(*parts: Any) -> str:
+    """
+    根据若干值生成稳定的指纹字符串，可用作 IS_CHANGED 的返回值
+    只依赖值的repr，跨进程、跨运行保持一致
+    """
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def shape_key(value: Any) -> Optional[Tuple[int, ...]]:
+    """读取张量或数组的形状作为缓存键，只访问元数据，不读取像素数据"""
+    shape = getattr(value, "shape", None)
+    if shape is None:
+        return None
+    try:
+        return tuple(int(dim) for dim in shape)
+    except (TypeError, ValueError):
+        return None
+
+
+def shape_fingerprint(value: Any) -> str:
+    """基于形状的指纹，用于只依赖图片尺寸的节点"""
+    return make_fingerprint(shape_key(value))
+
+
+def memoize_by_shape(cache: LRUCache) -> Callable:
+    """
+    按第一个参数的形状记忆化节点方法的结果
+    只适用于输出完全由输入形状决定的方法（如尺寸类节点）
+    """
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self: Any, image: Any, *args: Any, **kwargs: Any) -> Any:
+            shape = shape_key(image)
+            if shape is None:
+                return method(self, image, *args, **kwargs)
+            key = (type(self).__name__, method.__name__, shape, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_create(key, lambda: method(self, image, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+# 快速模式在每张图片上均匀抽取的网格边长（行、列各取这么多个位置）
+FINGERPRINT_GRID = 64
+
+# 精确模式每次送入哈希的最大字节数
+FINGERPRINT_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def _tensor_bytes(value: Any) -> memoryview:
+    """把张量或数组的一段连续数据以字节形式取出，连续的CPU张量不复制"""
+    if hasattr(value, "detach"):
+        import torch
+
+        value = value.detach().contiguous()
+        flat = value.reshape(-1)
+        if flat.dtype != torch.uint8:
+            flat = flat.view(torch.uint8)
+        return memoryview(flat.cpu().numpy())
+    import numpy as np
+
+    return memoryview(np.ascontiguousarray(value)).cast("B")
+
+
+def content_fingerprint(value: Any, exact: bool = False, grid: int = FINGERPRINT_GRID) -> str:
+    """
+    基于张量内容的指纹，形状和数据类型也计入哈希
+
+    Args:
+        value: 张量或数组，第一维以后按 [H, W, ...] 处理
+        exact: False时只哈希均匀抽样的 grid×grid 个位置（快速，用于缓存键和去重初筛）；
+               True时按行块流式哈希全部数据，每次只取出一块，不复制整张图片
+        grid: 快速模式的抽样网格边长
+    """
+    shape = shape_key(value)
+    if shape is None:
+        return make_fingerprint(value)
+    hasher = hashlib.blake2b(digest_size=16)
+    # numpy数组和torch张量的数据类型名称统一为 "float32" 形式
+    dtype = str(value.dtype).replace("torch.", "")
+    hasher.update(repr((shape, dtype, exact)).encode("utf-8"))
+    if 0 in shape:
+        return hasher.hexdigest()
+
+    if len(shape) < 2:
+        # 标量和一维数据直接完整哈希
+        hasher.update(_tensor_bytes(value))
+        return hasher.hexdigest()
+    if not exact:
+        hasher.update(_tensor_bytes(value[::max(1, shape[0] // grid), ::max(1, shape[1] // grid)]))
+        return hasher.hexdigest()
+
+    itemsize = value.element_size() if hasattr(value, "element_size") else value.itemsize
+    rows = max(1, FINGERPRINT_CHUNK_BYTES // (math.prod(shape[1:]) * itemsize))
+    for top in range(0, shape[0], rows):
+        hasher.update(_tensor_bytes(value[top:top + rows]))
+    return hasher.hexdigest()
@@ -0,0 +1,263 @@
+"""
+ComfyUI Popo Utility - 内容边界框 / 自动裁剪
+找出每张图片中与背景色不同（或alpha不透明）区域的最小边界框，用于放大前裁掉透明或纯色边框
+
+整个批次一起做行、列方向的最小/最大值归约，不逐像素循环，也不生成与图片同样大小的中间张量；裁剪结果是原张量的切片视图，不复制像素
+"""
+
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import torch
+
+from .base_node import ImageProcessingNode
+
+
+# 背景判定方式：auto 取左上角像素为背景色，color 使用指定颜色，alpha 按透明度
+BACKGROUND_MODES = ("auto", "color", "alpha")
+
+# 按行归约时每块包含的像素数
+ROW_BLOCK = 32
+
+
+class BoundingBoxes(NamedTuple):
+    """每张图片的内容边界框，每个字段是与批次一一对应的列表；没有内容的图片为整张图片"""
+
+    x: List[int]
+    y: List[int]
+    width: List[int]
+    height: List[int]
+    has_content: List[bool]
+
+
+def parse_color(text: str, channels: int = 3) -> Tuple[float, ...]:
+    """
+    解析 "#RRGGBB" / "#RGB" 十六进制颜色或 "r, g, b" 形式的0-1数值，返回0-1范围的元组
+
+    Raises:
+        ValueError: 格式无效
+    """
+    text = text.strip()
+    if text.startswith("#"):
+        digits = text[1:]
+        if len(digits) == 3:
+            digits = "".join(ch * 2 for ch in digits)
+        try:
+            if len(digits) != 6:
+                raise ValueError
+            values = tuple(int(digits[i:i + 2], 16) / 255 for i in (0, 2, 4))
+        except ValueError:
+            raise ValueError(f"无效的颜色: {text!r}") from None
+    else:
+        try:
+            values = tuple(float(part) for part in text.split(","))
+        except ValueError:
+            raise ValueError(f"无效的颜色: {text!r}") from None
+        if len(values) == 1:
+            values = values * 3
+        if len(values) != 3:
+            raise ValueError(f"颜色需要3个分量: {text!r}")
+    return values[:channels] + (values[-1],) * max(0, channels - len(values))
+
+
+def _row_extrema(images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    每张图片每一行、每个通道的 (最小值, 最大值)：[B, H, C]
+
+    直接沿宽度方向归约时最内层只有C个连续元素，非常慢；把每行按 ROW_BLOCK 个像素分块后
+    先跨块归约（最内层为 ROW_BLOCK*C 个连续元素），再归约块内的 ROW_BLOCK 个位置
+    """
+    batch, height, width, channels = images.shape
+    blocks = width // ROW_BLOCK
+    lows, highs = [], []
+    if blocks:
+        flat = images.reshape(batch, height, width * channels)
+        body = flat[..., :blocks * ROW_BLOCK * channels].unflatten(2, (blocks, ROW_BLOCK * channels))
+        lows.append(body.amin(dim=2).view(batch, height, ROW_BLOCK, channels))
+        highs.append(body.amax(dim=2).view(batch, height, ROW_BLOCK, channels))
+    tail = images[:, :, blocks * ROW_BLOCK:]
+    if tail.shape[2]:
+        lows.append(tail)
+        highs.append(tail)
+    return torch.cat(lows, dim=2).amin(dim=2), torch.cat(highs, dim=2).amax(dim=2)
+
+
+def _content_profiles(
+    images: torch.Tensor,
+    mode: str,
+    background: Tuple[float, ...],
+    threshold: float,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    返回每张图片每一行、每一列是否包含内容：([B, H], [B, W]) 布尔张量
+
+    |像素 - 背景| > threshold 等价于 像素 > 背景 + threshold 或 像素 < 背景 - threshold，
+    所以只需求出每行、每列各通道的最小/最大值再与背景比较，不生成与图片同样大小的中间张量
+    """
+    channels = images.shape[3]
+    if mode == "alpha" and channels < 4:
+        raise ValueError(f"图片没有alpha通道: {channels} 个通道")
+    row_low, row_high = _row_extrema(images)
+    col_low, col_high = images.amin(dim=1), images.amax(dim=1)
+
+    if mode == "alpha":
+        return row_high[..., 3] > threshold, col_high[..., 3] > threshold
+
+    # 只比较颜色通道，RGBA图片的alpha通道不参与
+    color = min(channels, 3)
+    if mode == "auto":
+        reference = images[:, 0, 0, :color].unsqueeze(1)
+    else:
+        reference = torch.tensor(background[:color], dtype=images.dtype, device=images.device)
+    upper, lower = reference + threshold, reference - threshold
+
+    def content(low: torch.Tensor, high: torch.Tensor) -> torch.Tensor:
+        return ((high[..., :color] > upper) | (low[..., :color] < lower)).any(dim=-1)
+
+    return content(row_low, row_high), content(col_low, col_high)
+
+
+def _first_true(flags: torch.Tensor) -> torch.Tensor:
+    # argmax 返回第一个最大值的下标
+    return flags.to(torch.uint8).argmax(dim=1)
+
+
+def find_content_bboxes(
+    images: Any,
+    mode: str = "auto",
+    background: str = "#000000",
+    threshold: float = 0.02,
+    padding: int = 0,
+) -> BoundingBoxes:
+    """
+    计算批次中每张图片的内容边界框
+
+    Args:
+        images: [B, H, W, C] 或 [H, W, C] 张量
+        mode: BACKGROUND_MODES 之一
+        background: mode 为 "color" 时的背景色，见 parse_color
+        threshold: 任一颜色通道与背景相差（或alpha）超过该值的像素视为内容
+        padding: 边界框向四周扩展的像素数，不超出图片范围
+
+    Raises:
+        ValueError: 参数无效、形状不支持或alpha模式下没有alpha通道
+    """
+    if mode not in BACKGROUND_MODES:
+        raise ValueError(f"未知的背景判定方式: {mode}")
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    if images.dim() != 4:
+        raise ValueError(f"不支持的图片形状: {tuple(images.shape)}")
+    _, height, width, _ = images.shape
+    color = parse_color(background) if mode == "color" else ()
+
+    rows, cols = _content_profiles(images, mode, color, threshold)
+    has_content = rows.any(dim=1)
+    top = _first_true(rows)
+    bottom = height - _first_true(rows.flip(1))
+    left = _first_true(cols)
+    right = width - _first_true(cols.flip(1))
+
+    # 没有内容的图片使用整张图片
+    padding = max(int(padding), 0)
+    top = torch.where(has_content, (top - padding).clamp_min(0), 0)
+    left = torch.where(has_content, (left - padding).clamp_min(0), 0)
+    bottom = torch.where(has_content, (bottom + padding).clamp_max(height), height)
+    right = torch.where(has_content, (right + padding).clamp_max(width), width)
+
+    # 一次取回所有结果，GPU上只同步一次
+    top, left, bottom, right, flags = torch.stack(
+        [top, left, bottom, right, has_content.to(top.dtype)]
+    ).cpu().tolist()
+    return BoundingBoxes(
+        left,
+        top,
+        [r - l for l, r in zip(left, right)],
+        [b - t for t, b in zip(top, bottom)],
+        [bool(flag) for flag in flags],
+    )
+
+
+def crop_views(images: torch.Tensor, boxes: BoundingBoxes) -> List[torch.Tensor]:
+    """按边界框裁剪，每张图片返回一个 [1, h, w, C] 切片视图（与原张量共享内存）"""
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    return [
+        images[b:b + 1, y:y + h, x:x + w]
+        for b, (x, y, w, h) in enumerate(zip(boxes.x, boxes.y, boxes.width, boxes.height))
+    ]
+
+
+def union_box(boxes: BoundingBoxes) -> Tuple[int, int, int, int]:
+    """包含所有图片内容的最小边界框 (x, y, 宽, 高)，只考虑有内容的图片"""
+    indices = [i for i, flag in enumerate(boxes.has_content) if flag] or list(range(len(boxes.x)))
+    left = min(boxes.x[i] for i in indices)
+    top = min(boxes.y[i] for i in indices)
+    right = max(boxes.x[i] + boxes.width[i] for i in indices)
+    bottom = max(boxes.y[i] + boxes.height[i] for i in indices)
+    return (left, top, right - left, bottom - top)
+
+
+def autocrop_input_types() -> Dict[str, Dict[str, tuple]]:
+    """自动裁剪节点的输入定义，两套节点共用"""
+    return {
+        "required": {
+            "image": ("IMAGE",),
+            "mode": (list(BACKGROUND_MODES), {"default": "auto"}),
+            "threshold": ("FLOAT", {"default": 0.02, "min": 0.0, "max": 1.0, "step": 0.005}),
+            "padding": ("INT", {"default": 0, "min": 0, "max": 4096}),
+        },
+        "optional": {
+            "background": ("STRING", {"default": "#000000"}),
+        }
+    }
+
+
+def autocrop_outputs(image: Any, mode: str, threshold: float, padding: int, background: str = "#000000") -> tuple:
+    """自动裁剪节点的输出：(逐张裁剪列表, 按并集裁剪的批次, x, y, 宽, 高)"""
+    boxes = find_content_bboxes(image, mode, background, threshold, padding)
+    batch = image if image.dim() == 4 else image.unsqueeze(0)
+    x, y, width, height = union_box(boxes)
+    return (
+        crop_views(batch, boxes),
+        batch[:, y:y + height, x:x + width],
+        boxes.x,
+        boxes.y,
+        boxes.width,
+        boxes.height,
+    )
+
+
+class ContentBoundingBoxNode(ImageProcessingNode):
+    """
+    内容边界框 / 自动裁剪节点
+    输出每张图片的内容边界框、逐张裁剪结果和按所有图片内容并集裁剪的批次
+    """
+
+    DESCRIPTION = "按背景色或alpha找出每张图片的内容边界框，输出坐标和不复制像素的裁剪视图"
+    RETURN_TYPES = ("IMAGE", "IMAGE", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("cropped", "cropped_batch", "x", "y", "width", "height")
+    FUNCTION = "autocrop"
+    OUTPUT_IS_LIST = (True, False, True, True, True, True)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return autocrop_input_types()
+
+    def autocrop(self, image, mode, threshold, padding, background="#000000"):
+        """
+        检测内容边界框并裁剪
+
+        Returns:
+            tuple: (逐张裁剪的图片列表, 按并集裁剪的批次, x列表, y列表, 宽度列表, 高度列表)
+        """
+        try:
+            return autocrop_outputs(image, mode, threshold, padding, background)
+
+        except Exception as e:
+            self.log_error(e, "autocrop")
+            return ([image], image, [0], [0], [0], [0])
+
+
+NODE_CLASSES = [
+    ContentBoundingBoxNode,
+]
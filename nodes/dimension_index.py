@@ -0,0 +1,395 @@
+"""
+ComfyUI Popo Utility - 图片目录尺寸索引
+用线程池探测目录中图片的文件头尺寸，结果保存在磁盘上的SQLite索引中
+
+再次扫描时只重新探测修改时间或大小发生变化的文件，删除的文件从索引中移除，
+几十万张图片的目录在索引建立后重新扫描只需要遍历目录和比较文件状态
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .aspect_ratio import describe_ratio
+from .base_node import ImageProcessingNode
+from .image_probe import ImageProbeError, probe_stream
+from .image_utils import identify_common_ratio
+
+try:
+    import folder_paths  # ComfyUI 提供，用于确定索引文件的默认位置
+except ImportError:
+    folder_paths = None
+
+
+# 参与扫描的文件扩展名
+IMAGE_EXTENSIONS = frozenset((".png", ".jpg", ".jpeg", ".jfif", ".webp", ".gif", ".bmp", ".tif", ".tiff"))
+
+# 索引文件路径，默认位于ComfyUI用户目录（不可用时为 ~/.cache/popo-utility）
+INDEX_PATH = os.environ.get("POPO_DIMENSION_INDEX", "")
+
+# 探测文件头的线程数，读取文件头以等待IO为主，线程数可以超过CPU核数
+DEFAULT_SCAN_WORKERS = int(os.environ.get("POPO_DIMENSION_INDEX_WORKERS", "0")) or min(32, (os.cpu_count() or 1) * 4)
+
+# 每批写入索引的记录数
+WRITE_BATCH = 2000
+
+# 索引结构版本，结构变化时重建索引
+# 2: 比例名称改为按最简整数比生成
+# 3: 只保存与语言无关的 "16:9" 形式，说明文字由各节点在输出时添加
+# 从版本1、2升级时只重新生成比例，不需要重新探测
+SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    format TEXT,
+    ratio_name TEXT,
+    error TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS images_folder ON images (folder);
+"""
+
+
+class ScanResult(NamedTuple):
+    """一次扫描的统计：文件总数、重新探测数、未变化数、移除数、失败数和耗时（秒）"""
+
+    total: int
+    probed: int
+    unchanged: int
+    removed: int
+    failed: int
+    elapsed: float
+
+
+class IndexedImage(NamedTuple):
+    """索引中的一条记录，ratio_name 为 "16:9" 形式的比例（查询时给出 ratio_format 则为其生成的名称）"""
+
+    path: str
+    width: int
+    height: int
+    format: str
+    ratio_name: str
+
+
+def default_index_path() -> str:
+    """索引文件的默认位置"""
+    if INDEX_PATH:
+        return INDEX_PATH
+    if folder_paths is not None and hasattr(folder_paths, "get_user_directory"):
+        return os.path.join(folder_paths.get_user_directory(), "popo-utility", "dimensions.sqlite")
+    return os.path.join(os.path.expanduser("~"), ".cache", "popo-utility", "dimensions.sqlite")
+
+
+def _walk(directory: str, recursive: bool, extensions: frozenset) -> Iterator[Tuple[str, str, int, int]]:
+    """遍历目录，返回 (路径, 所在目录, 大小, 修改时间)；os.scandir 在遍历时复用目录项信息，比逐个stat快得多"""
+    pending = [directory]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not entry.name.startswith("."):
+                            pending.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in extensions:
+                        stat = entry.stat()
+                        yield entry.path, folder, stat.st_size, stat.st_mtime_ns
+                except OSError:
+                    continue
+
+
+def _ratio_text(width: int, height: int) -> str:
+    """索引中保存的比例，如 16:9、1.52:1，不带说明文字"""
+    return describe_ratio(width, height).text
+
+
+def _probe_file(path: str) -> Tuple[int, int, Optional[str], Optional[str]]:
+    """探测单个文件，返回 (宽度, 高度, 格式, 错误信息)"""
+    try:
+        with open(path, "rb") as f:
+            width, height, fmt = probe_stream(f)
+        return width, height, fmt, None
+    except (OSError, ImageProbeError) as e:
+        return 0, 0, None, f"{type(e).__name__}: {e}"
+
+
+class DimensionIndex:
+    """
+    图片尺寸的磁盘索引
+
+    Args:
+        path: SQLite文件路径，默认见 default_index_path；":memory:" 表示只在内存中
+        workers: 探测文件头的线程数
+    """
+
+    def __init__(self, path: Optional[str] = None, workers: int = DEFAULT_SCAN_WORKERS):
+        self.path = path or default_index_path()
+        self.workers = max(int(workers), 1)
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+
+    def _migrate(self) -> None:
+        with self._lock, self._conn:
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version in (1, 2):
+                rows = self._conn.execute("SELECT path, width, height FROM images WHERE error IS NULL").fetchall()
+                self._conn.executemany(
+                    "UPDATE images SET ratio_name = ? WHERE path = ?",
+                    ((_ratio_text(width, height), path) for path, width, height in rows),
+                )
+            elif version != SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS images")
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "DimensionIndex":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _known(self, directory: str, recursive: bool) -> Dict[str, Tuple[int, int]]:
+        """读取目录下已索引文件的 {路径: (大小, 修改时间)}"""
+        if recursive:
+            # 主键上的范围查询，匹配以 "目录/" 开头的所有路径
+            prefix = os.path.join(directory, "")
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns FROM images WHERE path >= ? AND path < ?",
+                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)),
+            )
+        else:
+            rows = self._conn.execute("SELECT path, size, mtime_ns FROM images WHERE folder = ?", (directory,))
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def scan(
+        self,
+        directory: str,
+        recursive: bool = True,
+        extensions: Sequence[str] = IMAGE_EXTENSIONS,
+    ) -> ScanResult:
+        """
+        扫描目录并更新索引，只探测新增或修改时间、大小变化的文件
+
+        Raises:
+            NotADirectoryError: directory 不是目录
+        """
+        started = time.perf_counter()
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if not os.path.isdir(directory):
+            raise NotADirectoryError(f"目录不存在: {directory}")
+        extensions = frozenset(ext.lower() for ext in extensions)
+
+        with self._lock:
+            known = self._known(directory, recursive)
+            changed: List[Tuple[str, str, int, int]] = []
+            total = 0
+            for record in _walk(directory, recursive, extensions):
+                total += 1
+                if known.pop(record[0], None) != (record[2], record[3]):
+                    changed.append(record)
+            # known 中剩下的是已经不存在的文件（不在本次扩展名范围内的保留）
+            removed = [path for path in known if os.path.splitext(path)[1].lower() in extensions]
+
+            failed = 0
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="popo-dimension-scan") as pool:
+                # 分批提交，首次扫描大目录时不会一次创建几十万个任务
+                for start in range(0, len(changed), WRITE_BATCH):
+                    chunk = changed[start:start + WRITE_BATCH]
+                    batch = []
+                    probes = pool.map(_probe_file, [record[0] for record in chunk])
+                    for (path, folder, size, mtime_ns), (width, height, fmt, error) in zip(chunk, probes):
+                        failed += error is not None
+                        ratio_name = _ratio_text(width, height) if error is None else None
+                        batch.append((path, folder, size, mtime_ns, width, height, fmt, ratio_name, error))
+                    self._write(batch)
+
+            if removed:
+                with self._conn:
+                    self._conn.executemany("DELETE FROM images WHERE path = ?", ((path,) for path in removed))
+
+        return ScanResult(total, len(changed), total - len(changed), len(removed), failed, time.perf_counter() - started)
+
+    def _write(self, batch: List[Tuple[Any, ...]]) -> None:
+        if batch:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+
+    def query(
+        self,
+        directory: str,
+        recursive: bool = True,
+        min_width: int = 0,
+        min_height: int = 0,
+        max_width: int = 0,
+        max_height: int = 0,
+        ratio_name: Optional[str] = None,
+        ratio_format: Optional[Callable[[int, int], str]] = None,
+    ) -> List[IndexedImage]:
+        """
+        按尺寸条件查询目录下已索引的图片，按路径排序，探测失败的文件不会返回
+        max_width / max_height 为0表示不限制，ratio_name 按子串匹配
+
+        Args:
+            ratio_format: 由宽高生成比例名称的函数（各节点带自己语言的说明文字），
+                给出时返回记录的 ratio_name 为其生成的名称，ratio_name 筛选也按该名称匹配；
+                默认使用索引中 "16:9" 形式的比例
+        """
+        directory = os.path.abspath(os.path.expanduser(directory))
+        if recursive:
+            prefix = os.path.join(directory, "")
+            clauses = ["path >= ? AND path < ?"]
+            params: List[Any] = [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        else:
+            clauses = ["folder = ?"]
+            params = [directory]
+        clauses.append("error IS NULL AND width >= ? AND height >= ?")
+        params += [min_width, min_height]
+        if max_width > 0:
+            clauses.append("width <= ?")
+            params.append(max_width)
+        if max_height > 0:
+            clauses.append("height <= ?")
+            params.append(max_height)
+        if ratio_name and ratio_format is None:
+            clauses.append("instr(ratio_name, ?) > 0")
+            params.append(ratio_name)
+
+        sql = f"SELECT path, width, height, format, ratio_name FROM images WHERE {' AND '.join(clauses)} ORDER BY path"
+        with self._lock:
+            images = [IndexedImage(*row) for row in self._conn.execute(sql, params)]
+        if ratio_format is not None:
+            images = [image._replace(ratio_name=ratio_format(image.width, image.height)) for image in images]
+            if ratio_name:
+                images = [image for image in images if ratio_name in image.ratio_name]
+        return images
+
+    def errors(self, directory: str) -> List[Tuple[str, str]]:
+        """目录下探测失败的文件及错误信息"""
+        prefix = os.path.join(os.path.abspath(os.path.expanduser(directory)), "")
+        with self._lock:
+            return list(self._conn.execute(
+                "SELECT path, error FROM images WHERE path >= ? AND path < ? AND error IS NOT NULL ORDER BY path",
+                (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)),
+            ))
+
+
+_index: Optional[DimensionIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_dimension_index() -> DimensionIndex:
+    """获取全局索引，首次使用时打开"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DimensionIndex()
+        return _index
+
+
+def scan_and_query(
+    directory: str,
+    recursive: bool = True,
+    min_width: int = 0,
+    min_height: int = 0,
+    max_width: int = 0,
+    max_height: int = 0,
+    ratio_name: str = "",
+    index: Optional[DimensionIndex] = None,
+    ratio_format: Optional[Callable[[int, int], str]] = None,
+) -> Tuple[ScanResult, List[IndexedImage]]:
+    """增量扫描目录后按尺寸条件查询，ratio_format 见 DimensionIndex.query"""
+    index = index or get_dimension_index()
+    result = index.scan(directory, recursive)
+    images = index.query(
+        directory, recursive, min_width, min_height, max_width, max_height, ratio_name or None, ratio_format
+    )
+    return result, images
+
+
+class ImageDirectoryScanNode(ImageProcessingNode):
+    """
+    扫描图片目录并按尺寸筛选的节点
+    使用磁盘索引，重复执行时只探测新增或变化的文件
+    """
+
+    DESCRIPTION = "增量扫描图片目录的文件头尺寸，按宽高和比例筛选，输出路径和尺寸列表"
+    RETURN_TYPES = ("STRING", "INT", "INT", "INT", "STRING")
+    RETURN_NAMES = ("paths", "widths", "heights", "count", "summary")
+    FUNCTION = "scan_directory"
+    OUTPUT_IS_LIST = (True, True, True, False, False)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "directory": ("STRING", {"default": ""}),
+                "recursive": ("BOOLEAN", {"default": True}),
+                "min_width": ("INT", {"default": 0, "min": 0, "max": 65535}),
+                "min_height": ("INT", {"default": 0, "min": 0, "max": 65535}),
+                "max_width": ("INT", {"default": 0, "min": 0, "max": 65535}),
+                "max_height": ("INT", {"default": 0, "min": 0, "max": 65535}),
+            },
+            "optional": {
+                "ratio_name": ("STRING", {"default": ""}),
+            }
+        }
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        """目录内容随时可能变化，每次都执行（增量扫描的开销很小）"""
+        return float("nan")
+
+    def scan_directory(self, directory, recursive, min_width, min_height, max_width, max_height, ratio_name=""):
+        """
+        扫描并筛选目录中的图片
+
+        Returns:
+            tuple: (路径列表, 宽度列表, 高度列表, 数量, 扫描统计)
+        """
+        try:
+            result, images = scan_and_query(
+                directory, recursive, min_width, min_height, max_width, max_height, ratio_name,
+                ratio_format=identify_common_ratio,
+            )
+            summary = (
+                f"{result.total} files, {result.probed} probed, {result.removed} removed, "
+                f"{result.failed} failed, {len(images)} matched in {result.elapsed:.2f}s"
+            )
+            return (
+                [image.path for image in images],
+                [image.width for image in images],
+                [image.height for image in images],
+                len(images),
+                summary,
+            )
+
+        except Exception as e:
+            self.log_error(e, "scan_directory")
+            return ([], [], [], 0, f"error: {e}")
+
+
+NODE_CLASSES = [
+    ImageDirectoryScanNode,
+]
@@ -0,0 +1,273 @@
+"""
+ComfyUI Popo Utility - 分块并行表达式计算
+把向量化表达式编译为基于寄存器的指令序列，按缓存大小的分块在线程池中执行
+
+整数组计算时每个运算符都会产生一份完整大小的临时数组；
+分块执行时每个线程只持有几份分块大小的暂存缓冲区，ufunc通过 out= 直接写入，
+临时数据始终留在CPU缓存中，NumPy在ufunc内部释放GIL，多个分块可以真正并行
+"""
+
+import ast
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .cache_utils import LRUCache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# 每个分块的元素数（16K个float64约128KB，适合L2缓存）
+BLOCK_ELEMENTS = int(os.environ.get("POPO_EXPRESSION_BLOCK_ELEMENTS", str(1 << 14)))
+
+# 输入长度达到该值时才使用分块计算，较短的数组整体计算更快
+PARALLEL_MIN_ELEMENTS = int(os.environ.get("POPO_EXPRESSION_PARALLEL_MIN", str(1 << 17)))
+
+# 线程数，默认等于CPU核心数
+DEFAULT_THREADS = int(os.environ.get("POPO_EXPRESSION_THREADS", "0")) or (os.cpu_count() or 1)
+
+_BINARY_UFUNCS = {
+    ast.Add: "add",
+    ast.Sub: "subtract",
+    ast.Mult: "multiply",
+    ast.Div: "true_divide",
+    ast.FloorDiv: "floor_divide",
+    ast.Mod: "mod",
+    ast.Pow: "power",
+}
+
+_COMPARE_UFUNCS = {
+    ast.Eq: "equal",
+    ast.NotEq: "not_equal",
+    ast.Lt: "less",
+    ast.LtE: "less_equal",
+    ast.Gt: "greater",
+    ast.GtE: "greater_equal",
+}
+
+# 操作数: ("in", 输入序号) / ("const", 值) / ("reg", 寄存器序号)
+Operand = Tuple[str, Any]
+
+
+class BlockProgram:
+    """
+    寄存器式指令序列
+    每条指令为 (函数, 参数操作数, 关键字参数操作数, 输出寄存器, 是否ufunc)，
+    ufunc直接写入输出寄存器，其他函数的结果复制到输出寄存器
+    """
+
+    __slots__ = ("instructions", "result", "registers")
+
+    def __init__(self, instructions: List[Tuple[Any, ...]], result: Operand, registers: int):
+        self.instructions = instructions
+        self.result = result
+        self.registers = registers
+
+
+class _ProgramBuilder:
+    """按Python求值顺序遍历向量化语法树，生成指令并分配寄存器"""
+
+    def __init__(self, namespace: Dict[str, Any], variables: Tuple[str, ...]):
+        self.namespace = namespace
+        self.variables = variables
+        self.bindings: Dict[str, Operand] = {}
+        self.instructions: List[List[Any]] = []
+
+    def _push(self, fn: Any, args: List[Operand], kwargs: List[Tuple[str, Operand]], ufunc: bool) -> Operand:
+        self.instructions.append([fn, args, kwargs, len(self.instructions), ufunc])
+        return ("reg", len(self.instructions) - 1)
+
+    def emit(self, node: ast.AST) -> Operand:
+        if isinstance(node, ast.Expression):
+            return self.emit(node.body)
+        if isinstance(node, ast.Constant):
+            return ("const", node.value)
+        if isinstance(node, ast.Name):
+            if node.id in self.bindings:
+                return self.bindings[node.id]
+            if node.id in self.variables:
+                return ("in", self.variables.index(node.id))
+            value = self.namespace.get(node.id)
+            if value is not None and not callable(value):
+                return ("const", value)
+            raise ValueError(f"无法分块计算的名称: {node.id}")
+        if isinstance(node, ast.NamedExpr):
+            operand = self.emit(node.value)
+            self.bindings[node.target.id] = operand
+            return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_UFUNCS:
+            args = [self.emit(node.left), self.emit(node.right)]
+            return self._push(getattr(np, _BINARY_UFUNCS[type(node.op)]), args, [], True)
+        if isinstance(node, ast.UnaryOp):
+            operand = self.emit(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if isinstance(node.op, ast.USub):
+                return self._push(np.negative, [operand], [], True)
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _COMPARE_UFUNCS:
+            args = [self.emit(node.left), self.emit(node.comparators[0])]
+            return self._push(getattr(np, _COMPARE_UFUNCS[type(node.ops[0])]), args, [], True)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            fn = self.namespace.get(node.func.id)
+            if fn is None or not callable(fn):
+                raise ValueError(f"无法分块计算的函数: {node.func.id}")
+            args = [self.emit(arg) for arg in node.args]
+            kwargs = [(keyword.arg, self.emit(keyword.value)) for keyword in node.keywords]
+            ufunc = isinstance(fn, np.ufunc) and not kwargs and fn.nin == len(args) and fn.nout == 1
+            return self._push(fn, args, kwargs, ufunc)
+        raise ValueError(f"无法分块计算的语法: {type(node).__name__}")
+
+    def build(self, tree: ast.AST) -> BlockProgram:
+        result = self.emit(tree)
+
+        # 记录每个中间结果最后一次被读取的位置，用于寄存器复用
+        last_use: Dict[int, int] = {}
+        for index, (_, args, kwargs, _, _) in enumerate(self.instructions):
+            for kind, value in list(args) + [operand for _, operand in kwargs]:
+                if kind == "reg":
+                    last_use[value] = index
+        if result[0] == "reg":
+            last_use[result[1]] = len(self.instructions)
+
+        # 线性扫描分配：输入在本条指令之后不再使用时，其寄存器可以直接作为输出
+        mapping: Dict[int, int] = {}
+        free: List[int] = []
+        registers = 0
+        for index, instruction in enumerate(self.instructions):
+            _, args, kwargs, virtual, _ = instruction
+            operands = list(args) + [operand for _, operand in kwargs]
+            instruction[1] = [self._remap(operand, mapping) for operand in args]
+            instruction[2] = [(name, self._remap(operand, mapping)) for name, operand in kwargs]
+            for kind, value in operands:
+                if kind == "reg" and last_use.get(value) == index and mapping[value] not in free:
+                    free.append(mapping[value])
+            if free:
+                mapping[virtual] = free.pop()
+            else:
+                mapping[virtual] = registers
+                registers += 1
+            instruction[3] = mapping[virtual]
+
+        instructions = [tuple(instruction) for instruction in self.instructions]
+        return BlockProgram(instructions, self._remap(result, mapping), registers)
+
+    @staticmethod
+    def _remap(operand: Operand, mapping: Dict[int, int]) -> Operand:
+        return ("reg", mapping[operand[1]]) if operand[0] == "reg" else operand
+
+
+_program_cache = LRUCache(128)
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_threads = DEFAULT_THREADS
+
+
+def compile_block_program(
+    key: Any, tree: ast.AST, namespace: Dict[str, Any], variables: Tuple[str, ...]
+) -> Optional[BlockProgram]:
+    """
+    把向量化语法树编译为分块指令序列，结果按key缓存
+    包含无法分块的语法时返回None，调用方应退回整体计算
+    """
+    if np is None:
+        return None
+
+    def build() -> Optional[BlockProgram]:
+        try:
+            return _ProgramBuilder(namespace, tuple(variables)).build(tree)
+        except ValueError:
+            return None
+
+    return _program_cache.get_or_create(key, build)
+
+
+def configure_threads(threads: int) -> None:
+    """设置分块计算的线程数，0表示使用CPU核心数"""
+    global _executor, _threads
+    with _executor_lock:
+        _threads = int(threads) or (os.cpu_count() or 1)
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_threads, thread_name_prefix="popo-expr")
+        return _executor
+
+
+def _resolve(operand: Operand, inputs: Sequence[Any], registers: Any) -> Any:
+    kind, value = operand
+    if kind == "reg":
+        return registers[value]
+    if kind == "in":
+        return inputs[value]
+    return value
+
+
+def _run_blocks(program: BlockProgram, arrays: Sequence[Any], out: Any, starts: Sequence[int], block: int) -> None:
+    """在当前线程中依次计算若干分块，暂存缓冲区在分块之间复用"""
+    length = out.shape[0]
+    scratch = np.empty((max(program.registers, 1), block), dtype=np.float64)
+
+    # errstate是线程本地的，需要在工作线程中设置
+    with np.errstate(all="ignore"):
+        for start in starts:
+            stop = min(start + block, length)
+            registers = scratch[:, :stop - start]
+            inputs = [array if array.shape[0] == 1 else array[start:stop] for array in arrays]
+            for fn, args, kwargs, target, ufunc in program.instructions:
+                values = [_resolve(operand, inputs, registers) for operand in args]
+                if ufunc:
+                    fn(*values, out=registers[target])
+                else:
+                    options = {name: _resolve(operand, inputs, registers) for name, operand in kwargs}
+                    np.copyto(registers[target], fn(*values, **options))
+            np.copyto(out[start:stop], _resolve(program.result, inputs, registers))
+
+
+def evaluate_blocked(
+    program: BlockProgram,
+    arrays: Sequence[Any],
+    length: int,
+    block: Optional[int] = None,
+    threads: Optional[int] = None,
+) -> Any:
+    """
+    分块执行指令序列
+
+    Args:
+        program: compile_block_program 的结果
+        arrays: 与变量对应的一维float64数组，长度为1或length
+        length: 结果长度
+        block: 每个分块的元素数，默认BLOCK_ELEMENTS
+        threads: 使用的线程数，默认为configure_threads设置的值
+
+    Returns:
+        长度为length的一维float64数组
+    """
+    block = max(int(block or BLOCK_ELEMENTS), 1)
+    out = np.empty(length, dtype=np.float64)
+    starts = range(0, length, block)
+    workers = min(threads or _threads, len(starts))
+
+    if workers <= 1:
+        _run_blocks(program, arrays, out, starts, block)
+        return out
+
+    # 分块交错分配给各线程，避免某个线程分到的计算量明显偏多
+    executor = _get_executor()
+    futures = [
+        executor.submit(_run_blocks, program, arrays, out, starts[worker::workers], block)
+        for worker in range(workers)
+    ]
+    for future in futures:
+        future.result()
+    return out
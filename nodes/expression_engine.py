@@ -0,0 +1,729 @@
+"""
+ComfyUI Popo Utility - 数学表达式引擎
+负责表达式的语法树白名单检查、优化、编译和编译结果缓存
+"""
+
+import ast
+import copy
+import math
+import os
+import textwrap
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .cache_utils import LRUCache
+from .expression_optimizer import count_operations, optimize_tree, unparse
+from .expression_types import infer_expression
+
+
+# 默认的编译缓存容量，可通过环境变量 POPO_EXPRESSION_CACHE_SIZE 调整
+DEFAULT_CACHE_SIZE = int(os.environ.get("POPO_EXPRESSION_CACHE_SIZE", "256"))
+
+def _clamp(x: Any, low: Any = 0.0, high: Any = 1.0) -> Any:
+    """把数值限制在 [low, high] 区间内，默认区间适用于像素值"""
+    return min(max(x, low), high)
+
+
+# 安全的数学函数白名单
+SAFE_FUNCTIONS: Dict[str, Any] = {
+    # 基础数学函数
+    'abs': abs,
+    'round': round,
+    'int': int,
+    'float': float,
+    'min': min,
+    'max': max,
+    'pow': pow,
+    'clamp': _clamp,
+
+    # math模块函数
+    'ceil': math.ceil,
+    'floor': math.floor,
+    'sqrt': math.sqrt,
+    'exp': math.exp,
+    'log': math.log,
+    'log10': math.log10,
+    'log2': math.log2,
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'asin': math.asin,
+    'acos': math.acos,
+    'atan': math.atan,
+    'atan2': math.atan2,
+    'sinh': math.sinh,
+    'cosh': math.cosh,
+    'tanh': math.tanh,
+    'asinh': math.asinh,
+    'acosh': math.acosh,
+    'atanh': math.atanh,
+    'degrees': math.degrees,
+    'radians': math.radians,
+    'fabs': math.fabs,
+    'factorial': math.factorial,
+    'gcd': math.gcd,
+    'lcm': getattr(math, 'lcm', lambda x, y: abs(x * y) // math.gcd(x, y)),
+
+    # 数学常数
+    'pi': math.pi,
+    'e': math.e,
+    'tau': math.tau,
+    'inf': math.inf,
+    'nan': math.nan,
+}
+
+# 表达式默认可用的变量
+DEFAULT_VARIABLES: Tuple[str, ...] = ('a', 'b', 'c')
+
+# 允许出现在表达式中的语法节点类型（白名单）
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.keyword,
+    ast.Name,
+    ast.Constant,
+    ast.Load,
+    # 运算符
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.FloorDiv,
+    ast.Mod,
+    ast.Pow,
+    ast.UAdd,
+    ast.USub,
+    ast.Not,
+    ast.And,
+    ast.Or,
+    ast.Eq,
+    ast.NotEq,
+    ast.Lt,
+    ast.LtE,
+    ast.Gt,
+    ast.GtE,
+)
+
+# 白名单中的函数名（可以被调用的名称）
+_CALLABLE_NAMES = frozenset(name for name, value in SAFE_FUNCTIONS.items() if callable(value))
+
+
+class ExpressionError(ValueError):
+    """
+    表达式检查失败
+    col_offset 为出错位置（从0开始的列号），未知时为None
+    """
+
+    def __init__(self, message: str, col_offset: Optional[int] = None):
+        if col_offset is not None:
+            message = f"{message} (位置 {col_offset + 1})"
+        super().__init__(message)
+        self.col_offset = col_offset
+
+
+class ExpressionBudgetError(ExpressionError):
+    """表达式的静态计算量或运行时资源超出限制"""
+
+
+class EvaluationLimits:
+    """
+    表达式的计算量限制
+    静态检查在编译时拒绝明显过大的表达式，运行时限制保护依赖输入值的运算
+    """
+
+    def __init__(
+        self,
+        max_expression_length: int = 2000,
+        max_cost: int = 1000,
+        max_int_bits: int = 16384,
+        max_factorial: int = 1000,
+        time_budget: float = 0.5,
+    ):
+        # 表达式文本的最大长度
+        self.max_expression_length = max_expression_length
+        # 静态估算的最大计算量（加权运算数）
+        self.max_cost = max_cost
+        # 整数结果允许的最大位数（幂、乘法和 lcm 在计算前检查）
+        self.max_int_bits = max_int_bits
+        # factorial 参数上限
+        self.max_factorial = max_factorial
+        # 单次求值的时间预算（秒），在开销较大的运算前检查
+        self.time_budget = time_budget
+
+
+_limits = EvaluationLimits()
+_budget = threading.local()
+
+# 限制修改后需要清空的下游缓存（例如节点的结果缓存），见 on_limits_changed
+_limits_listeners: List[Callable[[], Any]] = []
+
+
+def configure_limits(**kwargs: Any) -> EvaluationLimits:
+    """
+    调整计算量限制，例如 configure_limits(max_factorial=200, time_budget=0.1)
+    修改后清空编译缓存和通过 on_limits_changed 注册的缓存，使检查按新限制重新执行
+    """
+    for name, value in kwargs.items():
+        if not hasattr(_limits, name):
+            raise ValueError(f"未知的限制项: {name}")
+        setattr(_limits, name, value)
+    clear_expression_cache()
+    for callback in _limits_listeners:
+        callback()
+    return _limits
+
+
+def on_limits_changed(callback: Callable[[], Any]) -> Callable[[], Any]:
+    """注册在 configure_limits 之后调用的回调，用于清空按旧限制得到的结果缓存"""
+    _limits_listeners.append(callback)
+    return callback
+
+
+def get_limits() -> EvaluationLimits:
+    """获取当前的计算量限制"""
+    return _limits
+
+
+def _check_deadline() -> None:
+    deadline = getattr(_budget, "deadline", None)
+    if deadline is not None and time.perf_counter() > deadline:
+        raise ExpressionBudgetError(f"表达式计算超出时间预算 ({_limits.time_budget}秒)")
+
+
+def _pow_bits(base: Any, exponent: Any) -> int:
+    """整数幂结果位数的上界估计，非整数幂返回0"""
+    if (
+        isinstance(base, int)
+        and isinstance(exponent, int)
+        and exponent > 0
+        and abs(base) > 1
+    ):
+        return exponent * abs(base).bit_length()
+    return 0
+
+
+def guarded_pow(x: Any, y: Any, mod: Any = None) -> Any:
+    """带位数限制的幂运算，** 运算符也会被改写为调用此函数"""
+    _check_deadline()
+    if mod is not None:
+        return pow(x, y, mod)
+    if _pow_bits(x, y) > _limits.max_int_bits:
+        raise ExpressionBudgetError(f"幂运算结果超过 {_limits.max_int_bits} 位整数限制")
+    return pow(x, y)
+
+
+def guarded_mul(x: Any, y: Any) -> Any:
+    """
+    带位数限制的乘法，可能产生整数的 * 运算符会被改写为调用此函数
+    加减法每次最多增加1位，整数的增长只可能来自乘法和幂运算
+    """
+    if isinstance(x, int) and isinstance(y, int):
+        _check_deadline()
+        if x.bit_length() + y.bit_length() > _limits.max_int_bits:
+            raise ExpressionBudgetError(f"乘法结果超过 {_limits.max_int_bits} 位整数限制")
+    return x * y
+
+
+def guarded_lcm(*args: Any) -> Any:
+    """带位数限制的最小公倍数，结果位数不超过各参数位数之和"""
+    _check_deadline()
+    if sum(arg.bit_length() for arg in args if isinstance(arg, int)) > _limits.max_int_bits:
+        raise ExpressionBudgetError(f"lcm 结果超过 {_limits.max_int_bits} 位整数限制")
+    return SAFE_FUNCTIONS['lcm'](*args)
+
+
+def check_statement(value: Any) -> None:
+    """多行程序每条语句执行后检查时间预算和整数结果的位数"""
+    _check_deadline()
+    if isinstance(value, int) and value.bit_length() > _limits.max_int_bits:
+        raise ExpressionBudgetError(f"结果超过 {_limits.max_int_bits} 位整数限制")
+
+
+def guarded_factorial(x: Any) -> Any:
+    """带参数上限的阶乘"""
+    _check_deadline()
+    if x > _limits.max_factorial:
+        raise ExpressionBudgetError(f"factorial 参数不能超过 {_limits.max_factorial}")
+    return math.factorial(x)
+
+
+# eval使用的全局命名空间，只构建一次，所有表达式共享
+# 开销可能随输入值增长的函数替换为带限制的版本
+_SAFE_GLOBALS: Dict[str, Any] = {
+    '__builtins__': {},
+    **SAFE_FUNCTIONS,
+    'pow': guarded_pow,
+    'factorial': guarded_factorial,
+    'lcm': guarded_lcm,
+    '_pow': guarded_pow,
+    '_mul': guarded_mul,
+    '_check': check_statement,
+}
+
+# 静态估算时各类运算的权重，未列出的运算权重为1
+_CALL_COSTS = {
+    'pow': 4,
+    'factorial': 16,
+    'gcd': 4,
+    'lcm': 4,
+    'exp': 2,
+    'log': 2,
+    'log10': 2,
+    'log2': 2,
+}
+
+
+def estimate_cost(tree: ast.AST, limits: Optional[EvaluationLimits] = None) -> int:
+    """
+    静态估算表达式的计算量（加权运算数）
+    参数为常量的阶乘和幂运算会直接按运行时限制检查
+
+    Raises:
+        ExpressionBudgetError: 计算量或常量参数超出限制
+    """
+    limits = limits or _limits
+    cost = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            name = node.func.id
+            cost += _CALL_COSTS.get(name, 1)
+            args = [arg.value if isinstance(arg, ast.Constant) else None for arg in node.args]
+            if name == 'factorial' and args and args[0] is not None:
+                if args[0] > limits.max_factorial:
+                    raise ExpressionBudgetError(
+                        f"factorial 参数不能超过 {limits.max_factorial}", node.col_offset
+                    )
+            if name == 'pow' and len(args) == 2 and _pow_bits(args[0], args[1]) > limits.max_int_bits:
+                raise ExpressionBudgetError(
+                    f"幂运算结果超过 {limits.max_int_bits} 位整数限制", node.col_offset
+                )
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            cost += 4
+            if (
+                isinstance(node.left, ast.Constant)
+                and isinstance(node.right, ast.Constant)
+                and _pow_bits(node.left.value, node.right.value) > limits.max_int_bits
+            ):
+                raise ExpressionBudgetError(
+                    f"幂运算结果超过 {limits.max_int_bits} 位整数限制", node.col_offset
+                )
+        elif isinstance(node, (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp)):
+            cost += 1
+
+    if cost > limits.max_cost:
+        raise ExpressionBudgetError(f"表达式计算量 {cost} 超出预算 {limits.max_cost}")
+    return cost
+
+
+# 返回值一定是浮点数的函数，以它们为操作数的乘法不会产生大整数
+_FLOAT_FUNCTIONS = frozenset((
+    'float', 'sqrt', 'exp', 'log', 'log10', 'log2', 'sin', 'cos', 'tan', 'asin', 'acos',
+    'atan', 'atan2', 'sinh', 'cosh', 'tanh', 'asinh', 'acosh', 'atanh', 'degrees', 'radians', 'fabs',
+))
+
+
+def _is_float(node: ast.AST) -> bool:
+    """节点的值是否一定是浮点数（无法确定时返回False）"""
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, float)
+    if isinstance(node, ast.Name):
+        return isinstance(SAFE_FUNCTIONS.get(node.id), float)
+    if isinstance(node, ast.BinOp):
+        # 真除法总是浮点数，其余算术运算只要一侧是浮点数结果就是浮点数
+        return isinstance(node.op, ast.Div) or _is_float(node.left) or _is_float(node.right)
+    if isinstance(node, ast.UnaryOp) and not isinstance(node.op, ast.Not):
+        return _is_float(node.operand)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return node.func.id in _FLOAT_FUNCTIONS
+    return False
+
+
+# 乘以不超过该位数的整数常量时不做位数检查
+_SMALL_CONSTANT_BITS = 64
+
+
+def _needs_mul_guard(node: ast.BinOp) -> bool:
+    """
+    乘法是否需要位数检查：两侧都可能是整数，且都不是小整数常量
+    乘以小常量每次最多增加64位，运算数受静态计算量限制，不会失控
+    （常量折叠可能产生很大的常量，这类乘法仍然检查）
+    """
+    for operand in (node.left, node.right):
+        if _is_float(operand):
+            return False
+        if isinstance(operand, ast.Constant) and abs(operand.value).bit_length() <= _SMALL_CONSTANT_BITS:
+            return False
+    return True
+
+
+class _GuardTransformer(ast.NodeTransformer):
+    """
+    把 ** 运算符改写为带限制的 _pow 调用，
+    把两侧都可能是非常量整数的 * 运算符改写为带位数限制的 _mul 调用（浮点乘法和乘以常量保持原样）
+    """
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        guard = isinstance(node.op, ast.Mult) and _needs_mul_guard(node)
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            name = '_pow'
+        elif guard:
+            name = '_mul'
+        else:
+            return node
+        call = ast.Call(
+            func=ast.Name(id=name, ctx=ast.Load()),
+            args=[node.left, node.right],
+            keywords=[],
+        )
+        return ast.copy_location(call, node)
+
+
+def _check_tree(tree: ast.AST, allowed_names: Any, indent: int = 0) -> None:
+    """按白名单检查语法树，出错位置加上indent"""
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            col_offset = getattr(node, "col_offset", None)
+            raise ExpressionError(
+                f"不支持的操作: {type(node).__name__}",
+                None if col_offset is None else indent + col_offset,
+            )
+
+        if isinstance(node, ast.Name):
+            if node.id not in allowed_names:
+                raise ExpressionError(f"未知的名称: {node.id}", indent + node.col_offset)
+
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, complex) or not isinstance(node.value, (int, float)):
+                raise ExpressionError(f"不支持的常量: {node.value!r}", indent + node.col_offset)
+
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in _CALLABLE_NAMES:
+                raise ExpressionError("只能调用白名单中的函数", indent + node.col_offset)
+            for keyword in node.keywords:
+                if keyword.arg is None:
+                    raise ExpressionError("不支持 ** 参数展开", indent + node.col_offset)
+
+
+def parse_expression(
+    expression: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> ast.Expression:
+    """
+    解析表达式并按白名单检查语法树，只遍历一次
+
+    Args:
+        expression: 表达式文本
+        variables: 表达式中允许使用的变量名
+
+    Returns:
+        ast.Expression: 通过检查的语法树
+
+    Raises:
+        ExpressionError: 语法错误或包含不允许的操作
+    """
+    if not isinstance(expression, str):
+        raise ExpressionError("表达式必须是字符串")
+    if len(expression) > _limits.max_expression_length:
+        raise ExpressionBudgetError(f"表达式长度超过 {_limits.max_expression_length} 个字符")
+
+    # 去掉首尾空白后解析，出错位置需要加回前导空白的长度
+    indent = len(expression) - len(expression.lstrip())
+
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"语法错误: {e.msg}", indent + max((e.offset or 1) - 1, 0))
+    except (RecursionError, MemoryError):
+        raise ExpressionError("表达式嵌套过深")
+
+    _check_tree(tree, set(variables) | set(SAFE_FUNCTIONS), indent)
+    return tree
+
+
+def is_safe_expression(expression: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES) -> bool:
+    """检查表达式是否安全"""
+    try:
+        parse_expression(expression, variables)
+    except ExpressionError:
+        return False
+    return True
+
+
+def _number_scope(variables: Tuple[str, ...], values: Tuple[Any, ...], integral: bool) -> Dict[str, Any]:
+    """
+    evaluate_number 的变量字典：输入全部是整数（或整数值的浮点数）且表达式保持整数时为整数，
+    否则全部转换为浮点数
+
+    每次求值都会执行，整体用C实现的 int() 转换后再与原值比较，不逐个判断 is_integer
+    """
+    if integral:
+        try:
+            exact = tuple(map(int, values))
+            if exact == values:
+                return dict(zip(variables, exact))
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return dict(zip(variables, map(float, values)))
+
+
+class CompiledExpression:
+    """
+    已通过安全检查、优化并预编译的表达式
+    重复求值时直接执行字节码，不再解析和检查
+    """
+
+    __slots__ = ("source", "variables", "tree", "optimized", "code", "integral")
+
+    def __init__(
+        self,
+        source: str,
+        variables: Tuple[str, ...],
+        tree: ast.Expression,
+        optimized: ast.Expression,
+        code: Any,
+        integral: bool = False,
+    ):
+        self.source = source
+        self.variables = variables
+        self.tree = tree
+        self.optimized = optimized
+        self.code = code
+        # 整数输入下结果可证明保持整数
+        self.integral = integral
+
+    @property
+    def optimized_source(self) -> str:
+        """优化后的表达式文本，用于调试"""
+        return unparse(self.optimized)
+
+    def evaluate(self, *values: Any) -> Any:
+        """按 variables 的顺序传入变量值并计算表达式，受时间预算限制"""
+        return self._run(dict(zip(self.variables, values)))
+
+    def evaluate_number(self, *values: Any) -> Any:
+        """
+        数值输入都是整数且表达式可证明保持整数时用精确的整数运算，
+        否则转换为浮点数计算
+        """
+        return self._run(_number_scope(self.variables, values, self.integral))
+
+    def _run(self, scope: Dict[str, Any]) -> Any:
+        _budget.deadline = time.perf_counter() + _limits.time_budget
+        try:
+            return eval(self.code, _SAFE_GLOBALS, scope)
+        finally:
+            _budget.deadline = None
+
+
+def _compile(expression: str, variables: Tuple[str, ...]) -> CompiledExpression:
+    tree = parse_expression(expression, variables)
+    estimate_cost(tree)
+    optimized = optimize_tree(copy.deepcopy(tree), SAFE_FUNCTIONS)
+    guarded = ast.fix_missing_locations(_GuardTransformer().visit(copy.deepcopy(optimized)))
+    code = compile(guarded, "<expression>", "eval")
+    integral = infer_expression(optimized, variables, SAFE_FUNCTIONS).integral
+    return CompiledExpression(expression, variables, tree, optimized, code, integral)
+
+
+# 全局编译缓存，键为 (表达式文本, 变量名)
+_expression_cache = LRUCache(DEFAULT_CACHE_SIZE)
+
+
+def compile_expression(
+    expression: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> CompiledExpression:
+    """
+    获取表达式的编译结果，优先从缓存中读取
+
+    Args:
+        expression: 表达式文本
+        variables: 表达式中允许使用的变量名
+
+    Returns:
+        CompiledExpression: 已检查并编译的表达式
+
+    Raises:
+        ExpressionError: 语法错误或包含不允许的操作
+        ExpressionBudgetError: 计算量超出限制
+    """
+    variables = tuple(variables)
+    return _expression_cache.get_or_create(
+        (expression, variables), lambda: _compile(expression, variables)
+    )
+
+
+def configure_expression_cache(maxsize: int) -> None:
+    """设置编译缓存的容量，0表示禁用缓存"""
+    _expression_cache.resize(maxsize)
+
+
+def get_expression_cache_stats() -> Dict[str, Any]:
+    """获取编译缓存的命中统计"""
+    return _expression_cache.stats()
+
+
+def clear_expression_cache() -> None:
+    """清空编译缓存和统计"""
+    _expression_cache.clear()
+
+
+def explain_expression(
+    expression: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> Dict[str, Any]:
+    """
+    返回表达式优化前后的形式和运算数，用于检查优化效果
+
+    Returns:
+        dict: source, optimized, operations_before, operations_after
+    """
+    compiled = compile_expression(expression, variables)
+    return {
+        "source": compiled.source,
+        "optimized": compiled.optimized_source,
+        "operations_before": count_operations(compiled.tree),
+        "operations_after": count_operations(compiled.optimized),
+    }
+
+
+def parse_program(
+    program: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> List[Tuple[str, ast.Expression]]:
+    """
+    解析多行表达式程序，每行（或以分号分隔的每条语句）形如 名称 = 表达式
+    后面的语句可以引用前面赋值的名称
+
+    Returns:
+        按书写顺序排列的 (名称, 已检查的表达式语法树)
+
+    Raises:
+        ExpressionError: 语法错误、不支持的语句或包含不允许的操作
+    """
+    if not isinstance(program, str):
+        raise ExpressionError("程序必须是字符串")
+    if len(program) > _limits.max_expression_length:
+        raise ExpressionBudgetError(f"程序长度超过 {_limits.max_expression_length} 个字符")
+
+    try:
+        module = ast.parse(textwrap.dedent(program).strip(), mode="exec")
+    except SyntaxError as e:
+        raise ExpressionError(f"第{e.lineno or 1}行: 语法错误: {e.msg}", max((e.offset or 1) - 1, 0))
+    except (RecursionError, MemoryError):
+        raise ExpressionError("程序嵌套过深")
+
+    if not module.body:
+        raise ExpressionError("程序为空")
+
+    allowed_names = set(variables) | set(SAFE_FUNCTIONS)
+    statements = []
+    for statement in module.body:
+        prefix = f"第{statement.lineno}行: "
+        if (
+            not isinstance(statement, ast.Assign)
+            or len(statement.targets) != 1
+            or not isinstance(statement.targets[0], ast.Name)
+        ):
+            raise ExpressionError(prefix + "只支持 名称 = 表达式 形式的赋值", statement.col_offset)
+
+        name = statement.targets[0].id
+        if name in allowed_names or name.startswith("_"):
+            # 输入变量、函数和已赋值的名称不能被覆盖，下划线开头的名称保留给内部使用
+            raise ExpressionError(prefix + f"不能赋值给名称: {name}", statement.col_offset)
+
+        tree = ast.Expression(body=statement.value)
+        try:
+            _check_tree(tree, allowed_names)
+        except ExpressionError as e:
+            raise type(e)(prefix + str(e)) from e
+
+        statements.append((name, tree))
+        allowed_names.add(name)
+
+    return statements
+
+
+class CompiledProgram:
+    """
+    已检查、逐行优化并编译为一段字节码的多行程序
+    一次执行计算全部赋值，后面的语句直接复用前面的结果；每条语句之后检查时间预算和整数位数
+    """
+
+    __slots__ = ("source", "variables", "names", "statements", "code", "integral")
+
+    def __init__(
+        self,
+        source: str,
+        variables: Tuple[str, ...],
+        statements: List[Tuple[str, ast.Expression]],
+        code: Any,
+        integral: bool = False,
+    ):
+        self.source = source
+        self.variables = variables
+        self.names = tuple(name for name, _ in statements)
+        self.statements = statements
+        self.code = code
+        # 整数输入下所有语句的结果都可证明保持整数
+        self.integral = integral
+
+    def evaluate(self, *values: Any) -> Dict[str, Any]:
+        """按 variables 的顺序传入变量值，返回各个赋值名称的结果"""
+        return self._run(dict(zip(self.variables, values)))
+
+    def evaluate_number(self, *values: Any) -> Dict[str, Any]:
+        """与 CompiledExpression.evaluate_number 相同，整个程序保持整数时使用整数运算"""
+        return self._run(_number_scope(self.variables, values, self.integral))
+
+    def _run(self, scope: Dict[str, Any]) -> Dict[str, Any]:
+        _budget.deadline = time.perf_counter() + _limits.time_budget
+        try:
+            exec(self.code, _SAFE_GLOBALS, scope)
+        finally:
+            _budget.deadline = None
+        return {name: scope[name] for name in self.names}
+
+
+def _compile_program(program: str, variables: Tuple[str, ...]) -> CompiledProgram:
+    statements = parse_program(program, variables)
+
+    cost = sum(estimate_cost(tree) for _, tree in statements)
+    if cost > _limits.max_cost:
+        raise ExpressionBudgetError(f"程序计算量 {cost} 超出预算 {_limits.max_cost}")
+
+    body = []
+    bindings = {}
+    for name, tree in statements:
+        optimized = optimize_tree(copy.deepcopy(tree), SAFE_FUNCTIONS)
+        bindings[name] = infer_expression(optimized, variables, SAFE_FUNCTIONS, bindings)
+        guarded = _GuardTransformer().visit(copy.deepcopy(optimized))
+        body.append(ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=guarded.body))
+        body.append(ast.Expr(ast.Call(
+            func=ast.Name(id='_check', ctx=ast.Load()),
+            args=[ast.Name(id=name, ctx=ast.Load())],
+            keywords=[],
+        )))
+    module = ast.fix_missing_locations(ast.Module(body=body, type_ignores=[]))
+    code = compile(module, "<program>", "exec")
+    integral = all(info.integral for info in bindings.values())
+    return CompiledProgram(program, variables, statements, code, integral)
+
+
+def compile_program(
+    program: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> CompiledProgram:
+    """
+    获取多行程序的编译结果，与表达式共用编译缓存
+
+    Raises:
+        ExpressionError: 语法错误、不支持的语句或包含不允许的操作
+        ExpressionBudgetError: 计算量超出限制
+    """
+    variables = tuple(variables)
+    return _expression_cache.get_or_create(
+        ("program", program, variables), lambda: _compile_program(program, variables)
+    )
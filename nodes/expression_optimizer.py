@@ -0,0 +1,403 @@
+"""
+ComfyUI Popo Utility - 表达式优化
+在编译前对已检查的语法树做常量折叠、恒等式化简和公共子表达式消除
+"""
+
+import ast
+import math
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+# 可以直接替换为常量的名称
+_CONSTANT_NAMES = {'pi': math.pi, 'e': math.e, 'tau': math.tau, 'inf': math.inf, 'nan': math.nan}
+
+# 折叠时允许产生的最大整数位数，避免在编译阶段计算巨大的整数
+FOLD_MAX_INT_BITS = 4096
+
+# 公共子表达式临时变量的前缀，用户表达式中不可能出现下划线开头的名称
+CSE_PREFIX = "_cse"
+
+_BINARY_OPERATORS = {
+    ast.Add: lambda x, y: x + y,
+    ast.Sub: lambda x, y: x - y,
+    ast.Mult: lambda x, y: x * y,
+    ast.Div: lambda x, y: x / y,
+    ast.FloorDiv: lambda x, y: x // y,
+    ast.Mod: lambda x, y: x % y,
+    ast.Pow: lambda x, y: x ** y,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: lambda x: +x,
+    ast.USub: lambda x: -x,
+    ast.Not: lambda x: not x,
+}
+
+_COMPARE_OPERATORS = {
+    ast.Eq: lambda x, y: x == y,
+    ast.NotEq: lambda x, y: x != y,
+    ast.Lt: lambda x, y: x < y,
+    ast.LtE: lambda x, y: x <= y,
+    ast.Gt: lambda x, y: x > y,
+    ast.GtE: lambda x, y: x >= y,
+}
+
+
+def _is_number(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.Constant)
+        and isinstance(node.value, (int, float))
+    )
+
+
+def _is_value(node: ast.AST, value: int) -> bool:
+    # 只匹配整数常量：a*1.0、a+0.0 会把整数a变为浮点数，不能化简为a；True/False 也不参与
+    return isinstance(node, ast.Constant) and type(node.value) is int and node.value == value
+
+
+def _pow_is_cheap(base: Any, exponent: Any) -> bool:
+    """整数幂的结果位数是否在折叠上限内"""
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0:
+        return exponent * max(abs(base).bit_length(), 1) <= FOLD_MAX_INT_BITS
+    return True
+
+
+def _call_is_cheap(name: str, args: List[Any]) -> bool:
+    if name == 'pow' and len(args) == 2:
+        return _pow_is_cheap(args[0], args[1])
+    if name == 'factorial' and args:
+        return isinstance(args[0], int) and args[0] <= 500
+    return True
+
+
+def _constant(value: Any, like: ast.AST) -> Optional[ast.Constant]:
+    """把折叠结果转换为常量节点，非数值或过大的结果返回None"""
+    if isinstance(value, bool):
+        pass
+    elif isinstance(value, int):
+        if value.bit_length() > FOLD_MAX_INT_BITS:
+            return None
+    elif not isinstance(value, float):
+        return None
+    return ast.copy_location(ast.Constant(value=value), like)
+
+
+class _ConstantFolder(ast.NodeTransformer):
+    """自底向上折叠常量子树并化简恒等式"""
+
+    def __init__(self, functions: Dict[str, Any]):
+        self.functions = functions
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id in _CONSTANT_NAMES:
+            return ast.copy_location(ast.Constant(value=_CONSTANT_NAMES[node.id]), node)
+        return node
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        left, right, op = node.left, node.right, node.op
+
+        if _is_number(left) and _is_number(right):
+            if not isinstance(op, ast.Pow) or _pow_is_cheap(left.value, right.value):
+                try:
+                    folded = _constant(_BINARY_OPERATORS[type(op)](left.value, right.value), node)
+                except Exception:
+                    # 折叠失败（如除零）时保留原表达式，让运行时报告错误
+                    folded = None
+                if folded is not None:
+                    return folded
+
+        # 恒等式: x+0, 0+x, x-0, x*1, 1*x, x**1（x/1 对整数x得到浮点数，不化简）
+        if isinstance(op, ast.Add):
+            if _is_value(right, 0):
+                return left
+            if _is_value(left, 0):
+                return right
+        elif isinstance(op, ast.Sub):
+            if _is_value(right, 0):
+                return left
+            if _is_value(left, 0):
+                return ast.copy_location(ast.UnaryOp(op=ast.USub(), operand=right), node)
+        elif isinstance(op, ast.Mult):
+            if _is_value(right, 1):
+                return left
+            if _is_value(left, 1):
+                return right
+        elif isinstance(op, ast.Pow):
+            if _is_value(right, 1):
+                return left
+        return node
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        self.generic_visit(node)
+        operand = node.operand
+
+        if _is_number(operand):
+            folded = _constant(_UNARY_OPERATORS[type(node.op)](operand.value), node)
+            if folded is not None:
+                return folded
+
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        # -(-x) -> x
+        if (
+            isinstance(node.op, ast.USub)
+            and isinstance(operand, ast.UnaryOp)
+            and isinstance(operand.op, ast.USub)
+        ):
+            return operand.operand
+        return node
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        self.generic_visit(node)
+        if all(_is_number(arg) for arg in node.args) and all(
+            _is_number(keyword.value) for keyword in node.keywords
+        ):
+            args = [arg.value for arg in node.args]
+            kwargs = {keyword.arg: keyword.value.value for keyword in node.keywords}
+            if _call_is_cheap(node.func.id, args):
+                try:
+                    folded = _constant(self.functions[node.func.id](*args, **kwargs), node)
+                except Exception:
+                    folded = None
+                if folded is not None:
+                    return folded
+        return node
+
+    def visit_Compare(self, node: ast.Compare) -> ast.AST:
+        self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        if all(_is_number(operand) for operand in operands):
+            result = all(
+                _COMPARE_OPERATORS[type(op)](left.value, right.value)
+                for op, left, right in zip(node.ops, operands, operands[1:])
+            )
+            return ast.copy_location(ast.Constant(value=result), node)
+        return node
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:
+        self.generic_visit(node)
+        # 从左到右按短路规则去掉已经确定的常量操作数
+        is_and = isinstance(node.op, ast.And)
+        values = []
+        for value in node.values:
+            if _is_number(value):
+                if bool(value.value) != is_and:
+                    # and 遇到假值 / or 遇到真值，结果就是这个值
+                    values.append(value)
+                    break
+                if value is node.values[-1]:
+                    values.append(value)
+                continue
+            values.append(value)
+        if len(values) == 1:
+            return values[0]
+        node.values = values
+        return node
+
+    def visit_IfExp(self, node: ast.IfExp) -> ast.AST:
+        self.generic_visit(node)
+        if _is_number(node.test):
+            return node.body if node.test.value else node.orelse
+        return node
+
+
+def _children(node: ast.AST) -> Iterator[Tuple[ast.AST, bool]]:
+    """
+    按求值顺序产生子节点，以及该子节点是否一定会被求值
+    条件表达式的分支、and/or 的后续操作数和链式比较的后续比较对象是条件求值的
+    """
+    if isinstance(node, ast.IfExp):
+        yield node.test, True
+        yield node.body, False
+        yield node.orelse, False
+    elif isinstance(node, ast.BoolOp):
+        for index, value in enumerate(node.values):
+            yield value, index == 0
+    elif isinstance(node, ast.Compare):
+        yield node.left, True
+        for index, comparator in enumerate(node.comparators):
+            yield comparator, index == 0
+    elif isinstance(node, ast.Call):
+        for arg in node.args:
+            yield arg, True
+        for keyword in node.keywords:
+            yield keyword.value, True
+    else:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.expr):
+                yield child, True
+
+
+def _structure_key(node: ast.AST, keys: Dict[int, Any], sizes: Dict[int, int]) -> Any:
+    """自底向上计算子树的结构键和节点数"""
+    children = [child for child, _ in _children(node)]
+    child_keys = tuple(_structure_key(child, keys, sizes) for child in children)
+
+    if isinstance(node, ast.Name):
+        key: Any = ("name", node.id)
+    elif isinstance(node, ast.Constant):
+        key = ("const", type(node.value).__name__, repr(node.value))
+    elif isinstance(node, ast.Call):
+        key = ("call", node.func.id, len(node.args),
+               tuple(keyword.arg for keyword in node.keywords), child_keys)
+    elif isinstance(node, (ast.BinOp, ast.UnaryOp, ast.BoolOp)):
+        key = (type(node).__name__, type(node.op).__name__, child_keys)
+    elif isinstance(node, ast.Compare):
+        key = ("compare", tuple(type(op).__name__ for op in node.ops), child_keys)
+    else:
+        key = (type(node).__name__, child_keys)
+
+    keys[id(node)] = key
+    sizes[id(node)] = 1 + sum(sizes[id(child)] for child in children)
+    return key
+
+
+def _eliminate_one(tree: ast.Expression, counter: int) -> bool:
+    """
+    找到最大的重复子表达式，首次出现处用海象运算符保存，其余位置直接引用
+    条件求值的子树（分支、短路操作数）各自单独成为一个区域，
+    只在同一区域内共享，保证短路语义不变
+    """
+    keys: Dict[int, Any] = {}
+    sizes: Dict[int, int] = {}
+    _structure_key(tree.body, keys, sizes)
+
+    # 按区域收集子树出现的位置（先序、从左到右即为求值顺序）
+    occurrences: Dict[Any, List[Tuple[ast.AST, ast.AST, str, Optional[int]]]] = {}
+    regions = [0]
+
+    def collect(node: ast.AST, region: int) -> None:
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                items = [(item, index) for index, item in enumerate(value)]
+            else:
+                items = [(value, None)]
+            for child, index in items:
+                if isinstance(child, ast.keyword):
+                    child_node, parent, attr, position = child.value, child, "value", None
+                elif isinstance(child, ast.expr):
+                    child_node, parent, attr, position = child, node, field, index
+                else:
+                    continue
+                child_region = region
+                if not _is_unconditional(node, child_node):
+                    regions[0] += 1
+                    child_region = regions[0]
+                if not isinstance(child_node, (ast.Name, ast.Constant, ast.NamedExpr)):
+                    occurrences.setdefault((child_region, keys[id(child_node)]), []).append(
+                        (child_node, parent, attr, position)
+                    )
+                collect(child_node, child_region)
+
+    collect(tree, 0)
+
+    repeated = [items for items in occurrences.values() if len(items) > 1]
+    if not repeated:
+        return False
+
+    items = max(repeated, key=lambda items: sizes[id(items[0][0])])
+    name = f"{CSE_PREFIX}{counter}"
+    for index, (child, parent, attr, position) in enumerate(items):
+        if index == 0:
+            replacement: ast.AST = ast.NamedExpr(
+                target=ast.Name(id=name, ctx=ast.Store()), value=child
+            )
+        else:
+            replacement = ast.Name(id=name, ctx=ast.Load())
+        ast.copy_location(replacement, child)
+        if position is None:
+            setattr(parent, attr, replacement)
+        else:
+            getattr(parent, attr)[position] = replacement
+    return True
+
+
+def _is_unconditional(parent: ast.AST, child: ast.AST) -> bool:
+    for candidate, unconditional in _children(parent):
+        if candidate is child:
+            return unconditional
+    return True
+
+
+def optimize_tree(
+    tree: ast.Expression, functions: Dict[str, Any], max_temporaries: int = 32
+) -> ast.Expression:
+    """
+    优化已通过白名单检查的语法树（会原地修改传入的树）
+
+    Args:
+        tree: parse_expression 返回的语法树
+        functions: 可用于常量折叠的纯函数表
+        max_temporaries: 公共子表达式临时变量的最大数量
+
+    Returns:
+        ast.Expression: 优化后的语法树
+    """
+    tree = _ConstantFolder(functions).visit(tree)
+    counter = 0
+    while counter < max_temporaries and _eliminate_one(tree, counter):
+        counter += 1
+    return ast.fix_missing_locations(tree)
+
+
+def unparse(tree: ast.AST) -> str:
+    """把语法树还原为表达式文本，Python 3.8 下退化为 ast.dump"""
+    if hasattr(ast, "unparse"):
+        return ast.unparse(tree)
+    return ast.dump(tree)
+
+
+_OPERATION_NODES = (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call)
+
+
+def count_operations(tree: ast.AST) -> int:
+    """统计语法树中需要在运行时执行的运算数，用于比较优化前后的计算量"""
+    return sum(1 for node in ast.walk(tree) if isinstance(node, _OPERATION_NODES))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    命令行调试入口，输出表达式优化前后的形式和运算数
+
+    用法:
+        python -m nodes.expression_optimizer "sqrt(a*a + b*b) * pi * 2"
+        python -m nodes.expression_optimizer --file expressions.txt
+    """
+    from .expression_engine import ExpressionError, explain_expression
+
+    args = list(sys.argv[1:] if argv is None else argv)
+    expressions: List[str] = []
+    while args:
+        arg = args.pop(0)
+        if arg == "--file" and args:
+            with open(args.pop(0), encoding="utf-8") as f:
+                expressions.extend(line.strip() for line in f if line.strip())
+        else:
+            expressions.append(arg)
+
+    if not expressions:
+        print(main.__doc__)
+        return 1
+
+    total_before = total_after = 0
+    for expression in expressions:
+        try:
+            info = explain_expression(expression)
+        except ExpressionError as e:
+            print(f"✗ {expression}\n    错误: {e}")
+            continue
+        total_before += info["operations_before"]
+        total_after += info["operations_after"]
+        print(f"  {info['source']}")
+        print(f"→ {info['optimized']}  ({info['operations_before']} → {info['operations_after']} 次运算)")
+
+    if total_before:
+        print(f"\n总计: {total_before} → {total_after} 次运算 "
+              f"({(1 - total_after / total_before) * 100:.1f}% 减少)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+ComfyUI Popo Utility - 表达式性能统计
+按表达式记录调用次数、累计耗时、p99耗时、缓存命中和失败次数，
+支持查询、重置和定期写入文件，用于在生产工作流中找出耗时的表达式
+
+命令行查看统计文件:
+    python -m nodes.expression_profiler profile.json [--top 20] [--sort p99_us]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# 设置为0时关闭统计
+PROFILE_ENABLED = os.environ.get("POPO_EXPRESSION_PROFILE", "1") != "0"
+
+# 设置后按 POPO_EXPRESSION_PROFILE_INTERVAL 秒（默认60）定期把统计写入该文件
+PROFILE_DUMP_PATH = os.environ.get("POPO_EXPRESSION_PROFILE_DUMP", "")
+PROFILE_DUMP_INTERVAL = float(os.environ.get("POPO_EXPRESSION_PROFILE_INTERVAL", "60"))
+
+# 每个表达式保留最近多少次耗时用于计算分位数
+SAMPLE_WINDOW = 1024
+
+# 最多跟踪的表达式数量，超出时淘汰最久未计时的表达式
+MAX_EXPRESSIONS = 1024
+
+# 每个表达式每隔多少次实际计算计时一次（1表示每次都计时），其余调用只计数，
+# 可通过环境变量 POPO_EXPRESSION_PROFILE_SAMPLE 调整
+SAMPLE_EVERY = max(1, int(os.environ.get("POPO_EXPRESSION_PROFILE_SAMPLE", "16")))
+
+
+class _ExpressionStats:
+    """单个表达式的统计数据"""
+
+    __slots__ = ("evaluations", "cache_hits", "failures", "timed", "total_ns", "max_ns", "samples",
+                 "last_error", "untimed")
+
+    def __init__(self, profiler: Optional["ExpressionProfiler"]):
+        self.evaluations = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.timed = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.samples: "deque[int]" = deque(maxlen=SAMPLE_WINDOW)
+        self.last_error: Optional[str] = None
+        # 不计时的调用共用的上下文，只记录失败
+        self.untimed = _Untimed(profiler, self)
+
+    def percentile(self, fraction: float) -> float:
+        """最近SAMPLE_WINDOW次计时的分位数（纳秒，最近邻取整）"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+        return float(ordered[index])
+
+
+class ExpressionProfiler:
+    """
+    线程安全的表达式性能统计，键为 (节点名, 表达式文本)
+
+    调用路径上只做计数：缓存命中和未被抽样的计算只给已有条目的计数器加一，不加锁也不分配对象；
+    每个表达式每 sample_every 次计算计时一次，累计耗时按抽样比例估算。
+    计数器在多线程下不加锁，并发时可能少计个别调用；条目被淘汰或重置后，
+    调用方（如结果缓存）仍持有的旧条目上的计数不再出现在统计中
+    """
+
+    def __init__(self, enabled: bool = True, max_expressions: int = MAX_EXPRESSIONS, sample_every: int = SAMPLE_EVERY):
+        self.enabled = enabled
+        self.max_expressions = max_expressions
+        self.sample_every = max(1, int(sample_every))
+        # 节点名 -> {表达式 -> 统计}，查找时不需要构造元组键
+        self._nodes: Dict[str, Dict[str, _ExpressionStats]] = {}
+        # 按最近计时的顺序排列的键，用于淘汰
+        self._order: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dump_thread: Optional[threading.Thread] = None
+        self._dump_stop = threading.Event()
+
+    def _entry(self, node: str, expression: str) -> _ExpressionStats:
+        expressions = self._nodes.get(node)
+        entry = expressions.get(expression) if expressions is not None else None
+        if entry is None:
+            with self._lock:
+                entry = self._nodes.setdefault(node, {}).get(expression)
+                if entry is None:
+                    entry = self._nodes[node][expression] = _ExpressionStats(self)
+                    self._order[(node, expression)] = None
+                    while len(self._order) > self.max_expressions:
+                        old_node, old_expression = self._order.popitem(last=False)[0]
+                        self._nodes[old_node].pop(old_expression, None)
+        return entry
+
+    def record(self, node: str, expression: str, elapsed_ns: int, error: Optional[BaseException] = None) -> None:
+        """记录一次计时的实际计算（包括可能的编译）的耗时和结果"""
+        if not self.enabled:
+            return
+        entry = self._entry(node, expression)
+        entry.evaluations += 1
+        self._record_timed(node, expression, entry, elapsed_ns, error)
+
+    def _record_timed(
+        self, node: str, expression: str, entry: _ExpressionStats, elapsed_ns: int, error: Optional[BaseException]
+    ) -> None:
+        with self._lock:
+            if (node, expression) in self._order:
+                self._order.move_to_end((node, expression))
+            entry.timed += 1
+            entry.total_ns += elapsed_ns
+            entry.max_ns = max(entry.max_ns, elapsed_ns)
+            entry.samples.append(elapsed_ns)
+            if error is not None:
+                entry.failures += 1
+                entry.last_error = f"{type(error).__name__}: {error}"
+
+    def record_hit(self, node: str, expression: str) -> None:
+        """记录一次结果缓存命中，只给计数器加一"""
+        # 命中的结果一定计算过，条目通常已经存在，内联查找以减少调用开销
+        expressions = self._nodes.get(node)
+        entry = expressions.get(expression) if expressions is not None else None
+        if entry is not None:
+            entry.cache_hits += 1
+        elif self.enabled:
+            self._entry(node, expression).cache_hits += 1
+
+    def measure(self, node: str, expression: str) -> Any:
+        """
+        计时上下文，退出时记录耗时，出现异常时同时记录失败（异常继续抛出）
+        未被抽样的调用返回条目自带的上下文，只计数和记录失败；
+        上下文的 stats 属性是该表达式的统计条目，结果缓存可以保存它，命中时直接执行 stats.cache_hits += 1
+
+        with profiler.measure("PopoMathExpressionNode", expression):
+            ...
+        """
+        if not self.enabled:
+            return _DISABLED
+        # 与 record_hit 相同，条目已存在时内联查找
+        expressions = self._nodes.get(node)
+        entry = expressions.get(expression) if expressions is not None else None
+        if entry is None:
+            entry = self._entry(node, expression)
+        entry.evaluations += 1
+        if (entry.evaluations - 1) % self.sample_every:
+            return entry.untimed
+        return _Measurement(self, node, expression, entry)
+
+    def stats(self, expression: Optional[str] = None, node: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        查询统计数据，可按表达式文本或节点名过滤
+
+        Returns:
+            每个表达式一项，包含 node, expression, calls, cache_hits, failures,
+            total_ms, mean_us, p99_us, max_us, last_error；按累计耗时从高到低排序
+            （total_ms 按计时调用的平均耗时和实际计算次数估算）
+        """
+        with self._lock:
+            items = [
+                (node_name, text, entry)
+                for node_name, expressions in self._nodes.items() if node is None or node_name == node
+                for text, entry in expressions.items() if expression is None or text == expression
+            ]
+            rows = []
+            for node_name, text, entry in items:
+                mean_ns = entry.total_ns / entry.timed if entry.timed else 0.0
+                rows.append({
+                    "node": node_name,
+                    "expression": text,
+                    "calls": entry.evaluations + entry.cache_hits,
+                    "cache_hits": entry.cache_hits,
+                    "failures": entry.failures,
+                    "total_ms": round(mean_ns * entry.evaluations / 1e6, 3),
+                    "mean_us": round(mean_ns / 1e3, 3),
+                    "p99_us": round(entry.percentile(0.99) / 1e3, 3),
+                    "max_us": round(entry.max_ns / 1e3, 3),
+                    "last_error": entry.last_error,
+                })
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows
+
+    def top(self, count: int = 10, sort_by: str = "total_ms") -> List[Dict[str, Any]]:
+        """按指定字段返回开销最大的若干表达式"""
+        return sorted(self.stats(), key=lambda row: row[sort_by], reverse=True)[:count]
+
+    def reset(self) -> None:
+        """清空所有统计"""
+        with self._lock:
+            self._nodes.clear()
+            self._order.clear()
+
+    def dump(self, path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        生成统计快照，指定path时以JSON写入文件（先写临时文件再替换，读取方不会读到半个文件）
+        """
+        snapshot = {"timestamp": time.time(), "pid": os.getpid(), "expressions": self.stats()}
+        if path:
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, path)
+        return snapshot
+
+    def start_periodic_dump(self, path: str, interval: float = PROFILE_DUMP_INTERVAL) -> None:
+        """在后台线程中每隔interval秒把统计写入path，重复调用会替换之前的设置"""
+        self.stop_periodic_dump()
+        stop = self._dump_stop = threading.Event()
+
+        def run() -> None:
+            while not stop.wait(interval):
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    print(f"Popo expression profiler: 写入统计失败: {e}")
+
+        self._dump_thread = threading.Thread(target=run, name="popo-expression-profiler", daemon=True)
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self) -> None:
+        """停止定期写入"""
+        self._dump_stop.set()
+        if self._dump_thread is not None:
+            self._dump_thread.join(timeout=1)
+            self._dump_thread = None
+
+
+class _Measurement:
+    __slots__ = ("profiler", "node", "expression", "stats", "start")
+
+    def __init__(self, profiler: ExpressionProfiler, node: str, expression: str, stats: _ExpressionStats):
+        self.profiler = profiler
+        self.node = node
+        self.expression = expression
+        self.stats = stats
+
+    def __enter__(self) -> "_Measurement":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> bool:
+        elapsed = time.perf_counter_ns() - self.start
+        self.profiler._record_timed(self.node, self.expression, self.stats, elapsed, exc)
+        return False
+
+
+class _Untimed:
+    """未被抽样的调用使用的上下文，每个表达式一个，只在出现异常时记录失败"""
+
+    __slots__ = ("profiler", "stats")
+
+    def __init__(self, profiler: ExpressionProfiler, stats: _ExpressionStats):
+        self.profiler = profiler
+        self.stats = stats
+
+    def __enter__(self) -> "_Untimed":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> bool:
+        if exc is not None:
+            # 与其他计数器一样不加锁；错误信息只在还没有记录时格式化，之后由计时的调用更新
+            self.stats.failures += 1
+            if self.stats.last_error is None:
+                self.stats.last_error = f"{type(exc).__name__}: {exc}"
+        return False
+
+
+class _Disabled:
+    """关闭统计时使用的空上下文，stats 是不属于任何统计对象的占位条目"""
+
+    __slots__ = ("stats",)
+
+    def __init__(self):
+        self.stats = _ExpressionStats(None)
+
+    def __enter__(self) -> "_Disabled":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> bool:
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+# 全局统计实例，节点共用
+profiler = ExpressionProfiler(enabled=PROFILE_ENABLED)
+
+if PROFILE_ENABLED and PROFILE_DUMP_PATH:
+    profiler.start_periodic_dump(PROFILE_DUMP_PATH, PROFILE_DUMP_INTERVAL)
+
+
+def get_expression_stats(expression: Optional[str] = None, node: Optional[str] = None) -> List[Dict[str, Any]]:
+    """查询全局统计，参见 ExpressionProfiler.stats"""
+    return profiler.stats(expression, node)
+
+
+def reset_expression_stats() -> None:
+    """清空全局统计"""
+    profiler.reset()
+
+
+def _format_table(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'calls':>8}{'hits':>8}{'fail':>6}{'total ms':>11}{'mean us':>10}{'p99 us':>10}  表达式"]
+    for row in rows:
+        text = row["expression"].replace("\n", "; ")
+        if len(text) > 60:
+            text = text[:57] + "..."
+        lines.append(
+            f"{row['calls']:>8}{row['cache_hits']:>8}{row['failures']:>6}{row['total_ms']:>11.2f}"
+            f"{row['mean_us']:>10.1f}{row['p99_us']:>10.1f}  {text}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="查看表达式性能统计文件")
+    parser.add_argument("path", help="POPO_EXPRESSION_PROFILE_DUMP 写入的JSON文件")
+    parser.add_argument("--top", type=int, default=20, help="显示的表达式数量")
+    parser.add_argument("--sort", default="total_ms", help="排序字段，如 total_ms、p99_us、failures")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"无法读取统计文件: {e}", file=sys.stderr)
+        return 1
+
+    rows = sorted(snapshot.get("expressions", []), key=lambda row: row.get(args.sort, 0), reverse=True)
+    print(_format_table(rows[:args.top]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
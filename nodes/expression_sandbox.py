@@ -0,0 +1,396 @@
+"""
+ComfyUI Popo Utility - 表达式隔离计算
+把表达式求值发送到预先启动的工作进程池中执行，工作进程带内存和CPU时间限制
+
+失控或恶意的表达式只会拖慢或终止某个工作进程，不会阻塞ComfyUI的执行线程或耗尽服务进程的内存；
+超时、超出限制或异常退出的工作进程会被回收并替换。请求按批次通过管道收发，
+一次往返可以计算多个表达式，进程常驻复用，单次调用的延迟在亚毫秒级
+"""
+
+import atexit
+import multiprocessing
+import os
+import queue
+import runpy
+import signal
+import threading
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .expression_engine import (
+    DEFAULT_VARIABLES,
+    ExpressionBudgetError,
+    ExpressionError,
+    compile_expression,
+    get_limits,
+)
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，工作进程只做进程隔离
+    resource = None
+
+
+# 设置为1时数学表达式节点默认在隔离进程中计算
+SANDBOX_ENABLED = os.environ.get("POPO_EXPRESSION_SANDBOX", "0") == "1"
+
+# 工作进程数量
+DEFAULT_WORKERS = int(os.environ.get("POPO_EXPRESSION_SANDBOX_WORKERS", "2"))
+
+# 每个工作进程在启动时占用之外最多可以再分配的内存（MB）
+DEFAULT_MEMORY_LIMIT_MB = int(os.environ.get("POPO_EXPRESSION_SANDBOX_MEMORY_MB", "256"))
+
+# 每个批次允许使用的CPU时间（秒），超出时工作进程被系统终止
+DEFAULT_CPU_SECONDS = 5
+
+# 进程启动方式，默认只在服务进程还是单线程时使用fork，否则使用forkserver（不支持时为spawn）
+START_METHOD = os.environ.get("POPO_EXPRESSION_SANDBOX_START_METHOD") or None
+
+# 等待空闲工作进程的最长时间（秒）
+DEFAULT_ACQUIRE_TIMEOUT = 30.0
+
+# 工作进程处理这么多批次后主动替换，避免长期运行积累内存
+DEFAULT_MAX_BATCHES = 10000
+
+
+class SandboxError(ExpressionError):
+    """隔离计算失败：等待超时、工作进程超出资源限制或异常退出"""
+
+
+def _default_start_method() -> str:
+    """
+    在多线程进程中fork时，子进程可能继承其他线程持有的锁而死锁，
+    所以只在当前进程只有一个线程时使用fork（工作进程直接继承已加载的模块）
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if "fork" in methods and threading.active_count() == 1:
+        return "fork"
+    return "forkserver" if "forkserver" in methods else "spawn"
+
+
+def _address_space() -> int:
+    """当前进程占用的虚拟地址空间（字节），无法读取时返回0"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def _apply_memory_limit(memory_limit_mb: int) -> None:
+    # fork出的进程继承了服务进程的地址空间，限制需要在当前占用的基础上计算
+    if resource is None or memory_limit_mb <= 0:
+        return
+    limit = _address_space() + memory_limit_mb * 1024 * 1024
+    try:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ValueError, OSError):
+        pass
+
+
+def _extend_cpu_limit(cpu_seconds: float) -> None:
+    # RLIMIT_CPU 按进程累计CPU时间计算，每个批次开始前在已用时间上追加额度
+    if resource is None or cpu_seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+    try:
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    except (ValueError, OSError):
+        pass
+
+
+def _worker_main(conn: Any, memory_limit_mb: int, cpu_seconds: float) -> None:
+    """
+    工作进程主循环
+    每次接收一个批次 [(表达式, 变量名, 输入值), ...]，
+    回复 [(True, 结果) 或 (False, (异常类型名, 错误信息)), ...]
+    """
+    # Ctrl+C 由服务进程处理，工作进程随之退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _apply_memory_limit(memory_limit_mb)
+
+    while True:
+        try:
+            batch = conn.recv()
+        except (EOFError, OSError):
+            break
+        if batch is None:
+            break
+
+        _extend_cpu_limit(cpu_seconds)
+        replies = []
+        for expression, variables, values in batch:
+            try:
+                result = compile_expression(expression, variables).evaluate_number(*values)
+                replies.append((True, result))
+            except Exception as e:
+                replies.append((False, (type(e).__name__, str(e))))
+        try:
+            conn.send(replies)
+        except (EOFError, OSError):
+            break
+
+
+# forkserver/spawn 方式启动的工作进程入口
+_WORKER_ENTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "expression_sandbox_worker.py")
+
+
+class _Worker:
+    """一个工作进程及其管道"""
+
+    def __init__(self, context: Any, memory_limit_mb: int, cpu_seconds: float):
+        self.conn, child_conn = context.Pipe()
+        target, args, kwargs = _worker_main, (child_conn, memory_limit_mb, cpu_seconds), {}
+        if context.get_start_method() != "fork":
+            # forkserver/spawn 在新进程中按模块名导入目标函数，而ComfyUI加载的包名
+            # （例如 comfyui-popo-utility）不能导入，所以改为按文件路径运行独立的入口脚本
+            bootstrap = {"package": __package__, "directory": os.path.dirname(_WORKER_ENTRY), "args": args}
+            target, args = runpy.run_path, (_WORKER_ENTRY,)
+            kwargs = {"run_name": "__popo_sandbox__", "init_globals": {"SANDBOX_BOOTSTRAP": bootstrap}}
+        self.process = context.Process(
+            target=target,
+            args=args,
+            kwargs=kwargs,
+            name="popo-expression-sandbox",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.batches = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):
+            pass
+        self.kill()
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    预先启动的表达式工作进程池
+
+    Args:
+        workers: 工作进程数量
+        memory_limit_mb: 每个工作进程额外可分配的内存（MB），0表示不限制
+        cpu_seconds: 每个批次允许使用的CPU时间（秒），0表示不限制
+        timeout: 每个表达式的等待时间（秒），默认为计算时间预算加0.5秒
+        max_batches: 工作进程处理多少个批次后被替换
+        start_method: 进程启动方式，默认见 _default_start_method
+        acquire_timeout: 等待空闲工作进程的最长时间（秒），超时抛出 SandboxError
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+        cpu_seconds: float = DEFAULT_CPU_SECONDS,
+        timeout: Optional[float] = None,
+        max_batches: int = DEFAULT_MAX_BATCHES,
+        start_method: Optional[str] = START_METHOD,
+        acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT,
+    ):
+        if workers < 1:
+            raise ValueError(f"工作进程数量至少为1: {workers}")
+        self._context = multiprocessing.get_context(start_method or _default_start_method())
+        self.size = workers
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.max_batches = max_batches
+        self.acquire_timeout = acquire_timeout
+        self.recycled = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        # 后进先出，优先复用最近用过的工作进程
+        self._idle: "queue.LifoQueue[_Worker]" = queue.LifoQueue()
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._context, self.memory_limit_mb, self.cpu_seconds)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _recycle(self, worker: _Worker) -> _Worker:
+        """终止工作进程并启动一个新的替换它"""
+        worker.kill()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self.recycled += 1
+        return self._spawn()
+
+    def _acquire(self, count: int) -> List[_Worker]:
+        """取得最多count个空闲工作进程，至少等待一个，超过 acquire_timeout 时抛出 SandboxError"""
+        if self._closed:
+            raise SandboxError("隔离计算进程池已关闭")
+        try:
+            workers = [self._idle.get(timeout=self.acquire_timeout)]
+        except queue.Empty:
+            raise SandboxError(f"等待空闲工作进程超过 {self.acquire_timeout} 秒") from None
+        while len(workers) < count:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            return [worker if worker.alive else self._recycle(worker) for worker in workers]
+        except BaseException:
+            # 启动替换进程失败：全部放回，已退出的进程在下次取得时再替换
+            for worker in workers:
+                self._idle.put(worker)
+            raise
+
+    def _release(self, worker: _Worker) -> None:
+        if self._closed:
+            worker.close()
+        elif worker.batches >= self.max_batches:
+            self._idle.put(self._recycle(worker))
+        else:
+            self._idle.put(worker)
+
+    def evaluate_many(
+        self,
+        requests: Sequence[Tuple[str, Sequence[Any]]],
+        variables: Tuple[str, ...] = DEFAULT_VARIABLES,
+    ) -> List[Any]:
+        """
+        批量计算表达式，请求平均分配给空闲的工作进程，每个工作进程只往返一次
+
+        Args:
+            requests: [(表达式, 输入值), ...]
+            variables: 变量名
+
+        Returns:
+            与请求一一对应的结果，计算失败的位置为异常对象（ExpressionError或其子类）
+        """
+        requests = list(requests)
+        if not requests:
+            return []
+
+        workers = self._acquire(min(len(requests), self.size))
+        # 还没有归还的工作进程；出现意外的异常（例如输入无法序列化或调用线程被中断）时，
+        # 在 finally 中回收替换，管道里可能还有未读取的回复，不能直接放回
+        outstanding = list(workers)
+        try:
+            step = -(-len(requests) // len(workers))
+            chunks = [requests[i:i + step] for i in range(0, len(requests), step)]
+            results: List[Any] = []
+
+            sent = []
+            for worker, chunk in zip(workers, chunks):
+                try:
+                    worker.conn.send([(expression, tuple(variables), tuple(values)) for expression, values in chunk])
+                    sent.append((worker, chunk, None))
+                except (EOFError, OSError) as e:
+                    sent.append((worker, chunk, e))
+            # 多取到的工作进程直接归还
+            for worker in workers[len(chunks):]:
+                outstanding.remove(worker)
+                self._release(worker)
+
+            budget = self.timeout if self.timeout is not None else get_limits().time_budget + 0.5
+            for worker, chunk, error in sent:
+                try:
+                    if error is None and worker.conn.poll(budget * len(chunk)):
+                        replies = worker.conn.recv()
+                        worker.batches += 1
+                        results.extend(self._unpack(reply) for reply in replies)
+                        outstanding.remove(worker)
+                        self._release(worker)
+                        continue
+                    failure = SandboxError("表达式计算超时，工作进程已被回收") if error is None else error
+                except (EOFError, OSError) as e:
+                    failure = e
+                # 超时或进程异常退出：回收工作进程，该批次全部失败
+                if not isinstance(failure, SandboxError):
+                    failure = SandboxError(f"工作进程异常退出（可能超出资源限制）: {str(failure) or '连接已断开'}")
+                results.extend(failure for _ in chunk)
+                outstanding.remove(worker)
+                self._release(self._recycle(worker))
+
+            return results
+        finally:
+            for worker in outstanding:
+                self._release(self._recycle(worker))
+
+    @staticmethod
+    def _unpack(reply: Tuple[bool, Any]) -> Any:
+        ok, payload = reply
+        if ok:
+            return payload
+        name, message = payload
+        if name == "ExpressionBudgetError":
+            return ExpressionBudgetError(message)
+        if name == "MemoryError":
+            return SandboxError(f"表达式超出内存限制: {message}")
+        return ExpressionError(message)
+
+    def evaluate(self, expression: str, values: Sequence[Any], variables: Tuple[str, ...] = DEFAULT_VARIABLES) -> Any:
+        """在工作进程中计算单个表达式，失败时抛出异常"""
+        (result,) = self.evaluate_many([(expression, values)], variables)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self) -> None:
+        """关闭所有工作进程"""
+        self._closed = True
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+
+    def pids(self) -> List[int]:
+        """当前工作进程的PID，用于调试"""
+        with self._lock:
+            return [worker.process.pid for worker in self._workers]
+
+
+_pool: Optional[SandboxPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """获取全局工作进程池，首次使用时启动（开启 SANDBOX_ENABLED 时在导入模块时启动）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = SandboxPool()
+        return _pool
+
+
+def shutdown_sandbox_pool() -> None:
+    """关闭全局工作进程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(shutdown_sandbox_pool)
+
+# 默认开启隔离计算时，在注册节点（服务进程还没有启动其他线程）时就启动进程池，
+# 工作进程可以直接fork并继承已加载的模块
+if SANDBOX_ENABLED:
+    get_sandbox_pool()
@@ -0,0 +1,36 @@
+"""
+ComfyUI Popo Utility - 隔离计算工作进程入口
+forkserver/spawn 方式启动的工作进程通过 runpy.run_path 按文件路径运行本文件，
+不要求节点包的名称可以导入（ComfyUI按目录名加载自定义节点，例如 comfyui-popo-utility）
+
+本文件不使用相对导入，也不应被节点包导入
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+from typing import Any, Tuple
+
+
+def load_sandbox_module(package: str, directory: str) -> Any:
+    """
+    按目录加载 expression_sandbox 模块，模块名与服务进程中一致
+    只创建包对象而不执行包的 __init__，工作进程不需要加载torch等节点依赖
+    """
+    if package not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            package,
+            os.path.join(directory, "__init__.py"),
+            submodule_search_locations=[directory],
+        )
+        sys.modules[package] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f"{package}.expression_sandbox")
+
+
+def run(package: str, directory: str, args: Tuple[Any, ...]) -> None:
+    load_sandbox_module(package, directory)._worker_main(*args)
+
+
+if __name__ == "__popo_sandbox__":
+    run(**SANDBOX_BOOTSTRAP)  # noqa: F821  由 runpy.run_path 的 init_globals 传入
@@ -0,0 +1,161 @@
+"""
+ComfyUI Popo Utility - 参数扫描序列
+在整个索引范围上用向量化表达式生成扫描值，按分块计算
+
+ComfyUI 在节点返回后立即展开 OUTPUT_IS_LIST 输出，节点通过 LazySweep.to_lists 在返回前
+生成全部值；按需计算分块只对直接使用 LazySweep 随机访问的代码有效
+
+表达式中可用的变量:
+    i - 从0开始的索引
+    x - 当前扫描值 start + i * step
+    n - 序列长度
+"""
+
+import math
+import threading
+from collections.abc import Sequence
+from typing import Any, List, Tuple
+
+from .cache_utils import LRUCache
+from .expression_vector import compile_vector_expression, evaluate_vectorized, to_result_lists
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+SWEEP_VARIABLES: Tuple[str, ...] = ("i", "x", "n")
+
+# 每个分块的元素数
+DEFAULT_SWEEP_CHUNK = 4096
+
+# 允许的最大序列长度
+MAX_SWEEP_LENGTH = 10_000_000
+
+
+def plan_sweep(start: float, stop: float, step: float = 0.0, count: int = 0) -> Tuple[int, float]:
+    """
+    计算扫描的长度和步长，stop包含在范围内
+
+    count大于0时在 [start, stop] 上均匀取count个值，忽略step；
+    否则按step从start走到stop（允许浮点误差）
+
+    Returns:
+        (长度, 步长)
+    """
+    count = int(count)
+    if count > 0:
+        if count > MAX_SWEEP_LENGTH:
+            raise ValueError(f"扫描长度不能超过 {MAX_SWEEP_LENGTH}")
+        return count, (stop - start) / (count - 1) if count > 1 else 0.0
+
+    if step == 0 or not math.isfinite(step):
+        raise ValueError("step为0时需要指定count")
+    span = (stop - start) / step
+    if span < 0:
+        raise ValueError("step的方向与start到stop的方向相反")
+    # 容许步长累积的浮点误差，使 0 到 1 步长 0.1 包含 1.0
+    length = int(math.floor(span + 1e-9)) + 1
+    if length > MAX_SWEEP_LENGTH:
+        raise ValueError(f"扫描长度不能超过 {MAX_SWEEP_LENGTH}")
+    return length, float(step)
+
+
+class LazySweep:
+    """
+    按需分块计算的扫描序列
+    只有被访问的分块才会计算，最近访问的分块保存在有界缓存中，
+    float_values / int_values 两个视图共享同一份分块缓存；分块计算失败时直接抛出异常
+    """
+
+    def __init__(
+        self,
+        expression: str,
+        start: float,
+        step: float,
+        length: int,
+        chunk_size: int = DEFAULT_SWEEP_CHUNK,
+    ):
+        # 立即编译，表达式错误在创建时就抛出
+        compile_vector_expression(expression, SWEEP_VARIABLES)
+        self.expression = expression
+        self.start = float(start)
+        self.step = float(step)
+        self.length = int(length)
+        self.chunk_size = max(int(chunk_size), 1)
+        self._chunks = LRUCache(16)
+        self._lock = threading.Lock()
+        self.float_values = _SweepView(self, 1)
+        self.int_values = _SweepView(self, 0)
+
+    def _chunk(self, index: int) -> Tuple[List[int], List[float]]:
+        def build() -> Tuple[List[int], List[float]]:
+            lo = index * self.chunk_size
+            hi = min(lo + self.chunk_size, self.length)
+            indices = np.arange(lo, hi, dtype=np.float64)
+            result = evaluate_vectorized(
+                self.expression, (indices, self.start + indices * self.step, [self.length]), SWEEP_VARIABLES
+            )
+            return to_result_lists(result)
+
+        with self._lock:
+            return self._chunks.get_or_create(index, build)
+
+    def item(self, position: int, column: int) -> Any:
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError("扫描序列索引超出范围")
+        chunk, offset = divmod(position, self.chunk_size)
+        return self._chunk(chunk)[column][offset]
+
+    def iterate(self, column: int):
+        for chunk in range(-(-self.length // self.chunk_size)):
+            yield from self._chunk(chunk)[column]
+
+    def to_lists(self) -> Tuple[List[float], List[int]]:
+        """一次生成全部值，返回 (浮点列表, 整数列表)，每个分块只计算一次"""
+        floats: List[float] = []
+        ints: List[int] = []
+        for chunk in range(-(-self.length // self.chunk_size)):
+            int_part, float_part = self._chunk(chunk)
+            floats.extend(float_part)
+            ints.extend(int_part)
+        return floats, ints
+
+
+class _SweepView(Sequence):
+    """LazySweep 的整数列或浮点列"""
+
+    def __init__(self, sweep: LazySweep, column: int):
+        self._sweep = sweep
+        self._column = column
+
+    def __len__(self) -> int:
+        return self._sweep.length
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [self._sweep.item(position, self._column) for position in range(*index.indices(len(self)))]
+        return self._sweep.item(index, self._column)
+
+    def __iter__(self):
+        return self._sweep.iterate(self._column)
+
+    def __repr__(self) -> str:
+        kind = "int" if self._column == 0 else "float"
+        return f"<LazySweep {kind} len={len(self)} expression={self._sweep.expression!r}>"
+
+
+def make_sweep(
+    expression: str,
+    start: float,
+    stop: float,
+    step: float = 0.0,
+    count: int = 0,
+    chunk_size: int = DEFAULT_SWEEP_CHUNK,
+) -> LazySweep:
+    """根据范围参数创建惰性扫描序列，参数或表达式无效时抛出异常"""
+    length, step = plan_sweep(start, stop, step, count)
+    return LazySweep(expression, start, step, length, chunk_size)
@@ -0,0 +1,216 @@
+"""
+ComfyUI Popo Utility - 表达式类型与范围推断
+在语法树上静态推断每个子表达式是整数还是浮点数以及取值范围，
+用于判断表达式在整数输入下是否始终保持整数，从而使用精确的整数运算
+"""
+
+import ast
+import math
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+INT = "int"
+FLOAT = "float"
+
+
+class ValueInfo(NamedTuple):
+    """子表达式的推断结果：类型和取值范围 [low, high]，未知的边界为无穷"""
+
+    kind: str
+    low: float = -math.inf
+    high: float = math.inf
+
+    @property
+    def integral(self) -> bool:
+        return self.kind == INT
+
+
+UNKNOWN_FLOAT = ValueInfo(FLOAT)
+UNKNOWN_INT = ValueInfo(INT)
+BOOLEAN = ValueInfo(INT, 0, 1)
+
+
+def _as_bound(value: int) -> float:
+    """范围边界统一为浮点数，超出浮点范围的整数视为无穷"""
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+
+def _bounds(*values: float) -> Tuple[float, float]:
+    """端点运算结果的范围，出现NaN（如 0*inf）时范围未知"""
+    if any(math.isnan(value) for value in values):
+        return -math.inf, math.inf
+    return min(values), max(values)
+
+
+def _join(kind: str, infos: Iterable[ValueInfo]) -> ValueInfo:
+    infos = list(infos)
+    return ValueInfo(kind, min(info.low for info in infos), max(info.high for info in infos))
+
+
+def _all_integral(infos: Iterable[ValueInfo]) -> str:
+    return INT if all(info.integral for info in infos) else FLOAT
+
+
+def _abs(info: ValueInfo) -> ValueInfo:
+    if info.low >= 0:
+        return info
+    if info.high <= 0:
+        return ValueInfo(info.kind, -info.high, -info.low)
+    return ValueInfo(info.kind, 0, max(-info.low, info.high))
+
+
+class _TypeInference:
+    """
+    自底向上推断语法树的类型和范围
+    输入变量假定为范围未知的整数，CSE临时变量取其绑定表达式的推断结果
+    """
+
+    def __init__(self, variables: Sequence[str], functions: Dict[str, Any], bindings: Optional[Dict[str, ValueInfo]] = None):
+        self.variables = set(variables)
+        self.functions = functions
+        self.bindings: Dict[str, ValueInfo] = dict(bindings or {})
+
+    def infer(self, node: ast.AST) -> ValueInfo:
+        method = getattr(self, f"_infer_{type(node).__name__}", None)
+        return method(node) if method else UNKNOWN_FLOAT
+
+    def _infer_Expression(self, node: ast.Expression) -> ValueInfo:
+        return self.infer(node.body)
+
+    def _infer_Constant(self, node: ast.Constant) -> ValueInfo:
+        value = node.value
+        if isinstance(value, (bool, int)):
+            bound = _as_bound(value)
+            return ValueInfo(INT, bound, bound)
+        if isinstance(value, float) and not math.isnan(value):
+            return ValueInfo(FLOAT, value, value)
+        return UNKNOWN_FLOAT
+
+    def _infer_Name(self, node: ast.Name) -> ValueInfo:
+        if node.id in self.bindings:
+            return self.bindings[node.id]
+        if node.id in self.variables:
+            return UNKNOWN_INT
+        value = self.functions.get(node.id)
+        if isinstance(value, (int, float)) and not callable(value):
+            return self._infer_Constant(ast.Constant(value=value))
+        return UNKNOWN_FLOAT
+
+    def _infer_NamedExpr(self, node: ast.NamedExpr) -> ValueInfo:
+        info = self.infer(node.value)
+        self.bindings[node.target.id] = info
+        return info
+
+    def _infer_BinOp(self, node: ast.BinOp) -> ValueInfo:
+        left, right = self.infer(node.left), self.infer(node.right)
+        kind = _all_integral((left, right))
+
+        if isinstance(node.op, ast.Add):
+            return ValueInfo(kind, *_bounds(left.low + right.low, left.high + right.high))
+        if isinstance(node.op, ast.Sub):
+            return ValueInfo(kind, *_bounds(left.low - right.high, left.high - right.low))
+        if isinstance(node.op, ast.Mult):
+            return ValueInfo(kind, *_bounds(
+                left.low * right.low, left.low * right.high,
+                left.high * right.low, left.high * right.high,
+            ))
+        if isinstance(node.op, ast.Div):
+            return UNKNOWN_FLOAT
+        if isinstance(node.op, ast.Mod):
+            # 除数为正时余数落在 [0, 除数)
+            if right.low > 0:
+                return ValueInfo(kind, 0, right.high)
+            return ValueInfo(kind)
+        if isinstance(node.op, ast.FloorDiv):
+            return ValueInfo(kind)
+        if isinstance(node.op, ast.Pow):
+            return self._power(left, right)
+        return UNKNOWN_FLOAT
+
+    @staticmethod
+    def _power(base: ValueInfo, exponent: ValueInfo) -> ValueInfo:
+        # 整数的负指数幂是浮点数，只有指数可证明非负时结果才保持整数
+        kind = INT if base.integral and exponent.integral and exponent.low >= 0 else FLOAT
+        if base.low >= 0:
+            return ValueInfo(kind, 0, math.inf)
+        return ValueInfo(kind)
+
+    def _infer_UnaryOp(self, node: ast.UnaryOp) -> ValueInfo:
+        operand = self.infer(node.operand)
+        if isinstance(node.op, ast.Not):
+            return BOOLEAN
+        if isinstance(node.op, ast.USub):
+            return ValueInfo(operand.kind, -operand.high, -operand.low)
+        return operand
+
+    def _infer_Compare(self, node: ast.Compare) -> ValueInfo:
+        self.infer(node.left)
+        for comparator in node.comparators:
+            self.infer(comparator)
+        return BOOLEAN
+
+    def _infer_BoolOp(self, node: ast.BoolOp) -> ValueInfo:
+        # and/or 返回某个操作数本身
+        infos = [self.infer(value) for value in node.values]
+        return _join(_all_integral(infos), infos)
+
+    def _infer_IfExp(self, node: ast.IfExp) -> ValueInfo:
+        self.infer(node.test)
+        infos = [self.infer(node.body), self.infer(node.orelse)]
+        return _join(_all_integral(infos), infos)
+
+    def _infer_Call(self, node: ast.Call) -> ValueInfo:
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        args = [self.infer(arg) for arg in node.args]
+        keywords = {keyword.arg: self.infer(keyword.value) for keyword in node.keywords}
+
+        if name == "abs" and len(args) == 1:
+            return _abs(args[0])
+        if name in ("int", "ceil", "floor") and len(args) == 1:
+            return ValueInfo(INT, *_bounds(args[0].low - 1, args[0].high + 1))
+        if name == "round":
+            # round(x) 总是返回整数，round(x, n) 保持x的类型
+            if len(args) == 1 and not keywords:
+                return ValueInfo(INT, *_bounds(args[0].low - 1, args[0].high + 1))
+            return ValueInfo(args[0].kind) if args else UNKNOWN_FLOAT
+        if name in ("min", "max") and args and not keywords:
+            pick = min if name == "min" else max
+            return ValueInfo(
+                _all_integral(args), pick(arg.low for arg in args), pick(arg.high for arg in args)
+            )
+        if name == "pow" and len(args) == 2 and not keywords:
+            return self._power(*args)
+        if name == "pow" and len(args) == 3:
+            return UNKNOWN_INT
+        if name == "factorial":
+            return ValueInfo(INT, 1, math.inf)
+        if name in ("gcd", "lcm"):
+            return ValueInfo(INT, 0, math.inf)
+        if name == "clamp":
+            # 默认区间 [0.0, 1.0] 是浮点数，只有三个参数都是整数时结果才是整数
+            bounds = args[1:] + [keywords[key] for key in ("low", "high") if key in keywords]
+            if len(args) >= 1 and len(bounds) == 2:
+                return ValueInfo(_all_integral([args[0]] + bounds), bounds[0].low, bounds[1].high)
+            return ValueInfo(FLOAT, 0, 1)
+        return UNKNOWN_FLOAT
+
+
+def infer_expression(
+    tree: ast.AST,
+    variables: Sequence[str],
+    functions: Dict[str, Any],
+    bindings: Optional[Dict[str, ValueInfo]] = None,
+) -> ValueInfo:
+    """
+    推断表达式在整数输入下的类型和取值范围
+
+    Args:
+        tree: 表达式语法树
+        variables: 输入变量名，假定为整数
+        functions: 函数和常量表（用于识别 pi 等浮点常量）
+        bindings: 已知名称的推断结果，例如多行程序中前面语句的结果
+    """
+    return _TypeInference(variables, functions, bindings).infer(tree)
+
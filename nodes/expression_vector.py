@@ -0,0 +1,503 @@
+"""
+ComfyUI Popo Utility - 向量化表达式计算
+把白名单表达式编译到NumPy/PyTorch的逐元素运算上，一次计算整个数组或整批图片
+"""
+
+import ast
+import copy
+import math
+from functools import reduce
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .cache_utils import LRUCache
+from .expression_blocks import PARALLEL_MIN_ELEMENTS, compile_block_program, evaluate_blocked
+from .expression_engine import (
+    DEFAULT_VARIABLES,
+    ExpressionBudgetError,
+    ExpressionError,
+    compile_expression,
+    get_limits,
+    guarded_pow,
+    on_limits_changed,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+# 特殊值的替换规则与标量计算保持一致
+NAN_REPLACEMENT = 0.0
+INF_REPLACEMENT = 999999.0
+
+# 逐像素计算时每个分块的最大元素数（约16MB的float32临时张量）
+DEFAULT_CHUNK_ELEMENTS = 1 << 22
+
+
+class _VectorizeTransformer(ast.NodeTransformer):
+    """
+    把依赖Python真值判断的语法改写为逐元素函数调用
+    条件表达式 -> _where，and/or/not -> _and/_or/_not，链式比较 -> _and
+    不含变量的 ** 运算（优化器未折叠的大整数幂）-> 带位数限制的 _pow
+    """
+
+    @staticmethod
+    def _call(name: str, args: List[ast.expr], like: ast.AST) -> ast.Call:
+        node = ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+        return ast.copy_location(node, like)
+
+    def visit_IfExp(self, node: ast.IfExp) -> ast.AST:
+        self.generic_visit(node)
+        return self._call("_where", [node.test, node.body, node.orelse], node)
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:
+        self.generic_visit(node)
+        name = "_and" if isinstance(node.op, ast.And) else "_or"
+        return reduce(lambda left, right: self._call(name, [left, right], node), node.values)
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call("_not", [node.operand], node)
+        return node
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        if not isinstance(node.op, ast.Pow):
+            return node
+        if any(isinstance(child, ast.Name) for child in ast.walk(node)):
+            return node
+        return self._call("_pow", [node.left, node.right], node)
+
+    def visit_Compare(self, node: ast.Compare) -> ast.AST:
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.copy_location(
+                ast.Compare(left=left, ops=[op], comparators=[right]), node
+            ))
+            left = right
+        return reduce(lambda x, y: self._call("_and", [x, y], node), parts)
+
+
+def _reject(name: str):
+    def unsupported(*args, **kwargs):
+        raise ExpressionError(f"批量模式不支持该用法: {name}")
+    return unsupported
+
+
+def _numpy_log(x, base=None):
+    if base is None:
+        return np.log(x)
+    return np.log(x) / np.log(base)
+
+
+def _numpy_round(x, ndigits=0):
+    return np.round(x, int(ndigits))
+
+
+def _numpy_pow(x, y, mod=None):
+    if mod is not None:
+        return _reject("pow(x, y, mod)")()
+    if isinstance(x, int) and isinstance(y, int):
+        return guarded_pow(x, y)
+    return np.power(x, y)
+
+
+def _numpy_integer(x):
+    values = np.asarray(x)
+    if not np.all(np.isfinite(values)) or np.any(values != np.trunc(values)):
+        raise ExpressionError("gcd/lcm/factorial 只接受整数")
+    return values.astype(np.int64)
+
+
+def _numpy_factorial(x):
+    values = _numpy_integer(x)
+    if np.any(values < 0):
+        raise ExpressionError("factorial 不接受负数")
+    if np.any(values > get_limits().max_factorial):
+        raise ExpressionBudgetError(f"factorial 参数不能超过 {get_limits().max_factorial}")
+    return np.vectorize(lambda v: float(math.factorial(int(v))), otypes=[np.float64])(values)
+
+
+def _numpy_namespace() -> Dict[str, Any]:
+    """构建 math 函数到 NumPy ufunc 的映射"""
+    return {
+        'abs': np.abs,
+        'round': _numpy_round,
+        'int': np.trunc,
+        'float': lambda x: np.asarray(x, dtype=np.float64),
+        'min': lambda *args: reduce(np.minimum, args),
+        'max': lambda *args: reduce(np.maximum, args),
+        'pow': _numpy_pow,
+        '_pow': _numpy_pow,
+        'clamp': lambda x, low=0.0, high=1.0: np.clip(x, low, high),
+        'ceil': np.ceil,
+        'floor': np.floor,
+        'sqrt': np.sqrt,
+        'exp': np.exp,
+        'log': _numpy_log,
+        'log10': np.log10,
+        'log2': np.log2,
+        'sin': np.sin,
+        'cos': np.cos,
+        'tan': np.tan,
+        'asin': np.arcsin,
+        'acos': np.arccos,
+        'atan': np.arctan,
+        'atan2': np.arctan2,
+        'sinh': np.sinh,
+        'cosh': np.cosh,
+        'tanh': np.tanh,
+        'asinh': np.arcsinh,
+        'acosh': np.arccosh,
+        'atanh': np.arctanh,
+        'degrees': np.degrees,
+        'radians': np.radians,
+        'fabs': np.fabs,
+        'factorial': _numpy_factorial,
+        'gcd': lambda x, y: np.gcd(_numpy_integer(x), _numpy_integer(y)),
+        'lcm': lambda x, y: np.lcm(_numpy_integer(x), _numpy_integer(y)),
+        'pi': math.pi,
+        'e': math.e,
+        'tau': math.tau,
+        'inf': math.inf,
+        'nan': math.nan,
+        '_where': np.where,
+        '_and': np.logical_and,
+        '_or': np.logical_or,
+        '_not': np.logical_not,
+    }
+
+
+def _torch_namespace(device: Any) -> Dict[str, Any]:
+    """构建 math 函数到 PyTorch 运算的映射，标量参数会被转换为张量"""
+    dtype = torch.float64 if device.type != "mps" else torch.float32
+
+    def tensor(x):
+        if isinstance(x, torch.Tensor):
+            return x
+        return torch.as_tensor(x, dtype=dtype, device=device)
+
+    def wrap(fn):
+        return lambda *args: fn(*(tensor(arg) for arg in args))
+
+    def integer(x):
+        values = tensor(x)
+        if values.is_floating_point():
+            if not bool(torch.all(torch.isfinite(values) & (values == torch.trunc(values)))):
+                raise ExpressionError("gcd/lcm/factorial 只接受整数")
+        return values.to(torch.int64)
+
+    def factorial(x):
+        values = integer(x)
+        if bool(torch.any(values < 0)):
+            raise ExpressionError("factorial 不接受负数")
+        return torch.round(torch.exp(torch.lgamma(values.to(dtype) + 1)))
+
+    def log(x, base=None):
+        if base is None:
+            return torch.log(tensor(x))
+        return torch.log(tensor(x)) / torch.log(tensor(base))
+
+    def round_(x, ndigits=0):
+        return torch.round(tensor(x), decimals=int(ndigits))
+
+    def pow_(x, y, mod=None):
+        if mod is not None:
+            return _reject("pow(x, y, mod)")()
+        if isinstance(x, int) and isinstance(y, int):
+            return guarded_pow(x, y)
+        return torch.pow(tensor(x), tensor(y))
+
+    return {
+        'abs': wrap(torch.abs),
+        'round': round_,
+        'int': wrap(torch.trunc),
+        'float': lambda x: tensor(x).to(dtype),
+        'min': lambda *args: reduce(torch.minimum, (tensor(arg) for arg in args)),
+        'max': lambda *args: reduce(torch.maximum, (tensor(arg) for arg in args)),
+        'pow': pow_,
+        '_pow': pow_,
+        'clamp': lambda x, low=0.0, high=1.0: torch.clamp(tensor(x), min=low, max=high),
+        'ceil': wrap(torch.ceil),
+        'floor': wrap(torch.floor),
+        'sqrt': wrap(torch.sqrt),
+        'exp': wrap(torch.exp),
+        'log': log,
+        'log10': wrap(torch.log10),
+        'log2': wrap(torch.log2),
+        'sin': wrap(torch.sin),
+        'cos': wrap(torch.cos),
+        'tan': wrap(torch.tan),
+        'asin': wrap(torch.asin),
+        'acos': wrap(torch.acos),
+        'atan': wrap(torch.atan),
+        'atan2': wrap(torch.atan2),
+        'sinh': wrap(torch.sinh),
+        'cosh': wrap(torch.cosh),
+        'tanh': wrap(torch.tanh),
+        'asinh': wrap(torch.asinh),
+        'acosh': wrap(torch.acosh),
+        'atanh': wrap(torch.atanh),
+        'degrees': wrap(torch.rad2deg),
+        'radians': wrap(torch.deg2rad),
+        'fabs': wrap(torch.abs),
+        'factorial': factorial,
+        'gcd': lambda x, y: torch.gcd(integer(x), integer(y)),
+        'lcm': lambda x, y: torch.lcm(integer(x), integer(y)),
+        'pi': math.pi,
+        'e': math.e,
+        'tau': math.tau,
+        'inf': math.inf,
+        'nan': math.nan,
+        '_where': lambda cond, x, y: torch.where(tensor(cond).to(torch.bool), tensor(x), tensor(y)),
+        '_and': wrap(torch.logical_and),
+        '_or': wrap(torch.logical_or),
+        '_not': wrap(torch.logical_not),
+    }
+
+
+class VectorExpression:
+    """
+    编译为逐元素运算的表达式
+    同一份字节码可以在NumPy数组或PyTorch张量上执行
+    """
+
+    __slots__ = ("source", "variables", "tree", "code")
+
+    def __init__(self, source: str, variables: Tuple[str, ...], tree: ast.AST, code: Any):
+        self.source = source
+        self.variables = variables
+        self.tree = tree
+        self.code = code
+
+    def evaluate(self, namespace: Dict[str, Any], *values: Any) -> Any:
+        """在给定的后端命名空间中计算，values按variables顺序传入"""
+        return eval(self.code, namespace, dict(zip(self.variables, values)))
+
+
+_vector_cache = LRUCache(128)
+# 缓存的语法树只按编译时的限制检查过，限制修改后重新编译
+on_limits_changed(_vector_cache.clear)
+_namespaces: Dict[Any, Dict[str, Any]] = {}
+
+
+def compile_vector_expression(
+    expression: str, variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> VectorExpression:
+    """检查并优化表达式后编译为向量化版本，结果会被缓存"""
+    variables = tuple(variables)
+
+    def build() -> VectorExpression:
+        optimized = compile_expression(expression, variables).optimized
+        tree = _VectorizeTransformer().visit(copy.deepcopy(optimized))
+        ast.fix_missing_locations(tree)
+        return VectorExpression(expression, variables, tree, compile(tree, "<vector-expression>", "eval"))
+
+    return _vector_cache.get_or_create((expression, variables), build)
+
+
+def get_namespace(backend: str, device: Any = None) -> Dict[str, Any]:
+    """获取指定后端的函数命名空间，按后端和设备缓存"""
+    key = (backend, str(device))
+    namespace = _namespaces.get(key)
+    if namespace is None:
+        if backend == "torch":
+            if torch is None:
+                raise ImportError("批量模式需要安装 PyTorch")
+            namespace = _torch_namespace(torch.device(device or "cpu"))
+        else:
+            if np is None:
+                raise ImportError("批量模式需要安装 NumPy")
+            namespace = _numpy_namespace()
+        namespace['__builtins__'] = {}
+        _namespaces[key] = namespace
+    return namespace
+
+
+def _is_tensor(value: Any) -> bool:
+    return torch is not None and isinstance(value, torch.Tensor)
+
+
+def flatten_values(values: Any) -> Any:
+    """
+    把FLOAT列表、张量或二者混合的列表展平为一维float64数组
+    包含张量时返回张量（保留设备），否则返回NumPy数组
+    """
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+
+    if any(_is_tensor(value) for value in values):
+        parts = [
+            value.reshape(-1).to(torch.float64) if _is_tensor(value)
+            else torch.as_tensor(np.asarray(value, dtype=np.float64).reshape(-1))
+            for value in values
+        ]
+        device = next(value.device for value in values if _is_tensor(value))
+        return torch.cat([part.to(device) for part in parts])
+
+    parts = [np.asarray(value, dtype=np.float64).reshape(-1) for value in values]
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float64)
+
+
+def broadcast_length(arrays: Sequence[Any]) -> int:
+    """检查各输入长度是否可以广播（长度为1或相同），返回结果长度"""
+    lengths = {int(array.shape[0]) for array in arrays if int(array.shape[0]) != 1}
+    if len(lengths) > 1:
+        raise ValueError(f"输入长度不一致，无法广播: {sorted(lengths)}")
+    if lengths:
+        return lengths.pop()
+    return 1 if any(int(array.shape[0]) == 1 for array in arrays) else 0
+
+
+def evaluate_vectorized(
+    expression: str, values: Sequence[Any], variables: Tuple[str, ...] = DEFAULT_VARIABLES
+) -> Any:
+    """
+    对一组数组输入计算表达式
+
+    Args:
+        expression: 表达式文本
+        values: 与variables一一对应的输入（FLOAT列表、数组或一维张量）
+        variables: 变量名
+
+    Returns:
+        一维float64数组，如果输入中包含张量则返回张量
+    """
+    compiled = compile_vector_expression(expression, variables)
+    arrays = [flatten_values(value) for value in values]
+    length = broadcast_length(arrays)
+
+    if any(_is_tensor(array) for array in arrays):
+        device = next(array.device for array in arrays if _is_tensor(array))
+        namespace = get_namespace("torch", device)
+        arrays = [
+            array.to(device) if _is_tensor(array) else torch.from_numpy(array).to(device)
+            for array in arrays
+        ]
+        result = compiled.evaluate(namespace, *arrays)
+        result = torch.as_tensor(result, device=device).to(torch.float64)
+        return result.expand(length).contiguous() if result.dim() == 0 else result.reshape(-1)
+
+    namespace = get_namespace("numpy")
+    if length >= PARALLEL_MIN_ELEMENTS:
+        # 大数组分块并行计算，避免每个运算符产生完整大小的临时数组
+        program = compile_block_program((expression, compiled.variables), compiled.tree, namespace, compiled.variables)
+        if program is not None:
+            return evaluate_blocked(program, arrays, length)
+
+    with np.errstate(all="ignore"):
+        result = compiled.evaluate(namespace, *arrays)
+    result = np.asarray(result, dtype=np.float64)
+    return np.broadcast_to(result, (length,)).copy() if result.ndim == 0 else result.reshape(-1)
+
+
+def to_result_lists(result: Any) -> Tuple[List[int], List[float]]:
+    """
+    把计算结果转换为 (INT列表, FLOAT列表)
+    NaN替换为0，正负无穷替换为±999999，与标量节点一致
+    """
+    if _is_tensor(result):
+        result = torch.nan_to_num(
+            result, nan=NAN_REPLACEMENT, posinf=INF_REPLACEMENT, neginf=-INF_REPLACEMENT
+        )
+        return torch.trunc(result).to(torch.int64).tolist(), result.tolist()
+
+    result = np.nan_to_num(
+        result, nan=NAN_REPLACEMENT, posinf=INF_REPLACEMENT, neginf=-INF_REPLACEMENT
+    )
+    return np.trunc(result).astype(np.int64).tolist(), result.tolist()
+
+
+def _as_image(value: Any) -> Any:
+    """把IMAGE [B,H,W,C]、MASK [B,H,W] 或单张 [H,W] 张量统一为四维"""
+    if value.dim() == 4:
+        return value
+    if value.dim() == 3:
+        return value.unsqueeze(-1)
+    if value.dim() == 2:
+        return value.unsqueeze(0).unsqueeze(-1)
+    raise ValueError(f"不支持的图片张量形状: {tuple(value.shape)}")
+
+
+def _chunk_slices(shape: Tuple[int, ...], chunk_elements: int):
+    """
+    按批次和行把 [B,H,W,C] 划分为分块
+    单张图片放得下时一次处理多张，否则按行切分
+    """
+    batch, height, width, channels = shape
+    image_elements = max(height * width * channels, 1)
+    if image_elements <= chunk_elements:
+        step = max(1, chunk_elements // image_elements)
+        for b0 in range(0, batch, step):
+            yield b0, min(b0 + step, batch), 0, height
+    else:
+        rows = max(1, chunk_elements // max(width * channels, 1))
+        for b0 in range(batch):
+            for r0 in range(0, height, rows):
+                yield b0, b0 + 1, r0, min(r0 + rows, height)
+
+
+def evaluate_image_expression(
+    expression: str,
+    values: Sequence[Any],
+    variables: Tuple[str, ...] = DEFAULT_VARIABLES,
+    chunk_elements: int = DEFAULT_CHUNK_ELEMENTS,
+) -> Any:
+    """
+    对图片张量逐像素计算表达式
+
+    输出张量预先分配，计算按批次/行分块进行，
+    每个分块的临时张量不超过chunk_elements个元素，整批图片只需要一份完整大小的输出
+
+    Args:
+        expression: 表达式文本
+        values: 与variables对应的输入，可以是图片张量或标量
+        variables: 变量名
+        chunk_elements: 每个分块的最大元素数
+
+    Returns:
+        [B,H,W,C] float32张量，批次和通道按广播规则确定
+    """
+    if torch is None:
+        raise ImportError("逐像素计算需要安装 PyTorch")
+
+    compiled = compile_vector_expression(expression, variables)
+    images = [_as_image(value) if _is_tensor(value) else None for value in values]
+    tensors = [image for image in images if image is not None]
+    if not tensors:
+        raise ValueError("至少需要一个图片输入")
+
+    device = tensors[0].device
+    shape = tuple(torch.broadcast_shapes(*(image.shape for image in tensors)))
+    namespace = get_namespace("torch", device)
+    out = torch.empty(shape, dtype=torch.float32, device=device)
+
+    with torch.no_grad():
+        for b0, b1, r0, r1 in _chunk_slices(shape, chunk_elements):
+            args = []
+            for value, image in zip(values, images):
+                if image is None:
+                    args.append(float(value))
+                    continue
+                part = image[b0:b1] if image.shape[0] != 1 else image[0:1]
+                part = part[:, r0:r1] if part.shape[1] != 1 else part
+                args.append(part.to(device, non_blocking=True))
+
+            target = out[b0:b1, r0:r1]
+            target.copy_(torch.as_tensor(compiled.evaluate(namespace, *args), device=device))
+            # 与标量节点相同：NaN替换为0，正负无穷替换为±999999，超出该范围的有限值同样截断
+            target.nan_to_num_(nan=NAN_REPLACEMENT, posinf=INF_REPLACEMENT, neginf=-INF_REPLACEMENT)
+            target.clamp_(-INF_REPLACEMENT, INF_REPLACEMENT)
+
+    return out
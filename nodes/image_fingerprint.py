@@ -0,0 +1,164 @@
+"""
+ComfyUI Popo Utility - 图片内容指纹
+为批次中的每张图片生成稳定的内容哈希，用于去重和缓存键
+
+- cheap: 形状 + 均匀抽样的 64×64 个像素，耗时与分辨率无关
+- exact: 按行块流式哈希全部像素，不复制整张图片
+- 感知哈希（dHash，64位）：缩小到 9×8 灰度后比较相邻像素，相似图片的汉明距离很小
+"""
+
+from typing import Any, Hashable, List, Optional, Sequence
+
+import torch
+import torch.nn.functional as F
+
+from .base_node import ImageProcessingNode
+from .cache_utils import content_fingerprint, make_fingerprint
+
+
+FINGERPRINT_MODES = ("cheap", "exact")
+
+# dHash 的网格大小：8行 × 9列，每行比较出8位
+PERCEPTUAL_HASH_SIZE = 8
+
+
+def perceptual_hash(image: torch.Tensor, size: int = PERCEPTUAL_HASH_SIZE) -> str:
+    """
+    计算单张 [H, W, C] 图片的差值哈希（dHash），返回 size*size 位的十六进制字符串
+
+    [H, W, C] 转置为 [1, C, H, W] 后正好是channels_last布局，平均池化直接读取原数据
+    """
+    if image.dim() != 3:
+        raise ValueError(f"不支持的图片形状: {tuple(image.shape)}")
+    planes = image.permute(2, 0, 1).unsqueeze(0)
+    if not planes.is_floating_point():
+        planes = planes.float()
+    small = F.adaptive_avg_pool2d(planes, (size, size + 1))[0].float().mean(dim=0)
+    bits = (small[:, 1:] > small[:, :-1]).flatten().tolist()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:0{(size * size + 3) // 4}x}"
+
+
+def hamming_distance(a: str, b: str) -> int:
+    """两个十六进制感知哈希之间不同的位数"""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def image_fingerprints(images: Any, mode: str = "cheap") -> List[str]:
+    """
+    为 [B, H, W, C] 批次（或单张 [H, W, C]）中的每张图片计算内容指纹
+
+    Raises:
+        ValueError: 模式未知或形状不支持
+    """
+    if mode not in FINGERPRINT_MODES:
+        raise ValueError(f"未知的指纹模式: {mode}")
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    if images.dim() != 4:
+        raise ValueError(f"不支持的图片形状: {tuple(images.shape)}")
+    return [content_fingerprint(image, exact=mode == "exact") for image in images]
+
+
+def duplicate_keys(images: Any, fingerprints: Sequence[str], mode: str) -> List[Hashable]:
+    """
+    判断重复时使用的键
+
+    cheap 指纹只覆盖抽样像素，指纹相同的图片可能只是未被抽样的像素不同；
+    这些图片再计算精确指纹确认，指纹唯一的图片不需要额外计算
+    """
+    if mode == "exact":
+        return list(fingerprints)
+    counts = {}
+    for fingerprint in fingerprints:
+        counts[fingerprint] = counts.get(fingerprint, 0) + 1
+    return [
+        (fingerprint, content_fingerprint(image, exact=True) if counts[fingerprint] > 1 else "")
+        for image, fingerprint in zip(images, fingerprints)
+    ]
+
+
+def find_duplicates(
+    fingerprints: Sequence[Hashable],
+    perceptual_hashes: Optional[Sequence[str]] = None,
+    max_distance: int = 0,
+) -> List[int]:
+    """
+    为每张图片找到与它重复的第一张图片的下标，没有重复时为 -1
+
+    fingerprints 相等即视为重复，cheap 指纹需要先经过 duplicate_keys 确认；
+    给出感知哈希且 max_distance > 0 时，汉明距离不超过 max_distance 的图片也视为重复
+    """
+    first = {}
+    duplicates = []
+    for index, fingerprint in enumerate(fingerprints):
+        match = first.setdefault(fingerprint, index)
+        if match == index and perceptual_hashes is not None and max_distance > 0:
+            match = next(
+                (j for j in range(index)
+                 if duplicates[j] == -1 and hamming_distance(perceptual_hashes[j], perceptual_hashes[index]) <= max_distance),
+                index,
+            )
+        duplicates.append(-1 if match == index else match)
+    return duplicates
+
+
+def fingerprint_outputs(image: Any, mode: str, perceptual: bool = False, max_distance: int = 0) -> tuple:
+    """指纹节点的输出，两套节点共用"""
+    fingerprints = image_fingerprints(image, mode)
+    batch = image if image.dim() == 4 else image.unsqueeze(0)
+    hashes = [perceptual_hash(item) for item in batch] if perceptual else None
+    duplicates = find_duplicates(duplicate_keys(batch, fingerprints, mode), hashes, max_distance)
+    return (
+        fingerprints,
+        make_fingerprint(mode, *fingerprints),
+        hashes or [""] * len(fingerprints),
+        duplicates,
+    )
+
+
+class ImageFingerprintNode(ImageProcessingNode):
+    """
+    图片内容指纹节点
+    输出每张图片的指纹、整个批次的指纹、可选的感知哈希和重复图片的下标
+    """
+
+    DESCRIPTION = "为批次中的每张图片计算内容哈希（快速抽样或完整精确），可选感知哈希，用于去重和缓存键"
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "INT")
+    RETURN_NAMES = ("fingerprint", "batch_fingerprint", "perceptual_hash", "duplicate_of")
+    FUNCTION = "fingerprint"
+    OUTPUT_IS_LIST = (True, False, True, True)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "mode": (list(FINGERPRINT_MODES), {"default": "cheap"}),
+            },
+            "optional": {
+                "perceptual": ("BOOLEAN", {"default": False}),
+                "max_distance": ("INT", {"default": 0, "min": 0, "max": 64}),
+            }
+        }
+
+    def fingerprint(self, image, mode, perceptual=False, max_distance=0):
+        """
+        计算图片指纹
+
+        Returns:
+            tuple: (每张图片的指纹列表, 批次指纹, 感知哈希列表（未启用时为空字符串）, 重复图片下标列表)
+        """
+        try:
+            return fingerprint_outputs(image, mode, perceptual, max_distance)
+
+        except Exception as e:
+            self.log_error(e, "fingerprint")
+            return ([""], "", [""], [-1])
+
+
+NODE_CLASSES = [
+    ImageFingerprintNode,
+]
@@ -0,0 +1,261 @@
+"""
+ComfyUI Popo Utility - 按尺寸分组
+把尺寸混杂的图片列表重新组合成尺寸一致的批次，下游的采样、放大等节点对每组只执行一次批量调用，
+处理完成后用配套的节点按原始顺序还原
+
+分组依据可以是精确尺寸 (H, W)，也可以是宽高比分桶（此时每张图片先缩放裁剪到桶尺寸）
+"""
+
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from .aspect_buckets import BUCKET_PRESETS, BucketAssignment, _first, get_bucket_table
+from .base_node import ImageProcessingNode
+from .image_utils import collect_image_sizes
+
+
+# 分组依据：size 按精确尺寸，bucket 按宽高比分桶
+GROUP_MODES = ("size", "bucket")
+
+
+class ImageGroups(NamedTuple):
+    """
+    分组结果
+    images 为每组一个的批次张量；order[i] 为原列表展开后第i张图片在所有组依次展开后的位置；
+    batch_sizes 为原列表每一项的批次大小，用于还原原来的列表结构
+    """
+
+    images: List[torch.Tensor]
+    order: List[int]
+    batch_sizes: List[int]
+
+
+def _as_batch(image: Any) -> torch.Tensor:
+    if image.dim() == 3:
+        return image.unsqueeze(0)
+    if image.dim() != 4:
+        raise ValueError(f"不支持的图片形状: {tuple(image.shape)}")
+    return image
+
+
+def _fit_bucket(image: torch.Tensor, assignment: BucketAssignment) -> torch.Tensor:
+    """把单张 [H, W, C] 图片等比缩放后居中裁剪到桶尺寸"""
+    height, width = image.shape[0], image.shape[1]
+    if (assignment.resize_width, assignment.resize_height) != (width, height):
+        planes = image.permute(2, 0, 1).unsqueeze(0)
+        if not planes.is_floating_point():
+            planes = planes.float()
+        planes = F.interpolate(
+            planes, size=(assignment.resize_height, assignment.resize_width),
+            mode="bilinear", align_corners=False, antialias=True,
+        )
+        image = planes[0].permute(1, 2, 0)
+    return image[
+        assignment.crop_y:assignment.crop_y + assignment.height,
+        assignment.crop_x:assignment.crop_x + assignment.width,
+    ]
+
+
+def group_images(
+    images: Any,
+    mode: str = "size",
+    preset: str = "sdxl",
+    custom_buckets: str = "",
+    step: int = 64,
+) -> ImageGroups:
+    """
+    把图片列表按尺寸或宽高比分桶分组，每组合并成一个连续的批次张量
+
+    通道数、数据类型或设备不同的图片不会分到同一组；
+    一组恰好是原列表中一个完整批次时直接复用原张量，不复制
+
+    Args:
+        images: 图片张量列表（尺寸可以各不相同），也可以是单个张量
+        mode: GROUP_MODES 之一
+        preset, custom_buckets, step: mode 为 "bucket" 时的桶表参数，见 get_bucket_table
+
+    Raises:
+        ValueError: 模式未知、形状不支持或桶表参数无效
+    """
+    if mode not in GROUP_MODES:
+        raise ValueError(f"未知的分组方式: {mode}")
+    if not isinstance(images, (list, tuple)):
+        images = [images]
+    sources = [_as_batch(image) for image in images]
+    batch_sizes = [int(source.shape[0]) for source in sources]
+    items = [(index, b) for index, size in enumerate(batch_sizes) for b in range(size)]
+    sizes = collect_image_sizes(sources, True)
+
+    assignments: Optional[List[BucketAssignment]] = None
+    targets = sizes
+    if mode == "bucket":
+        assignments = get_bucket_table(preset, custom_buckets, step).assign_many(sizes)
+        targets = [(assignment.width, assignment.height) for assignment in assignments]
+
+    # 按第一次出现的顺序分组，保持组内原有的相对顺序
+    groups: Dict[Tuple, List[int]] = {}
+    for i, (index, _) in enumerate(items):
+        source = sources[index]
+        groups.setdefault((targets[i], source.shape[3], source.dtype, source.device), []).append(i)
+
+    grouped: List[torch.Tensor] = []
+    order = [0] * len(items)
+    position = 0
+    for ((width, height), channels, dtype, device), members in groups.items():
+        first_source = items[members[0]][0]
+        if (assignments is None or targets[members[0]] == sizes[members[0]]) \
+                and len(members) == batch_sizes[first_source] \
+                and all(items[m] == (first_source, b) for b, m in enumerate(members)):
+            batch = sources[first_source]
+        else:
+            batch = torch.empty((len(members), height, width, channels), dtype=dtype, device=device)
+            for k, m in enumerate(members):
+                index, b = items[m]
+                image = sources[index][b]
+                batch[k].copy_(image if assignments is None else _fit_bucket(image, assignments[m]))
+        grouped.append(batch)
+        for m in members:
+            order[m] = position
+            position += 1
+    return ImageGroups(grouped, order, batch_sizes)
+
+
+def restore_order(
+    images: Any,
+    order: Sequence[int],
+    batch_sizes: Optional[Sequence[int]] = None,
+) -> List[torch.Tensor]:
+    """
+    按 group_images 输出的 order 把处理后的分组还原为原始顺序
+
+    Args:
+        images: 处理后的分组批次列表，每组的图片数量必须与分组时相同
+        order: group_images 输出的 order
+        batch_sizes: group_images 输出的 batch_sizes；给出时按原列表结构重新合并批次，
+                     否则每张图片单独作为一项
+
+    Returns:
+        还原顺序后的图片列表，元素为原批次张量的切片视图（合并批次时为新张量）
+    """
+    if not isinstance(images, (list, tuple)):
+        images = [images]
+    flat = [batch[b:b + 1] for batch in map(_as_batch, images) for b in range(batch.shape[0])]
+    if sorted(order) != list(range(len(flat))):
+        raise ValueError(f"顺序索引与图片数量不匹配: {len(order)} 个索引, {len(flat)} 张图片")
+    restored = [flat[position] for position in order]
+    if not batch_sizes:
+        return restored
+    if sum(batch_sizes) != len(restored):
+        raise ValueError(f"批次大小之和 {sum(batch_sizes)} 与图片数量 {len(restored)} 不一致")
+
+    result = []
+    start = 0
+    for size in batch_sizes:
+        part = restored[start:start + size]
+        result.append(part[0] if size == 1 else torch.cat(part))
+        start += size
+    return result
+
+
+def grouping_input_types() -> Dict[str, Dict[str, tuple]]:
+    """分组节点的输入定义，两套节点共用"""
+    return {
+        "required": {
+            "image": ("IMAGE",),
+            "group_by": (list(GROUP_MODES), {"default": "size"}),
+        },
+        "optional": {
+            "preset": (list(BUCKET_PRESETS), {"default": "sdxl"}),
+            "step": ("INT", {"default": 64, "min": 8, "max": 512, "step": 8}),
+            "custom_buckets": ("STRING", {"default": "1024x1024, 1152x896, 896x1152", "multiline": True}),
+        }
+    }
+
+
+def restore_input_types() -> Dict[str, Dict[str, tuple]]:
+    """还原顺序节点的输入定义，两套节点共用"""
+    return {
+        "required": {
+            "image": ("IMAGE",),
+            "order": ("INT", {"forceInput": True}),
+        },
+        "optional": {
+            "batch_sizes": ("INT", {"forceInput": True}),
+        }
+    }
+
+
+class ImageGroupBySizeNode(ImageProcessingNode):
+    """
+    按尺寸分组节点
+    把尺寸混杂的图片列表合并成尺寸一致的批次，输出还原顺序所需的索引
+    """
+
+    DESCRIPTION = "按尺寸或宽高比分桶把图片列表合并成尺寸一致的批次，下游节点每组只执行一次"
+    RETURN_TYPES = ("IMAGE", "INT", "INT", "INT")
+    RETURN_NAMES = ("images", "order", "batch_sizes", "group_count")
+    FUNCTION = "group"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True, True, False)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return grouping_input_types()
+
+    def group(self, image, group_by, preset=None, step=None, custom_buckets=None):
+        """
+        分组
+
+        Returns:
+            tuple: (分组批次列表, 还原顺序索引, 原批次大小列表, 组数)
+        """
+        try:
+            groups = group_images(
+                image, _first(group_by, "size"), _first(preset, "sdxl"),
+                _first(custom_buckets, ""), _first(step, 64),
+            )
+            return (groups.images, groups.order, groups.batch_sizes, len(groups.images))
+
+        except Exception as e:
+            self.log_error(e, "group")
+            return (list(image), [], [], 0)
+
+
+class ImageRestoreOrderNode(ImageProcessingNode):
+    """
+    还原顺序节点
+    与按尺寸分组节点配套，把处理后的分组按原始顺序拆开
+    """
+
+    DESCRIPTION = "按分组节点输出的顺序索引把处理后的图片还原为原始顺序和批次结构"
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("images",)
+    FUNCTION = "restore"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True,)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return restore_input_types()
+
+    def restore(self, image, order, batch_sizes=None):
+        """
+        还原顺序
+
+        Returns:
+            tuple: (原始顺序的图片列表,)
+        """
+        try:
+            return (restore_order(image, order, batch_sizes),)
+
+        except Exception as e:
+            self.log_error(e, "restore")
+            return (list(image),)
+
+
+NODE_CLASSES = [
+    ImageGroupBySizeNode,
+    ImageRestoreOrderNode,
+]
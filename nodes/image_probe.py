@@ -0,0 +1,266 @@
+"""
+ComfyUI Popo Utility - 图片文件头尺寸探测
+只解析容器文件头读取图片尺寸，不解码像素数据，每个文件通常只读取几百字节
+
+支持的格式: PNG、JPEG、WebP (VP8/VP8L/VP8X)、GIF、BMP、TIFF
+JPEG 和 TIFF 的 EXIF 方向标记为旋转90度时交换宽高，与加载图片时的自动旋转结果一致
+"""
+
+import os
+import struct
+from typing import BinaryIO, NamedTuple, Tuple
+
+from .cache_utils import LRUCache
+
+try:
+    import folder_paths  # ComfyUI 提供，用于解析输入目录中的相对文件名
+except ImportError:
+    folder_paths = None
+
+
+# 初始读取的字节数，足以覆盖除JPEG和TIFF之外所有格式的尺寸字段
+HEADER_BYTES = 64
+
+# JPEG EXIF 段最多读取的字节数，方向标记位于IFD0，通常在前几百字节内
+EXIF_READ_LIMIT = 4096
+
+# TIFF IFD 最多解析的条目数
+TIFF_MAX_ENTRIES = 512
+
+# EXIF 方向值 5-8 表示图片需要旋转90度或270度显示
+_TRANSPOSED_ORIENTATIONS = frozenset((5, 6, 7, 8))
+
+# JPEG 帧起始标记 SOF0-SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# 没有长度字段的JPEG标记：TEM 和 RST0-RST7
+_JPEG_STANDALONE_MARKERS = frozenset((0x01,) + tuple(range(0xD0, 0xD8)))
+
+
+class ImageProbeError(ValueError):
+    """文件不是支持的图片格式，或文件头损坏、被截断"""
+
+
+class ImageInfo(NamedTuple):
+    """探测结果：显示方向上的宽度和高度、格式名称"""
+
+    width: int
+    height: int
+    format: str
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) < size:
+        raise ImageProbeError("文件头被截断")
+    return data
+
+
+def _probe_png(header: bytes) -> Tuple[int, int]:
+    # 签名之后第一个块必须是 IHDR：长度(4) 类型(4) 宽(4) 高(4)
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        raise ImageProbeError("PNG 缺少 IHDR 块")
+    return struct.unpack(">II", header[16:24])
+
+
+def _probe_gif(header: bytes) -> Tuple[int, int]:
+    if len(header) < 10:
+        raise ImageProbeError("GIF 文件头被截断")
+    return struct.unpack("<HH", header[6:10])
+
+
+def _probe_bmp(header: bytes) -> Tuple[int, int]:
+    if len(header) < 26:
+        raise ImageProbeError("BMP 文件头被截断")
+    (dib_size,) = struct.unpack("<I", header[14:18])
+    if dib_size == 12:  # OS/2 BITMAPCOREHEADER 使用16位尺寸
+        return struct.unpack("<HH", header[18:22])
+    width, height = struct.unpack("<ii", header[18:26])
+    # 高度为负表示自上而下存储
+    return abs(width), abs(height)
+
+
+def _probe_webp(header: bytes) -> Tuple[int, int]:
+    chunk = header[12:16]
+    if chunk == b"VP8X" and len(header) >= 30:
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return width, height
+    if chunk == b"VP8L" and len(header) >= 25:
+        if header[20] != 0x2F:
+            raise ImageProbeError("VP8L 签名无效")
+        bits = int.from_bytes(header[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8 " and len(header) >= 30:
+        if header[23:26] != b"\x9d\x01\x2a":
+            raise ImageProbeError("VP8 起始码无效")
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    raise ImageProbeError("无法识别的 WebP 数据块")
+
+
+def _tiff_tags(data: bytes, base: int = 0, wanted: Tuple[int, ...] = (256, 257, 274)) -> dict:
+    """
+    从内存中的TIFF结构（文件或EXIF段）读取IFD0中的指定标签
+    base 为TIFF头在data中的偏移
+    """
+    order = {b"II": "<", b"MM": ">"}.get(data[base:base + 2])
+    if order is None or struct.unpack(order + "H", data[base + 2:base + 4])[0] != 42:
+        raise ImageProbeError("TIFF 头无效")
+    (offset,) = struct.unpack(order + "I", data[base + 4:base + 8])
+    start = base + offset
+    if start + 2 > len(data):
+        raise ImageProbeError("TIFF IFD 超出读取范围")
+    (count,) = struct.unpack(order + "H", data[start:start + 2])
+
+    tags = {}
+    for index in range(min(count, TIFF_MAX_ENTRIES)):
+        entry = start + 2 + index * 12
+        if entry + 12 > len(data):
+            break
+        tag, kind = struct.unpack(order + "HH", data[entry:entry + 4])
+        if tag not in wanted:
+            continue
+        if kind == 3:  # SHORT
+            (tags[tag],) = struct.unpack(order + "H", data[entry + 8:entry + 10])
+        elif kind == 4:  # LONG
+            (tags[tag],) = struct.unpack(order + "I", data[entry + 8:entry + 12])
+    return tags
+
+
+def _probe_tiff(f: BinaryIO, header: bytes) -> Tuple[int, int, int]:
+    order = "<" if header[:2] == b"II" else ">"
+    (offset,) = struct.unpack(order + "I", header[4:8])
+    f.seek(offset)
+    (count,) = struct.unpack(order + "H", _read_exact(f, 2))
+    # 只读取IFD0本身，拼接成以TIFF头开始、IFD位于偏移8的小块数据再解析
+    entries = f.read(min(count, TIFF_MAX_ENTRIES) * 12)
+    data = header[:4] + struct.pack(order + "I", 8) + struct.pack(order + "H", count) + entries
+    tags = _tiff_tags(data)
+    if 256 not in tags or 257 not in tags:
+        raise ImageProbeError("TIFF 缺少尺寸标签")
+    return tags[256], tags[257], tags.get(274, 1)
+
+
+def _probe_jpeg(f: BinaryIO) -> Tuple[int, int, int]:
+    """逐段扫描直到帧起始段，途中从 APP1 EXIF 段读取方向标记"""
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = _read_exact(f, 1)
+        if byte != b"\xff":
+            raise ImageProbeError("JPEG 段标记无效")
+        # 标记前可以有任意多个填充字节 0xFF
+        marker = 0xFF
+        while marker == 0xFF:
+            marker = _read_exact(f, 1)[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            raise ImageProbeError("JPEG 在帧起始段之前结束")
+
+        (length,) = struct.unpack(">H", _read_exact(f, 2))
+        if length < 2:
+            raise ImageProbeError("JPEG 段长度无效")
+        if marker in _JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack(">BHH", _read_exact(f, 5))
+            return width, height, orientation
+
+        if marker == 0xE1 and orientation == 1:
+            segment = f.read(min(length - 2, EXIF_READ_LIMIT))
+            if segment.startswith(b"Exif\x00\x00"):
+                try:
+                    orientation = _tiff_tags(segment, 6, (274,)).get(274, 1)
+                except (ImageProbeError, struct.error):
+                    pass  # EXIF 损坏时忽略方向
+            f.seek(length - 2 - len(segment), os.SEEK_CUR)
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_stream(f: BinaryIO) -> ImageInfo:
+    """
+    从已打开的二进制文件中探测图片尺寸
+
+    Raises:
+        ImageProbeError: 格式不支持或文件头损坏
+    """
+    header = f.read(HEADER_BYTES)
+    orientation = 1
+    try:
+        if header.startswith(b"\x89PNG\r\n\x1a\n"):
+            fmt = "PNG"
+            width, height = _probe_png(header)
+        elif header.startswith(b"\xff\xd8"):
+            fmt = "JPEG"
+            width, height, orientation = _probe_jpeg(f)
+        elif header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            fmt = "WEBP"
+            width, height = _probe_webp(header)
+        elif header[:6] in (b"GIF87a", b"GIF89a"):
+            fmt = "GIF"
+            width, height = _probe_gif(header)
+        elif header.startswith(b"BM"):
+            fmt = "BMP"
+            width, height = _probe_bmp(header)
+        elif header[:4] in (b"II*\x00", b"MM\x00*"):
+            fmt = "TIFF"
+            width, height, orientation = _probe_tiff(f, header)
+        else:
+            raise ImageProbeError("不支持的图片格式")
+    except struct.error as e:
+        raise ImageProbeError(f"文件头被截断: {e}") from e
+
+    if width <= 0 or height <= 0:
+        raise ImageProbeError(f"{fmt} 尺寸无效: {width}x{height}")
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return ImageInfo(int(width), int(height), fmt)
+
+
+def resolve_image_path(path: str) -> str:
+    """
+    解析图片路径：支持绝对路径、~ 以及ComfyUI输入目录中的文件名（如 "photo.png [input]"）
+    """
+    path = os.path.expanduser(path.strip().strip('"'))
+    if not os.path.isfile(path) and folder_paths is not None:
+        try:
+            return folder_paths.get_annotated_filepath(path)
+        except Exception:
+            pass
+    return path
+
+
+# 按 (路径, 修改时间, 文件大小) 缓存探测结果，文件变化后自动失效
+_probe_cache = LRUCache(1024)
+
+
+def file_signature(path: str) -> Tuple[str, int, int]:
+    """文件的缓存键，用于 IS_CHANGED 和探测结果缓存"""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def probe_image_size(path: str) -> ImageInfo:
+    """
+    只读取文件头获取图片尺寸
+
+    Args:
+        path: 图片路径（参见 resolve_image_path）
+
+    Returns:
+        ImageInfo(width, height, format)，宽高已按EXIF方向调整
+
+    Raises:
+        OSError: 文件不存在或无法读取
+        ImageProbeError: 格式不支持或文件头损坏
+    """
+    path = resolve_image_path(path)
+    signature = file_signature(path)
+
+    def probe() -> ImageInfo:
+        with open(path, "rb") as f:
+            return probe_stream(f)
+
+    return _probe_cache.get_or_create(signature, probe)
+
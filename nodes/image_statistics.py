@@ -0,0 +1,225 @@
+"""
+ComfyUI Popo Utility - 图片通道统计
+逐张图片、逐通道计算均值、标准差、最小/最大值、近似分位数和256级直方图
+
+按固定大小的行块遍历 [B, H, W, C] 批次，块缓冲区和累加器在整个批次中复用，
+内存占用只取决于块大小，与批次大小和分辨率无关；计算在图片所在的设备上进行，
+每张图片结束时才把结果取回
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+
+from .base_node import ImageProcessingNode
+
+
+# 直方图级数，覆盖 [0, 1]，超出范围的值计入两端
+HISTOGRAM_BINS = 256
+
+# 默认的块缓冲区内存预算（MB）
+DEFAULT_CHUNK_MEGABYTES = 64
+
+# 每个元素在块缓冲区中占用的字节数：float32 数值 + int64 直方图下标
+_BYTES_PER_ELEMENT = 4 + 8
+
+# 输出到JSON的默认分位数
+DEFAULT_PERCENTILES = (1.0, 5.0, 50.0, 95.0, 99.0)
+
+
+class _ChannelAccumulator:
+    """一张图片的逐通道累加器，在批次的各张图片之间复用"""
+
+    def __init__(self, channels: int, device: torch.device):
+        self.sum = torch.zeros(channels, dtype=torch.float64, device=device)
+        self.sum_sq = torch.zeros(channels, dtype=torch.float64, device=device)
+        self.min = torch.empty(channels, dtype=torch.float32, device=device)
+        self.max = torch.empty(channels, dtype=torch.float32, device=device)
+        self.histogram = torch.zeros(channels * HISTOGRAM_BINS, dtype=torch.int64, device=device)
+        # 第c个通道的下标偏移 c*HISTOGRAM_BINS，使所有通道共用一次bincount
+        self.offsets = torch.arange(channels, device=device) * HISTOGRAM_BINS
+        self.count = 0
+
+    def reset(self) -> None:
+        self.sum.zero_()
+        self.sum_sq.zero_()
+        self.min.fill_(float("inf"))
+        self.max.fill_(float("-inf"))
+        self.histogram.zero_()
+        self.count = 0
+
+
+def percentile_from_histogram(histogram: Sequence[int], percentile: float) -> float:
+    """
+    从 [0, 1] 上的直方图估计分位数，在落入的区间内线性插值，误差不超过一个区间宽度（1/256）
+    """
+    total = sum(histogram)
+    if total == 0:
+        return 0.0
+    target = total * min(max(percentile, 0.0), 100.0) / 100.0
+    bins = len(histogram)
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        if count and cumulative + count >= target:
+            return (index + (target - cumulative) / count) / bins
+        cumulative += count
+    return 1.0
+
+
+def compute_image_statistics(
+    images: Any,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    chunk_megabytes: float = DEFAULT_CHUNK_MEGABYTES,
+) -> List[Dict[str, Any]]:
+    """
+    计算批次中每张图片的逐通道统计
+
+    Args:
+        images: [B, H, W, C] 或 [H, W, C] 张量（numpy数组会被包装为张量，不复制）
+        percentiles: 需要估计的分位数（0-100）
+        chunk_megabytes: 块缓冲区的内存预算
+
+    Returns:
+        每张图片一项：{"width", "height", "channels", "mean", "std", "min", "max",
+        "percentiles": {"1.0": [...], ...}, "histogram": [[256个计数], ...]}，
+        除 histogram 外每个统计量都是每通道一个值的列表
+    """
+    if not isinstance(images, torch.Tensor):
+        images = torch.as_tensor(images)
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    if images.dim() != 4:
+        raise ValueError(f"不支持的图片形状: {tuple(images.shape)}")
+
+    batch, height, width, channels = images.shape
+    row_elements = max(width * channels, 1)
+    budget = max(int(chunk_megabytes * 1024 * 1024 / _BYTES_PER_ELEMENT), row_elements)
+    rows_per_chunk = max(1, min(height, budget // row_elements))
+    chunk_elements = rows_per_chunk * row_elements
+
+    device = images.device
+    accumulator = _ChannelAccumulator(channels, device)
+    # 复用的块缓冲区：float32 数值和直方图下标
+    values = torch.empty(chunk_elements, dtype=torch.float32, device=device)
+    indices = torch.empty(chunk_elements, dtype=torch.int64, device=device)
+
+    results = []
+    for b in range(batch):
+        accumulator.reset()
+        for top in range(0, height, rows_per_chunk):
+            rows = min(rows_per_chunk, height - top)
+            size = rows * row_elements
+            chunk = values[:size].view(rows * width, channels)
+            chunk.copy_(images[b, top:top + rows].reshape(rows * width, channels))
+
+            accumulator.sum += chunk.sum(dim=0, dtype=torch.float64)
+            accumulator.sum_sq += chunk.square().sum(dim=0, dtype=torch.float64)
+            torch.minimum(accumulator.min, chunk.amin(dim=0), out=accumulator.min)
+            torch.maximum(accumulator.max, chunk.amax(dim=0), out=accumulator.max)
+
+            index = indices[:size].view(rows * width, channels)
+            torch.mul(chunk, HISTOGRAM_BINS, out=chunk)
+            torch.clamp(chunk, 0, HISTOGRAM_BINS - 1, out=chunk)
+            index.copy_(chunk)  # 截断取整
+            index += accumulator.offsets
+            accumulator.histogram += torch.bincount(index.view(-1), minlength=channels * HISTOGRAM_BINS)
+            accumulator.count += rows * width
+
+        count = max(accumulator.count, 1)
+        mean = accumulator.sum / count
+        variance = (accumulator.sum_sq / count - mean.square()).clamp_min(0)
+        histogram = accumulator.histogram.view(channels, HISTOGRAM_BINS).tolist()
+        results.append({
+            "width": int(width),
+            "height": int(height),
+            "channels": int(channels),
+            "mean": mean.tolist(),
+            "std": variance.sqrt().tolist(),
+            "min": accumulator.min.tolist(),
+            "max": accumulator.max.tolist(),
+            "percentiles": {
+                str(float(p)): [percentile_from_histogram(channel, p) for channel in histogram]
+                for p in percentiles
+            },
+            "histogram": histogram,
+        })
+    return results
+
+
+def summarize_statistics(stats: Dict[str, Any], low: float, high: float) -> List[float]:
+    """
+    把逐通道统计合并为所有通道整体的 [均值, 标准差, 最小值, 最大值, 低分位数, 高分位数]
+    """
+    channels = max(stats["channels"], 1)
+    mean = sum(stats["mean"]) / channels
+    # 各通道像素数相同，整体方差 = 通道方差的均值 + 通道均值的方差
+    variance = sum(std ** 2 + (m - mean) ** 2 for std, m in zip(stats["std"], stats["mean"])) / channels
+    combined = [sum(column) for column in zip(*stats["histogram"])]
+    return [
+        mean,
+        variance ** 0.5,
+        min(stats["min"]),
+        max(stats["max"]),
+        percentile_from_histogram(combined, low),
+        percentile_from_histogram(combined, high),
+    ]
+
+
+def statistics_outputs(
+    image: Any,
+    low_percentile: float,
+    high_percentile: float,
+    chunk_megabytes: float = DEFAULT_CHUNK_MEGABYTES,
+    percentiles: Optional[Sequence[float]] = None,
+) -> tuple:
+    """统计节点的输出：(JSON, 均值列表, 标准差列表, 最小值列表, 最大值列表, 低分位数列表, 高分位数列表)"""
+    requested = sorted(set(percentiles or DEFAULT_PERCENTILES) | {float(low_percentile), float(high_percentile)})
+    stats = compute_image_statistics(image, requested, chunk_megabytes)
+    columns = list(zip(*(summarize_statistics(item, low_percentile, high_percentile) for item in stats)))
+    return (json.dumps(stats),) + tuple(list(column) for column in columns)
+
+
+class ImageStatisticsNode(ImageProcessingNode):
+    """
+    图片通道统计节点
+    输出每张图片的整体统计（列表）和包含逐通道统计、直方图的JSON
+    """
+
+    DESCRIPTION = "分块计算每张图片每个通道的均值、标准差、最小/最大值、分位数和256级直方图"
+    RETURN_TYPES = ("STRING", "FLOAT", "FLOAT", "FLOAT", "FLOAT", "FLOAT", "FLOAT")
+    RETURN_NAMES = ("stats_json", "mean", "std", "min", "max", "low_percentile", "high_percentile")
+    FUNCTION = "compute_statistics"
+    OUTPUT_IS_LIST = (False, True, True, True, True, True, True)
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "low_percentile": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+                "high_percentile": ("FLOAT", {"default": 99.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+            },
+            "optional": {
+                "chunk_megabytes": ("INT", {"default": DEFAULT_CHUNK_MEGABYTES, "min": 1, "max": 4096}),
+            }
+        }
+
+    def compute_statistics(self, image, low_percentile, high_percentile, chunk_megabytes=DEFAULT_CHUNK_MEGABYTES):
+        """
+        计算图片统计
+
+        Returns:
+            tuple: (逐通道统计JSON, 均值列表, 标准差列表, 最小值列表, 最大值列表, 低分位数列表, 高分位数列表)
+        """
+        try:
+            return statistics_outputs(image, low_percentile, high_percentile, chunk_megabytes)
+
+        except Exception as e:
+            self.log_error(e, "compute_statistics")
+            return ("[]", [0.0], [0.0], [0.0], [0.0], [0.0], [0.0])
+
+
+NODE_CLASSES = [
+    ImageStatisticsNode,
+]
@@ -4,7 +4,102 @@ ComfyUI Popo Utility - 图片处理工具节点
 """
 
 from .base_node import ImageProcessingNode
-from typing import Tuple
+from .aspect_ratio import DEFAULT_MAX_DENOMINATOR, DEFAULT_TOLERANCE, format_ratio_name
+from .cache_utils import LRUCache, make_fingerprint, memoize_by_shape, shape_key
+from .image_probe import file_signature, probe_image_size, resolve_image_path
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+# 尺寸类节点的结果只由图片形状决定，按形状记忆化
+_dimension_memo = LRUCache(256)
+
+
+def image_shape_size(image: Any) -> Tuple[int, int, int]:
+    """
+    从张量形状读取 (宽度, 高度, 批次大小)，不访问像素数据
+    支持 [batch, height, width, channels] 和 [height, width, channels]，其他形状返回 (0, 0, 0)
+    """
+    shape = shape_key(image)
+    if shape is None:
+        return (0, 0, 0)
+    if len(shape) == 4:
+        return (shape[2], shape[1], shape[0])
+    if len(shape) == 3:
+        return (shape[1], shape[0], 1)
+    return (0, 0, 0)
+
+
+def collect_image_sizes(images: Any, expand_batch: bool = True) -> List[Tuple[int, int]]:
+    """
+    读取图片列表中每一项的 (宽度, 高度)
+
+    Args:
+        images: 图片张量列表（尺寸可以各不相同），也可以是单个张量
+        expand_batch: 为True时批次中的每张图片各占一项（同一批次尺寸相同），
+                      否则每个张量只占一项
+
+    Returns:
+        [(宽度, 高度), ...]，无法识别的张量对应 (0, 0)
+    """
+    if not isinstance(images, (list, tuple)):
+        images = [images]
+    sizes: List[Tuple[int, int]] = []
+    for image in images:
+        width, height, batch = image_shape_size(image)
+        sizes.extend([(width, height)] * (batch if expand_batch and batch > 0 else 1))
+    return sizes
+
+
+def gather_sizes(
+    images: Optional[Sequence[Any]],
+    widths: Optional[Sequence[int]],
+    heights: Optional[Sequence[int]],
+) -> List[Tuple[int, int]]:
+    """列表节点的尺寸来源：优先使用图片列表（批次展开），否则使用宽高列表"""
+    if images:
+        return collect_image_sizes(list(images), True)
+    if widths and heights:
+        if len(widths) != len(heights):
+            raise ValueError(f"宽度和高度列表长度不同: {len(widths)} != {len(heights)}")
+        return list(zip(widths, heights))
+    raise ValueError("需要输入图片或宽高列表")
+
+
+def dimension_lists(sizes: List[Tuple[int, int]]) -> Tuple[List[int], List[int], List[int], List[int]]:
+    """把 (宽度, 高度) 列表拆成宽度、高度、长边、短边四个列表"""
+    widths = [width for width, _ in sizes]
+    heights = [height for _, height in sizes]
+    return (widths, heights, list(map(max, widths, heights)), list(map(min, widths, heights)))
+
+
+# 常见比例的说明，其他比例只标注横屏或竖屏
+RATIO_LABELS = {
+    "1:1": "正方形",
+    "5:4": "显示器",
+    "4:3": "标准",
+    "3:2": "经典",
+    "16:10": "宽屏",
+    "16:9": "宽屏",
+    "21:9": "超宽屏",
+    "32:9": "超宽屏",
+    "4:5": "竖屏显示器",
+    "3:4": "竖屏标准",
+    "2:3": "竖屏经典",
+    "10:16": "竖屏宽屏",
+    "9:16": "竖屏宽屏",
+}
+
+
+def identify_common_ratio(
+    width: int,
+    height: int,
+    max_denominator: int = DEFAULT_MAX_DENOMINATOR,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> str:
+    """识别宽高比名称，如 16:9 (宽屏)、7:5 (横屏)、1.52:1 (横屏)"""
+    return format_ratio_name(
+        width, height, RATIO_LABELS, ("横屏", "竖屏", "正方形"), "{ratio} ({label})", max_denominator, tolerance
+    )
 
 
 class ImageSizeNode(ImageProcessingNode):
@@ -27,6 +122,7 @@ class ImageSizeNode(ImageProcessingNode):
             }
         }
     
+    @memoize_by_shape(_dimension_memo)
     def get_image_size(self, image):
         """
         获取图片尺寸的核心函数
@@ -76,6 +172,7 @@ class ImageDimensionsNode(ImageProcessingNode):
             }
         }
     
+    @memoize_by_shape(_dimension_memo)
     def get_dimensions(self, image):
         """
         获取图片详细尺寸信息
@@ -122,15 +219,22 @@ class ImageAspectRatioNode(ImageProcessingNode):
         return {
             "required": {
                 "image": ("IMAGE",),
+            },
+            "optional": {
+                "max_denominator": ("INT", {"default": DEFAULT_MAX_DENOMINATOR, "min": 1, "max": 1000}),
+                "tolerance": ("FLOAT", {"default": DEFAULT_TOLERANCE, "min": 0.0, "max": 0.5, "step": 0.001}),
             }
         }
     
-    def calculate_aspect_ratio(self, image):
+    @memoize_by_shape(_dimension_memo)
+    def calculate_aspect_ratio(self, image, max_denominator=DEFAULT_MAX_DENOMINATOR, tolerance=DEFAULT_TOLERANCE):
         """
         计算图片宽高比
         
         Args:
             image: ComfyUI 格式的图片张量
+            max_denominator: 比例名称中较小一项的上限
+            tolerance: 比例名称允许的相对误差
         
         Returns:
             tuple: (宽高比浮点数, 比例名称字符串)
@@ -147,8 +251,8 @@ class ImageAspectRatioNode(ImageProcessingNode):
             # 计算宽高比
             aspect_ratio = width / height
             
-            # 识别常见比例
-            ratio_name = self._identify_common_ratio(aspect_ratio)
+            # 识别比例名称
+            ratio_name = self._identify_common_ratio(width, height, max_denominator, tolerance)
             
             return (round(aspect_ratio, 3), ratio_name)
             
@@ -156,37 +260,116 @@ class ImageAspectRatioNode(ImageProcessingNode):
             self.log_error(e, "calculate_aspect_ratio")
             return (0.0, "error")
     
-    def _identify_common_ratio(self, ratio: float) -> str:
-        """识别常见的宽高比名称"""
-        common_ratios = {
-            1.0: "1:1 (正方形)",
-            4/3: "4:3 (标准)",
-            3/2: "3:2 (经典)",
-            16/9: "16:9 (宽屏)",
-            21/9: "21:9 (超宽屏)",
-            5/4: "5:4 (显示器)",
-            3/4: "3:4 (竖屏标准)",
-            2/3: "2:3 (竖屏经典)",
-            9/16: "9:16 (竖屏宽屏)",
+    def _identify_common_ratio(self, width: int, height: int, max_denominator: int, tolerance: float) -> str:
+        """识别宽高比名称"""
+        return identify_common_ratio(width, height, max_denominator, tolerance)
+
+
+class ImageDimensionsListNode(ImageProcessingNode):
+    """
+    一次获取整个图片列表每一项尺寸的节点
+    输入可以是尺寸各不相同的图片列表，输出与之一一对应的宽度、高度、长边、短边列表
+    """
+    
+    DESCRIPTION = "一次获取图片列表中每张图片的宽度、高度、长边、短边，只读取张量形状"
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "long_side", "short_side", "count")
+    FUNCTION = "get_dimensions_list"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True, True, True, False)
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+            },
+            "optional": {
+                "expand_batch": ("BOOLEAN", {"default": True}),
+            }
         }
+    
+    def get_dimensions_list(self, image, expand_batch=True):
+        """
+        获取图片列表中每一项的尺寸
+        
+        Args:
+            image: ComfyUI 格式的图片张量列表
+            expand_batch: 是否把批次中的每张图片展开为单独的一项
         
-        # 容差范围
-        tolerance = 0.05
+        Returns:
+            tuple: (宽度列表, 高度列表, 长边列表, 短边列表, 项数)
+        """
+        # INPUT_IS_LIST 时所有输入都是列表
+        if isinstance(expand_batch, list):
+            expand_batch = expand_batch[0] if expand_batch else True
         
-        for target_ratio, name in common_ratios.items():
-            if abs(ratio - target_ratio) <= tolerance:
-                return name
+        try:
+            sizes = collect_image_sizes(image, bool(expand_batch))
+            return dimension_lists(sizes) + (len(sizes),)
+            
+        except Exception as e:
+            self.log_error(e, "get_dimensions_list")
+            return ([0], [0], [0], [0], 0)
+
+
+class ImageFileDimensionsNode(ImageProcessingNode):
+    """
+    根据文件路径获取图片尺寸的节点
+    只解析文件头，不解码像素数据，适合在加载图片之前按尺寸分流
+    """
+    
+    DESCRIPTION = "只读取图片文件头获取宽度、高度、长边、短边和宽高比，无需解码图片"
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "FLOAT", "STRING")
+    RETURN_NAMES = ("width", "height", "long_side", "short_side", "aspect_ratio", "ratio_name")
+    FUNCTION = "get_file_dimensions"
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "path": ("STRING", {"default": ""}),
+            }
+        }
+    
+    @classmethod
+    def IS_CHANGED(cls, path, **kwargs):
+        """文件路径、修改时间或大小变化时重新执行"""
+        try:
+            return make_fingerprint(file_signature(resolve_image_path(path)))
+        except OSError:
+            return make_fingerprint(path)
+    
+    def get_file_dimensions(self, path):
+        """
+        读取图片文件头获取尺寸
         
-        # 判断横屏还是竖屏
-        if ratio > 1:
-            return f"{ratio:.2f}:1 (横屏)"
-        else:
-            return f"1:{1/ratio:.2f} (竖屏)"
+        Args:
+            path: 图片文件路径
+        
+        Returns:
+            tuple: (宽度, 高度, 长边, 短边, 宽高比, 比例名称)
+        """
+        try:
+            width, height, _ = probe_image_size(path)
+            
+            long_side = max(height, width)
+            short_side = min(height, width)
+            aspect_ratio = width / height
+            ratio_name = identify_common_ratio(width, height)
+            
+            return (width, height, long_side, short_side, round(aspect_ratio, 3), ratio_name)
+            
+        except Exception as e:
+            self.log_error(e, "get_file_dimensions")
+            return (0, 0, 0, 0, 0.0, "error")
 
 
 # 导出节点类
 NODE_CLASSES = [
     ImageSizeNode,
     ImageDimensionsNode,
+    ImageDimensionsListNode,
+    ImageFileDimensionsNode,
     ImageAspectRatioNode,
 ]
\ No newline at end of file
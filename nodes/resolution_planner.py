@@ -0,0 +1,173 @@
+"""
+ComfyUI Popo Utility - 分辨率规划
+根据原图尺寸计算目标分辨率：按长边或短边缩放、保持宽高比、对齐到8/64的倍数、限制总像素数
+
+整个列表用numpy一次向量化计算，替代在工作流中用多个数学节点拼出的同一套运算
+"""
+
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from .base_node import ImageProcessingNode
+from .image_utils import gather_sizes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# 缩放基准：long 按长边，short 按短边
+SCALE_SIDES = ("long", "short")
+
+# 对齐方式：round 取最近的倍数，floor 向下（只裁剪），ceil 向上（只填充）
+SNAP_MODES = ("round", "floor", "ceil")
+
+
+class ResolutionPlan(NamedTuple):
+    """
+    规划结果，每个字段是与输入一一对应的列表
+    原图先等比缩放到 (resize_width, resize_height)，再填充（正数）或裁剪（负数）pad_width / pad_height 像素得到目标尺寸
+    """
+
+    width: List[int]
+    height: List[int]
+    scale: List[float]
+    resize_width: List[int]
+    resize_height: List[int]
+    pad_width: List[int]
+    pad_height: List[int]
+
+
+def plan_resolutions(
+    sizes: Sequence[Tuple[int, int]],
+    target: int = 1024,
+    side: str = "long",
+    multiple: int = 8,
+    max_pixels: int = 0,
+    snap: str = "round",
+    upscale: bool = True,
+) -> ResolutionPlan:
+    """
+    为一组图片尺寸规划目标分辨率
+
+    Args:
+        sizes: [(宽, 高), ...]
+        target: 缩放后长边（或短边）的长度，0表示保持原尺寸
+        side: SCALE_SIDES 之一
+        multiple: 目标宽高对齐的倍数，1表示不对齐
+        max_pixels: 目标总像素数上限，0表示不限制；超出时按面积整体缩小，对齐后仍超出的改为向下对齐
+        snap: SNAP_MODES 之一
+        upscale: 为False时只缩小不放大
+
+    Raises:
+        ValueError: 参数无效或尺寸不为正数
+        ImportError: 没有安装 NumPy
+    """
+    if np is None:
+        raise ImportError("分辨率规划需要安装 NumPy")
+    if side not in SCALE_SIDES:
+        raise ValueError(f"未知的缩放基准: {side}")
+    if snap not in SNAP_MODES:
+        raise ValueError(f"未知的对齐方式: {snap}")
+    if multiple < 1 or target < 0 or max_pixels < 0:
+        raise ValueError(f"参数无效: target={target}, multiple={multiple}, max_pixels={max_pixels}")
+
+    dims = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    if dims.size and (dims <= 0).any():
+        raise ValueError("图片尺寸必须为正数")
+    widths, heights = dims[:, 0], dims[:, 1]
+
+    if target > 0:
+        reference = np.maximum(widths, heights) if side == "long" else np.minimum(widths, heights)
+        scale = target / reference
+    else:
+        scale = np.ones_like(widths)
+    if not upscale:
+        scale = np.minimum(scale, 1.0)
+    if max_pixels > 0:
+        scale = np.minimum(scale, np.sqrt(max_pixels / (widths * heights)))
+
+    scaled_width, scaled_height = widths * scale, heights * scale
+    rounding = {"round": np.round, "floor": np.floor, "ceil": np.ceil}[snap]
+    out_width = np.maximum(rounding(scaled_width / multiple), 1) * multiple
+    out_height = np.maximum(rounding(scaled_height / multiple), 1) * multiple
+    if max_pixels > 0:
+        # 向上对齐可能超出像素上限，这些项改为向下对齐（向下对齐的面积不会超过缩放后的面积）
+        over = out_width * out_height > max_pixels
+        out_width = np.where(over, np.maximum(np.floor(scaled_width / multiple), 1) * multiple, out_width)
+        out_height = np.where(over, np.maximum(np.floor(scaled_height / multiple), 1) * multiple, out_height)
+
+    resize_width = np.maximum(np.round(scaled_width), 1)
+    resize_height = np.maximum(np.round(scaled_height), 1)
+
+    def as_ints(values: "np.ndarray") -> List[int]:
+        return values.astype(np.int64).tolist()
+
+    return ResolutionPlan(
+        as_ints(out_width),
+        as_ints(out_height),
+        np.round(scale, 6).tolist(),
+        as_ints(resize_width),
+        as_ints(resize_height),
+        as_ints(out_width - resize_width),
+        as_ints(out_height - resize_height),
+    )
+
+
+def planner_input_types() -> Dict[str, Dict[str, tuple]]:
+    """规划节点的输入定义，两套节点共用"""
+    return {
+        "required": {
+            "target": ("INT", {"default": 1024, "min": 0, "max": 16384, "step": 8}),
+            "side": (list(SCALE_SIDES), {"default": "long"}),
+            "multiple": ("INT", {"default": 8, "min": 1, "max": 512}),
+            "max_pixels": ("INT", {"default": 0, "min": 0, "max": 268435456, "step": 1024}),
+            "snap": (list(SNAP_MODES), {"default": "round"}),
+            "upscale": ("BOOLEAN", {"default": True}),
+        },
+        "optional": {
+            "image": ("IMAGE",),
+            "widths": ("INT", {"forceInput": True}),
+            "heights": ("INT", {"forceInput": True}),
+        }
+    }
+
+
+class ResolutionPlannerNode(ImageProcessingNode):
+    """
+    分辨率规划节点
+    输入图片列表或宽高列表，输出对齐后的目标尺寸、缩放系数和填充量
+    """
+
+    DESCRIPTION = "按长边/短边缩放、对齐倍数、限制总像素，计算目标分辨率、缩放系数和填充量"
+    RETURN_TYPES = ("INT", "INT", "FLOAT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ResolutionPlan._fields
+    FUNCTION = "plan"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True,) * 7
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return planner_input_types()
+
+    def plan(self, target, side, multiple, max_pixels, snap, upscale, image=None, widths=None, heights=None):
+        """
+        规划目标分辨率
+
+        Returns:
+            tuple: 与输入一一对应的 (目标宽, 目标高, 缩放系数, 缩放宽, 缩放高, 宽度填充, 高度填充) 七个列表
+        """
+        try:
+            return tuple(plan_resolutions(
+                gather_sizes(image, widths, heights),
+                target[0], side[0], multiple[0], max_pixels[0], snap[0], upscale[0],
+            ))
+
+        except Exception as e:
+            self.log_error(e, "plan")
+            return ([0], [0], [0.0], [0], [0], [0], [0])
+
+
+NODE_CLASSES = [
+    ResolutionPlannerNode,
+]
@@ -0,0 +1,196 @@
+"""
+ComfyUI Popo Utility - LATENT / MASK / 视频张量尺寸节点
+只读取张量的 .shape 元数据，不调用 .cpu()、.numpy()、.item() 等会触发设备同步或数据复制的方法，
+可以在采样流程中途按潜空间尺寸分支而没有额外开销
+"""
+
+from typing import Any, NamedTuple, Tuple
+
+from .base_node import ImageProcessingNode
+from .cache_utils import shape_key
+
+
+# 潜空间到像素的缩放倍数（SD1.x / SDXL / Flux 等VAE为8）
+DEFAULT_LATENT_SCALE = 8
+
+
+class TensorDimensions(NamedTuple):
+    """从形状读取的尺寸：像素宽高、批次大小和帧数"""
+
+    width: int
+    height: int
+    batch: int
+    frames: int
+
+
+def _shape(value: Any) -> Tuple[int, ...]:
+    shape = shape_key(value)
+    if shape is None:
+        raise ValueError(f"无法读取形状: {type(value).__name__}")
+    return shape
+
+
+def latent_dimensions(latent: Any) -> Tuple[TensorDimensions, int]:
+    """
+    读取LATENT的潜空间尺寸
+
+    支持 {"samples": [B, C, h, w]} 和视频模型的 {"samples": [B, C, T, h, w]}
+
+    Returns:
+        (潜空间尺寸, 通道数)，宽高为潜空间单位
+    """
+    samples = latent.get("samples") if isinstance(latent, dict) else latent
+    shape = _shape(samples)
+    if len(shape) == 4:
+        batch, channels, height, width = shape
+        frames = 1
+    elif len(shape) == 5:
+        batch, channels, frames, height, width = shape
+    else:
+        raise ValueError(f"不支持的LATENT形状: {shape}")
+    return TensorDimensions(width, height, batch, frames), channels
+
+
+def mask_dimensions(mask: Any) -> TensorDimensions:
+    """
+    读取MASK的尺寸，支持 [H, W]、[B, H, W] 以及 [B, 1, H, W] / [B, H, W, 1]
+    """
+    shape = _shape(mask)
+    if len(shape) == 2:
+        return TensorDimensions(shape[1], shape[0], 1, 1)
+    if len(shape) == 3:
+        return TensorDimensions(shape[2], shape[1], shape[0], 1)
+    if len(shape) == 4 and shape[1] == 1:
+        return TensorDimensions(shape[3], shape[2], shape[0], 1)
+    if len(shape) == 4 and shape[3] == 1:
+        return TensorDimensions(shape[2], shape[1], shape[0], 1)
+    raise ValueError(f"不支持的MASK形状: {shape}")
+
+
+def video_dimensions(video: Any) -> TensorDimensions:
+    """
+    读取视频帧张量的尺寸
+    5维 [B, T, H, W, C] 为多段视频；4维 [T, H, W, C] 按ComfyUI惯例把批次视为帧序列
+    """
+    shape = _shape(video)
+    if len(shape) == 5:
+        batch, frames, height, width, _ = shape
+        return TensorDimensions(width, height, batch, frames)
+    if len(shape) == 4:
+        frames, height, width, _ = shape
+        return TensorDimensions(width, height, 1, frames)
+    raise ValueError(f"不支持的视频张量形状: {shape}")
+
+
+class LatentDimensionsNode(ImageProcessingNode):
+    """
+    获取LATENT对应像素尺寸的节点
+    输出像素宽高（潜空间尺寸乘以缩放倍数）、潜空间宽高、批次大小和帧数
+    """
+
+    DESCRIPTION = "只读取LATENT的形状，输出像素尺寸、潜空间尺寸、批次大小和帧数"
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "latent_width", "latent_height", "batch_size", "frames")
+    FUNCTION = "get_latent_dimensions"
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "samples": ("LATENT",),
+            },
+            "optional": {
+                "scale": ("INT", {"default": DEFAULT_LATENT_SCALE, "min": 1, "max": 64}),
+            }
+        }
+
+    def get_latent_dimensions(self, samples, scale=DEFAULT_LATENT_SCALE):
+        """
+        获取LATENT尺寸
+
+        Returns:
+            tuple: (像素宽度, 像素高度, 潜空间宽度, 潜空间高度, 批次大小, 帧数)
+        """
+        try:
+            dims, _ = latent_dimensions(samples)
+            return (dims.width * scale, dims.height * scale, dims.width, dims.height, dims.batch, dims.frames)
+
+        except Exception as e:
+            self.log_error(e, "get_latent_dimensions")
+            return (0, 0, 0, 0, 0, 0)
+
+
+class MaskDimensionsNode(ImageProcessingNode):
+    """
+    获取遮罩尺寸的节点
+    """
+
+    DESCRIPTION = "只读取MASK的形状，输出宽度、高度和批次大小"
+    RETURN_TYPES = ("INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "batch_size")
+    FUNCTION = "get_mask_dimensions"
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "mask": ("MASK",),
+            }
+        }
+
+    def get_mask_dimensions(self, mask):
+        """
+        获取遮罩尺寸
+
+        Returns:
+            tuple: (宽度, 高度, 批次大小)
+        """
+        try:
+            dims = mask_dimensions(mask)
+            return (dims.width, dims.height, dims.batch)
+
+        except Exception as e:
+            self.log_error(e, "get_mask_dimensions")
+            return (0, 0, 0)
+
+
+class VideoDimensionsNode(ImageProcessingNode):
+    """
+    获取视频帧张量尺寸的节点
+    支持 [B, T, H, W, C] 和以批次作为帧序列的 [T, H, W, C]
+    """
+
+    DESCRIPTION = "只读取视频帧张量的形状，输出宽度、高度、帧数和视频段数"
+    RETURN_TYPES = ("INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "frames", "batch_size")
+    FUNCTION = "get_video_dimensions"
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "frames": ("IMAGE",),
+            }
+        }
+
+    def get_video_dimensions(self, frames):
+        """
+        获取视频帧尺寸
+
+        Returns:
+            tuple: (宽度, 高度, 帧数, 视频段数)
+        """
+        try:
+            dims = video_dimensions(frames)
+            return (dims.width, dims.height, dims.frames, dims.batch)
+
+        except Exception as e:
+            self.log_error(e, "get_video_dimensions")
+            return (0, 0, 0, 0)
+
+
+NODE_CLASSES = [
+    LatentDimensionsNode,
+    MaskDimensionsNode,
+    VideoDimensionsNode,
+]
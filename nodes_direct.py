@@ -6,7 +6,107 @@ ComfyUI Popo Utility - 直接节点实现
 import torch
 import numpy as np
 import math
-import re
+
+try:
+    from .nodes.aspect_buckets import BUCKET_PRESETS, get_bucket_table
+    from .nodes.aspect_ratio import DEFAULT_MAX_DENOMINATOR, DEFAULT_TOLERANCE, format_ratio_name
+    from .nodes.cache_utils import LRUCache, make_fingerprint, memoize_by_shape
+    from .nodes.content_bbox import autocrop_input_types, autocrop_outputs
+    from .nodes.dimension_index import scan_and_query
+    from .nodes.expression_engine import (
+        compile_expression,
+        compile_program,
+        is_safe_expression,
+        on_limits_changed,
+    )
+    from .nodes.expression_profiler import profiler
+    from .nodes.expression_sandbox import SANDBOX_ENABLED, get_sandbox_pool
+    from .nodes.expression_sweep import make_sweep
+    from .nodes.expression_vector import (
+        evaluate_image_expression,
+        evaluate_vectorized,
+        to_result_lists,
+    )
+    from .nodes.image_fingerprint import FINGERPRINT_MODES, fingerprint_outputs
+    from .nodes.image_grouping import group_images, grouping_input_types, restore_input_types, restore_order
+    from .nodes.image_probe import file_signature, probe_image_size, resolve_image_path
+    from .nodes.image_statistics import DEFAULT_CHUNK_MEGABYTES, statistics_outputs
+    from .nodes.image_utils import collect_image_sizes, dimension_lists, gather_sizes
+    from .nodes.resolution_planner import ResolutionPlan, plan_resolutions, planner_input_types
+    from .nodes.tensor_dimensions import (
+        DEFAULT_LATENT_SCALE,
+        latent_dimensions,
+        mask_dimensions,
+        video_dimensions,
+    )
+except ImportError:
+    from nodes.aspect_buckets import BUCKET_PRESETS, get_bucket_table
+    from nodes.aspect_ratio import DEFAULT_MAX_DENOMINATOR, DEFAULT_TOLERANCE, format_ratio_name
+    from nodes.cache_utils import LRUCache, make_fingerprint, memoize_by_shape
+    from nodes.content_bbox import autocrop_input_types, autocrop_outputs
+    from nodes.dimension_index import scan_and_query
+    from nodes.expression_engine import (
+        compile_expression,
+        compile_program,
+        is_safe_expression,
+        on_limits_changed,
+    )
+    from nodes.expression_profiler import profiler
+    from nodes.expression_sandbox import SANDBOX_ENABLED, get_sandbox_pool
+    from nodes.expression_sweep import make_sweep
+    from nodes.expression_vector import (
+        evaluate_image_expression,
+        evaluate_vectorized,
+        to_result_lists,
+    )
+    from nodes.image_fingerprint import FINGERPRINT_MODES, fingerprint_outputs
+    from nodes.image_grouping import group_images, grouping_input_types, restore_input_types, restore_order
+    from nodes.image_probe import file_signature, probe_image_size, resolve_image_path
+    from nodes.image_statistics import DEFAULT_CHUNK_MEGABYTES, statistics_outputs
+    from nodes.image_utils import collect_image_sizes, dimension_lists, gather_sizes
+    from nodes.resolution_planner import ResolutionPlan, plan_resolutions, planner_input_types
+    from nodes.tensor_dimensions import (
+        DEFAULT_LATENT_SCALE,
+        latent_dimensions,
+        mask_dimensions,
+        video_dimensions,
+    )
+
+
+# 尺寸类节点的结果只由图片形状决定，按形状记忆化
+_dimension_memo = LRUCache(256)
+
+# 常见比例的说明，其他比例只标注 Landscape / Portrait
+_RATIO_LABELS = {
+    "1:1": "Square",
+    "5:4": "Monitor",
+    "4:3": "Standard",
+    "3:2": "Classic",
+    "16:10": "Widescreen",
+    "16:9": "Widescreen",
+    "21:9": "Ultrawide",
+    "32:9": "Super Ultrawide",
+    "4:5": "Portrait Monitor",
+    "3:4": "Portrait Standard",
+    "2:3": "Portrait Classic",
+    "10:16": "Portrait Widescreen",
+    "9:16": "Portrait Widescreen",
+}
+
+# 数学表达式节点的结果缓存，键为 (表达式, a, b, c)，值为 (输出, 该表达式的性能统计条目)
+# 命中时直接给条目的计数器加一，不再经过统计对象的查找；结果取决于计算量限制，限制修改后清空
+_expression_result_memo = LRUCache(1024)
+on_limits_changed(_expression_result_memo.clear)
+
+
+def _memo_value(value):
+    """
+    结果缓存键中的数值
+    -0.0 与 0.0 相等且哈希相同，但 atan2、copysign 等函数的结果不同，负零单独作为键
+    """
+    if isinstance(value, float) and value == 0.0 and math.copysign(1.0, value) < 0:
+        return ("-0.0",)
+    return value
 
 
 class PopoImageSizeNode:
@@ -25,6 +125,7 @@ class PopoImageSizeNode:
     FUNCTION = "get_image_size"
     CATEGORY = "popo-utility"
     
+    @memoize_by_shape(_dimension_memo)
     def get_image_size(self, image):
         """获取图片尺寸"""
         try:
@@ -61,6 +162,7 @@ class PopoImageDimensionsNode:
     FUNCTION = "get_dimensions"
     CATEGORY = "popo-utility"
     
+    @memoize_by_shape(_dimension_memo)
     def get_dimensions(self, image):
         """获取图片详细尺寸信息"""
         try:
@@ -81,6 +183,44 @@ class PopoImageDimensionsNode:
             return (0, 0, 0, 0)
 
 
+class PopoImageDimensionsListNode:
+    """一次获取整个图片列表每一项尺寸的节点，只读取张量形状"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+            },
+            "optional": {
+                "expand_batch": ("BOOLEAN", {"default": True}),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "long_side", "short_side", "count")
+    FUNCTION = "get_dimensions_list"
+    CATEGORY = "popo-utility"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True, True, True, False)
+    
+    def get_dimensions_list(self, image, expand_batch=True):
+        """
+        获取图片列表中每一项的宽度、高度、长边、短边
+        expand_batch为True时批次中的每张图片各占一项，否则每个张量占一项
+        """
+        # INPUT_IS_LIST 时所有输入都是列表
+        if isinstance(expand_batch, list):
+            expand_batch = expand_batch[0] if expand_batch else True
+        
+        try:
+            sizes = collect_image_sizes(image, bool(expand_batch))
+            return dimension_lists(sizes) + (len(sizes),)
+        except Exception as e:
+            print(f"PopoImageDimensionsListNode error: {e}")
+            return ([0], [0], [0], [0], 0)
+
+
 class PopoImageAspectRatioNode:
     """计算图片宽高比的节点"""
     
@@ -89,6 +229,10 @@ class PopoImageAspectRatioNode:
         return {
             "required": {
                 "image": ("IMAGE",),
+            },
+            "optional": {
+                "max_denominator": ("INT", {"default": DEFAULT_MAX_DENOMINATOR, "min": 1, "max": 1000}),
+                "tolerance": ("FLOAT", {"default": DEFAULT_TOLERANCE, "min": 0.0, "max": 0.5, "step": 0.001}),
             }
         }
     
@@ -97,7 +241,8 @@ class PopoImageAspectRatioNode:
     FUNCTION = "calculate_aspect_ratio"
     CATEGORY = "popo-utility"
     
-    def calculate_aspect_ratio(self, image):
+    @memoize_by_shape(_dimension_memo)
+    def calculate_aspect_ratio(self, image, max_denominator=DEFAULT_MAX_DENOMINATOR, tolerance=DEFAULT_TOLERANCE):
         """计算图片宽高比"""
         try:
             # 从PyTorch张量获取尺寸
@@ -114,40 +259,443 @@ class PopoImageAspectRatioNode:
             # 计算宽高比
             aspect_ratio = width / height
             
-            # 识别常见比例
-            ratio_name = self._identify_common_ratio(aspect_ratio)
+            # 识别比例名称
+            ratio_name = self._identify_common_ratio(width, height, max_denominator, tolerance)
             
             return (round(aspect_ratio, 3), ratio_name)
         except Exception as e:
             print(f"PopoImageAspectRatioNode error: {e}")
             return (0.0, "error")
     
-    def _identify_common_ratio(self, ratio):
-        """识别常见的宽高比名称"""
-        common_ratios = {
-            1.0: "1:1 Square",
-            4/3: "4:3 Standard",
-            3/2: "3:2 Classic",
-            16/9: "16:9 Widescreen",
-            21/9: "21:9 Ultrawide",
-            5/4: "5:4 Monitor",
-            3/4: "3:4 Portrait Standard",
-            2/3: "2:3 Portrait Classic",
-            9/16: "9:16 Portrait Widescreen",
-        }
-        
-        # 容差范围
-        tolerance = 0.05
-        
-        for target_ratio, name in common_ratios.items():
-            if abs(ratio - target_ratio) <= tolerance:
-                return name
-        
-        # 判断横屏还是竖屏
-        if ratio > 1:
-            return f"{ratio:.2f}:1 Landscape"
+    def _identify_common_ratio(self, width, height, max_denominator=DEFAULT_MAX_DENOMINATOR, tolerance=DEFAULT_TOLERANCE):
+        """识别宽高比名称：误差范围内最简单的整数比，常见比例附带说明"""
+        return format_ratio_name(
+            width, height, _RATIO_LABELS, ("Landscape", "Portrait", "Square"),
+            max_denominator=max_denominator, tolerance=tolerance,
+        )
+
+
+def _to_number_outputs(result):
+    """把表达式结果转换为 (INT, FLOAT)，NaN替换为0，正负无穷替换为±999999"""
+    # 整数运算得到的精确结果（包括比较得到的bool）直接输出
+    if isinstance(result, int):
+        try:
+            return (int(result), float(result))
+        except OverflowError:
+            result = math.inf if result > 0 else -math.inf
+    
+    # 确保结果是数字
+    if not isinstance(result, (int, float, complex)):
+        raise ValueError("表达式结果必须是数字")
+    
+    # 处理复数
+    if isinstance(result, complex):
+        if result.imag == 0:
+            result = result.real
         else:
-            return f"1:{1/ratio:.2f} Portrait"
+            raise ValueError("不支持复数结果")
+    
+    # 处理特殊值
+    if math.isnan(result):
+        result = 0.0
+    elif math.isinf(result):
+        result = 999999.0 if result > 0 else -999999.0
+    
+    result_float = float(result)
+    return (int(result_float), result_float)
+
+
+class PopoImageFileDimensionsNode:
+    """根据文件路径获取图片尺寸的节点，只解析文件头，不解码像素数据"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "path": ("STRING", {"default": ""}),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "FLOAT", "STRING")
+    RETURN_NAMES = ("width", "height", "long_side", "short_side", "aspect_ratio", "ratio_name")
+    FUNCTION = "get_file_dimensions"
+    CATEGORY = "popo-utility"
+    
+    @classmethod
+    def IS_CHANGED(s, path, **kwargs):
+        """文件路径、修改时间或大小变化时重新执行"""
+        try:
+            return make_fingerprint(file_signature(resolve_image_path(path)))
+        except OSError:
+            return make_fingerprint(path)
+    
+    def get_file_dimensions(self, path):
+        """读取图片文件头获取宽度、高度、长边、短边和宽高比"""
+        try:
+            width, height, _ = probe_image_size(path)
+            
+            long_side = max(height, width)
+            short_side = min(height, width)
+            aspect_ratio = width / height
+            
+            return (width, height, long_side, short_side, round(aspect_ratio, 3),
+                    PopoImageAspectRatioNode._identify_common_ratio(self, width, height))
+        except Exception as e:
+            print(f"PopoImageFileDimensionsNode error: {e}")
+            return (0, 0, 0, 0, 0.0, "error")
+
+
+class PopoImageDirectoryScanNode:
+    """增量扫描图片目录的文件头尺寸并按宽高、比例筛选，结果保存在磁盘索引中"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "directory": ("STRING", {"default": ""}),
+                "recursive": ("BOOLEAN", {"default": True}),
+                "min_width": ("INT", {"default": 0, "min": 0, "max": 65535}),
+                "min_height": ("INT", {"default": 0, "min": 0, "max": 65535}),
+                "max_width": ("INT", {"default": 0, "min": 0, "max": 65535}),
+                "max_height": ("INT", {"default": 0, "min": 0, "max": 65535}),
+            },
+            "optional": {
+                "ratio_name": ("STRING", {"default": ""}),
+            }
+        }
+    
+    RETURN_TYPES = ("STRING", "INT", "INT", "INT", "STRING")
+    RETURN_NAMES = ("paths", "widths", "heights", "count", "summary")
+    FUNCTION = "scan_directory"
+    CATEGORY = "popo-utility"
+    OUTPUT_IS_LIST = (True, True, True, False, False)
+    
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        """目录内容随时可能变化，每次都执行（增量扫描的开销很小）"""
+        return float("nan")
+    
+    def scan_directory(self, directory, recursive, min_width, min_height, max_width, max_height, ratio_name=""):
+        """扫描目录，只探测新增或变化的文件，返回符合条件的路径和尺寸"""
+        try:
+            result, images = scan_and_query(
+                directory, recursive, min_width, min_height, max_width, max_height, ratio_name,
+                ratio_format=lambda width, height: PopoImageAspectRatioNode._identify_common_ratio(self, width, height),
+            )
+            summary = (
+                f"{result.total} files, {result.probed} probed, {result.removed} removed, "
+                f"{result.failed} failed, {len(images)} matched in {result.elapsed:.2f}s"
+            )
+            return (
+                [image.path for image in images],
+                [image.width for image in images],
+                [image.height for image in images],
+                len(images),
+                summary,
+            )
+        except Exception as e:
+            print(f"PopoImageDirectoryScanNode error: {e}")
+            return ([], [], [], 0, f"error: {e}")
+
+
+class PopoAspectBucketNode:
+    """宽高比分桶节点，一次为整个图片列表或宽高列表分配分辨率桶"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "preset": (list(BUCKET_PRESETS), {"default": "sdxl"}),
+                "step": ("INT", {"default": 64, "min": 8, "max": 512, "step": 8}),
+                "custom_buckets": ("STRING", {"default": "1024x1024, 1152x896, 896x1152", "multiline": True}),
+            },
+            "optional": {
+                "image": ("IMAGE",),
+                "widths": ("INT", {"forceInput": True}),
+                "heights": ("INT", {"forceInput": True}),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("bucket_id", "width", "height", "resize_width", "resize_height", "crop_x", "crop_y")
+    FUNCTION = "assign_buckets"
+    CATEGORY = "popo-utility"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True,) * 7
+    
+    def assign_buckets(self, preset, step, custom_buckets, image=None, widths=None, heights=None):
+        """
+        为每张图片分配对数宽高比最接近的桶
+        输出与输入一一对应：桶ID、桶尺寸、等比缩放后的尺寸和居中裁剪偏移
+        """
+        try:
+            table = get_bucket_table(preset[0], custom_buckets[0], step[0])
+            assignments = table.assign_many(gather_sizes(image, widths, heights))
+            return tuple(list(column) for column in zip(*assignments)) or ([],) * 7
+        except Exception as e:
+            print(f"PopoAspectBucketNode error: {e}")
+            return ([0], [0], [0], [0], [0], [0], [0])
+
+
+class PopoResolutionPlannerNode:
+    """分辨率规划节点：按长边/短边缩放、对齐倍数、限制总像素，一次规划整个列表"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return planner_input_types()
+    
+    RETURN_TYPES = ("INT", "INT", "FLOAT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ResolutionPlan._fields
+    FUNCTION = "plan"
+    CATEGORY = "popo-utility"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True,) * 7
+    
+    def plan(self, target, side, multiple, max_pixels, snap, upscale, image=None, widths=None, heights=None):
+        """
+        输出与输入一一对应：目标宽高、缩放系数、等比缩放后的宽高，
+        以及从缩放尺寸到目标尺寸需要填充（正数）或裁剪（负数）的像素数
+        """
+        try:
+            return tuple(plan_resolutions(
+                gather_sizes(image, widths, heights),
+                target[0], side[0], multiple[0], max_pixels[0], snap[0], upscale[0],
+            ))
+        except Exception as e:
+            print(f"PopoResolutionPlannerNode error: {e}")
+            return ([0], [0], [0.0], [0], [0], [0], [0])
+
+
+class PopoLatentDimensionsNode:
+    """获取LATENT对应像素尺寸的节点，只读取形状，不触发设备同步"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "samples": ("LATENT",),
+            },
+            "optional": {
+                "scale": ("INT", {"default": DEFAULT_LATENT_SCALE, "min": 1, "max": 64}),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "latent_width", "latent_height", "batch_size", "frames")
+    FUNCTION = "get_latent_dimensions"
+    CATEGORY = "popo-utility"
+    
+    def get_latent_dimensions(self, samples, scale=DEFAULT_LATENT_SCALE):
+        """潜空间 [B, C, h, w] 或 [B, C, T, h, w]，像素尺寸为潜空间尺寸乘以scale"""
+        try:
+            dims, _ = latent_dimensions(samples)
+            return (dims.width * scale, dims.height * scale, dims.width, dims.height, dims.batch, dims.frames)
+        except Exception as e:
+            print(f"PopoLatentDimensionsNode error: {e}")
+            return (0, 0, 0, 0, 0, 0)
+
+
+class PopoMaskDimensionsNode:
+    """获取遮罩尺寸的节点，只读取形状"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "mask": ("MASK",),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "batch_size")
+    FUNCTION = "get_mask_dimensions"
+    CATEGORY = "popo-utility"
+    
+    def get_mask_dimensions(self, mask):
+        """遮罩 [H, W] 或 [B, H, W]"""
+        try:
+            dims = mask_dimensions(mask)
+            return (dims.width, dims.height, dims.batch)
+        except Exception as e:
+            print(f"PopoMaskDimensionsNode error: {e}")
+            return (0, 0, 0)
+
+
+class PopoVideoDimensionsNode:
+    """获取视频帧张量尺寸的节点，只读取形状"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "frames": ("IMAGE",),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("width", "height", "frames", "batch_size")
+    FUNCTION = "get_video_dimensions"
+    CATEGORY = "popo-utility"
+    
+    def get_video_dimensions(self, frames):
+        """视频帧 [B, T, H, W, C]，或以批次作为帧序列的 [T, H, W, C]"""
+        try:
+            dims = video_dimensions(frames)
+            return (dims.width, dims.height, dims.frames, dims.batch)
+        except Exception as e:
+            print(f"PopoVideoDimensionsNode error: {e}")
+            return (0, 0, 0, 0)
+
+
+class PopoImageStatisticsNode:
+    """图片通道统计节点，按固定大小的块遍历批次，内存占用不随批次大小增长"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "low_percentile": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+                "high_percentile": ("FLOAT", {"default": 99.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+            },
+            "optional": {
+                "chunk_megabytes": ("INT", {"default": DEFAULT_CHUNK_MEGABYTES, "min": 1, "max": 4096}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "FLOAT", "FLOAT", "FLOAT", "FLOAT", "FLOAT", "FLOAT")
+    RETURN_NAMES = ("stats_json", "mean", "std", "min", "max", "low_percentile", "high_percentile")
+    FUNCTION = "compute_statistics"
+    CATEGORY = "popo-utility"
+    OUTPUT_IS_LIST = (False, True, True, True, True, True, True)
+
+    def compute_statistics(self, image, low_percentile, high_percentile, chunk_megabytes=DEFAULT_CHUNK_MEGABYTES):
+        """
+        每张图片输出所有通道整体的均值、标准差、最小/最大值和两个分位数；
+        stats_json 包含逐通道的统计和256级直方图
+        """
+        try:
+            return statistics_outputs(image, low_percentile, high_percentile, chunk_megabytes)
+        except Exception as e:
+            print(f"PopoImageStatisticsNode error: {e}")
+            return ("[]", [0.0], [0.0], [0.0], [0.0], [0.0], [0.0])
+
+
+class PopoImageFingerprintNode:
+    """图片内容指纹节点，用于去重和缓存键"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "image": ("IMAGE",),
+                "mode": (list(FINGERPRINT_MODES), {"default": "cheap"}),
+            },
+            "optional": {
+                "perceptual": ("BOOLEAN", {"default": False}),
+                "max_distance": ("INT", {"default": 0, "min": 0, "max": 64}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING", "STRING", "INT")
+    RETURN_NAMES = ("fingerprint", "batch_fingerprint", "perceptual_hash", "duplicate_of")
+    FUNCTION = "fingerprint"
+    CATEGORY = "popo-utility"
+    OUTPUT_IS_LIST = (True, False, True, True)
+
+    def fingerprint(self, image, mode, perceptual=False, max_distance=0):
+        """
+        cheap 只哈希形状和抽样像素，exact 流式哈希全部像素；
+        duplicate_of 为每张图片第一次出现的下标，没有重复时为 -1，
+        启用感知哈希且 max_distance > 0 时近似图片也算重复
+        """
+        try:
+            return fingerprint_outputs(image, mode, perceptual, max_distance)
+        except Exception as e:
+            print(f"PopoImageFingerprintNode error: {e}")
+            return ([""], "", [""], [-1])
+
+
+class PopoImageGroupBySizeNode:
+    """按尺寸分组节点，把尺寸混杂的图片列表合并成尺寸一致的批次"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return grouping_input_types()
+
+    RETURN_TYPES = ("IMAGE", "INT", "INT", "INT")
+    RETURN_NAMES = ("images", "order", "batch_sizes", "group_count")
+    FUNCTION = "group"
+    CATEGORY = "popo-utility"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True, True, False)
+
+    def group(self, image, group_by, preset=None, step=None, custom_buckets=None):
+        """
+        size 按精确尺寸分组，bucket 先把每张图片缩放裁剪到所属的宽高比桶再分组；
+        order 和 batch_sizes 接到 Popo Image Restore Order 还原原始顺序
+        """
+        try:
+            groups = group_images(
+                image,
+                group_by[0],
+                preset[0] if preset else "sdxl",
+                custom_buckets[0] if custom_buckets else "",
+                step[0] if step else 64,
+            )
+            return (groups.images, groups.order, groups.batch_sizes, len(groups.images))
+        except Exception as e:
+            print(f"PopoImageGroupBySizeNode error: {e}")
+            return (list(image), [], [], 0)
+
+
+class PopoImageRestoreOrderNode:
+    """还原顺序节点，与按尺寸分组节点配套使用"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return restore_input_types()
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("images",)
+    FUNCTION = "restore"
+    CATEGORY = "popo-utility"
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True,)
+
+    def restore(self, image, order, batch_sizes=None):
+        """按order把处理后的分组拆开还原顺序，连接batch_sizes时同时还原原来的批次结构"""
+        try:
+            return (restore_order(image, order, batch_sizes),)
+        except Exception as e:
+            print(f"PopoImageRestoreOrderNode error: {e}")
+            return (list(image),)
+
+
+class PopoContentBoundingBoxNode:
+    """内容边界框 / 自动裁剪节点，裁剪结果是原图片的切片视图，不复制像素"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return autocrop_input_types()
+
+    RETURN_TYPES = ("IMAGE", "IMAGE", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("cropped", "cropped_batch", "x", "y", "width", "height")
+    FUNCTION = "autocrop"
+    CATEGORY = "popo-utility"
+    OUTPUT_IS_LIST = (True, False, True, True, True, True)
+
+    def autocrop(self, image, mode, threshold, padding, background="#000000"):
+        """
+        auto 以左上角像素为背景色，color 使用background，alpha 按透明度；
+        cropped 为每张图片各自的裁剪，cropped_batch 按所有图片内容的并集裁剪整个批次，
+        没有内容的图片保持原尺寸
+        """
+        try:
+            return autocrop_outputs(image, mode, threshold, padding, background)
+        except Exception as e:
+            print(f"PopoContentBoundingBoxNode error: {e}")
+            return ([image], image, [0], [0], [0], [0])
 
 
 class PopoMathExpressionNode:
@@ -161,6 +709,9 @@ class PopoMathExpressionNode:
                 "b": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
                 "c": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
                 "expression": ("STRING", {"multiline": False, "default": "a + b + c"}),
+            },
+            "optional": {
+                "sandbox": ("BOOLEAN", {"default": SANDBOX_ENABLED}),
             }
         }
     
@@ -169,149 +720,272 @@ class PopoMathExpressionNode:
     FUNCTION = "calculate_expression"
     CATEGORY = "popo-utility"
     
-    def calculate_expression(self, a, b, c, expression):
-        """计算数学表达式"""
+    def calculate_expression(self, a, b, c, expression, sandbox=SANDBOX_ENABLED):
+        """计算数学表达式，sandbox为True时在带资源限制的隔离进程中求值"""
         try:
-            # 安全的数学函数白名单
-            safe_functions = {
-                # 基础数学函数
-                'abs': abs,
-                'round': round,
-                'int': int,
-                'float': float,
-                'min': min,
-                'max': max,
-                'pow': pow,
+            # 数值直接作为键：相等的整数和浮点数哈希相同、结果也相同（evaluate_number 把整数值的浮点数按整数计算），
+            # 超出浮点精度的大整数保持原值，不会与相邻的整数混淆；负零见 _memo_value
+            key = (expression, _memo_value(a), _memo_value(b), _memo_value(c))
+            cached = _expression_result_memo.get(key)
+            if cached is not None:
+                output, stats = cached
+                stats.cache_hits += 1
+                return output
+            
+            with profiler.measure("PopoMathExpressionNode", expression) as measurement:
+                # 从缓存获取已检查并预编译的表达式
+                compiled = compile_expression(expression)
                 
-                # math模块函数
-                'ceil': math.ceil,
-                'floor': math.floor,
-                'sqrt': math.sqrt,
-                'exp': math.exp,
-                'log': math.log,
-                'log10': math.log10,
-                'log2': math.log2,
-                'sin': math.sin,
-                'cos': math.cos,
-                'tan': math.tan,
-                'asin': math.asin,
-                'acos': math.acos,
-                'atan': math.atan,
-                'atan2': math.atan2,
-                'sinh': math.sinh,
-                'cosh': math.cosh,
-                'tanh': math.tanh,
-                'asinh': math.asinh,
-                'acosh': math.acosh,
-                'atanh': math.atanh,
-                'degrees': math.degrees,
-                'radians': math.radians,
-                'fabs': math.fabs,
-                'factorial': math.factorial,
-                'gcd': math.gcd,
-                'lcm': getattr(math, 'lcm', lambda x, y: abs(x * y) // math.gcd(x, y)),
+                # 计算表达式，整数输入且表达式保持整数时使用精确的整数运算
+                if sandbox:
+                    # 语法和计算量检查已在本进程完成，工作进程只负责求值
+                    result = get_sandbox_pool().evaluate(expression, (a, b, c))
+                else:
+                    result = compiled.evaluate_number(a, b, c)
                 
-                # 数学常数
-                'pi': math.pi,
-                'e': math.e,
-                'tau': math.tau,
-                'inf': math.inf,
-                'nan': math.nan,
-            }
-            
-            # 创建安全的执行环境
-            safe_dict = {
-                '__builtins__': {},
-                'a': float(a),
-                'b': float(b), 
-                'c': float(c),
-                **safe_functions
-            }
+                output = _to_number_outputs(result)
             
-            # 验证表达式安全性
-            if not self._is_safe_expression(expression):
-                raise ValueError("表达式包含不安全的操作")
+            _expression_result_memo.put(key, (output, measurement.stats))
+            return output
             
-            # 计算表达式
-            result = eval(expression, safe_dict)
+        except Exception as e:
+            print(f"PopoMathExpressionNode error: {e}")
+            return (0, 0.0)
+    
+    def _is_safe_expression(self, expression):
+        """检查表达式是否安全"""
+        return is_safe_expression(expression)
+
+
+class PopoMathProgramNode:
+    """多行数学程序节点，一次编译和计算多个相关的结果，后面的行可以引用前面的结果"""
+    
+    # 输出槽数量，每个槽同时提供INT和FLOAT
+    OUTPUT_SLOTS = 4
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "a": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "b": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "c": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "program": ("STRING", {
+                    "multiline": True,
+                    "default": "w = a // 8 * 8\nh = b // 8 * 8\nlong = max(w, h)\nscale = c / long if long else 0",
+                }),
+            },
+            "optional": {
+                "outputs": ("STRING", {"multiline": False, "default": ""}),
+            }
+        }
+    
+    RETURN_TYPES = ("INT", "FLOAT") * OUTPUT_SLOTS
+    RETURN_NAMES = tuple(
+        f"out{slot}_{kind}" for slot in range(1, OUTPUT_SLOTS + 1) for kind in ("int", "float")
+    )
+    FUNCTION = "run_program"
+    CATEGORY = "popo-utility"
+    
+    def run_program(self, a, b, c, program, outputs=""):
+        """
+        执行程序并按outputs（逗号分隔的名称）把结果放入输出槽
+        outputs为空时按赋值顺序输出前几个名称，多余的输出槽为0
+        """
+        empty = (0, 0.0) * self.OUTPUT_SLOTS
+        try:
+            key = ("program", program, outputs, _memo_value(a), _memo_value(b), _memo_value(c))
+            cached = _expression_result_memo.get(key)
+            if cached is not None:
+                output, stats = cached
+                stats.cache_hits += 1
+                return output
             
-            # 确保结果是数字
-            if not isinstance(result, (int, float, complex)):
-                raise ValueError("表达式结果必须是数字")
+            with profiler.measure("PopoMathProgramNode", program) as measurement:
+                compiled = compile_program(program)
+                names = [name.strip() for name in (outputs or "").split(",") if name.strip()]
+                names = names or list(compiled.names)
+                if len(names) > self.OUTPUT_SLOTS:
+                    raise ValueError(f"最多只能输出 {self.OUTPUT_SLOTS} 个结果")
+                for name in names:
+                    if name not in compiled.names:
+                        raise ValueError(f"程序中没有赋值: {name}")
+                
+                results = compiled.evaluate_number(a, b, c)
+                output = ()
+                for name in names[:self.OUTPUT_SLOTS]:
+                    output += _to_number_outputs(results[name])
+                output += empty[len(output):]
             
-            # 处理复数
-            if isinstance(result, complex):
-                if result.imag == 0:
-                    result = result.real
-                else:
-                    raise ValueError("不支持复数结果")
+            _expression_result_memo.put(key, (output, measurement.stats))
+            return output
             
-            # 处理特殊值
-            if math.isnan(result):
-                result = 0.0
-            elif math.isinf(result):
-                result = 999999.0 if result > 0 else -999999.0
+        except Exception as e:
+            print(f"PopoMathProgramNode error: {e}")
+            return empty
+
+
+class PopoMathExpressionBatchNode:
+    """批量数学表达式计算节点，对FLOAT列表或一维张量一次性向量化计算"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "a": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "b": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "c": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "expression": ("STRING", {"multiline": False, "default": "a + b + c"}),
+            }
+        }
+    
+    INPUT_IS_LIST = True
+    RETURN_TYPES = ("INT", "FLOAT")
+    RETURN_NAMES = ("result_int", "result_float")
+    OUTPUT_IS_LIST = (True, True)
+    FUNCTION = "calculate_batch"
+    CATEGORY = "popo-utility"
+    
+    def calculate_batch(self, a, b, c, expression):
+        """对整组输入计算数学表达式，长度为1的输入会广播到其他输入的长度"""
+        try:
+            # INPUT_IS_LIST模式下所有输入都是列表
+            if isinstance(expression, (list, tuple)):
+                expression = expression[0] if expression else ""
             
-            result_float = float(result)
-            result_int = int(result_float)
+            with profiler.measure("PopoMathExpressionBatchNode", expression):
+                result = evaluate_vectorized(expression, (a, b, c))
+                return to_result_lists(result)
             
-            return (result_int, result_float)
+        except Exception as e:
+            print(f"PopoMathExpressionBatchNode error: {e}")
+            return ([0], [0.0])
+
+
+class PopoSweepNode:
+    """参数扫描节点，在整个索引范围上按分块向量化计算表达式，输出结果列表"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "start": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "stop": ("FLOAT", {"default": 1.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "step": ("FLOAT", {"default": 0.1, "min": -999999, "max": 999999, "step": 0.01}),
+                "count": ("INT", {"default": 0, "min": 0, "max": 10000000}),
+                "expression": ("STRING", {"multiline": False, "default": "x"}),
+            }
+        }
+    
+    RETURN_TYPES = ("FLOAT", "INT", "INT")
+    RETURN_NAMES = ("values", "values_int", "count")
+    OUTPUT_IS_LIST = (True, True, False)
+    FUNCTION = "generate_sweep"
+    CATEGORY = "popo-utility"
+    
+    def generate_sweep(self, start, stop, step, count, expression):
+        """
+        生成扫描序列，count大于0时在[start, stop]上均匀取count个值，否则按step取值
+        表达式中 i 为索引，x 为 start + i * step，n 为序列长度
+        """
+        try:
+            # ComfyUI 会在节点返回后立即展开列表输出，惰性视图无法推迟计算，
+            # 在这里生成全部值，任何分块计算失败都按节点错误处理
+            sweep = make_sweep(expression, start, stop, step, count)
+            values, values_int = sweep.to_lists()
+            return (values, values_int, sweep.length)
             
         except Exception as e:
-            print(f"PopoMathExpressionNode error: {e}")
-            return (0, 0.0)
+            print(f"PopoSweepNode error: {e}")
+            return ([0.0], [0], 1)
+
+
+class PopoImageExpressionNode:
+    """逐像素图片表达式节点，使用数学表达式语法对整批图片做像素运算"""
     
-    def _is_safe_expression(self, expression):
-        """检查表达式是否安全"""
-        # 禁止的关键词和操作
-        forbidden_patterns = [
-            r'import\s+',
-            r'__.*__',
-            r'eval\s*\(',
-            r'exec\s*\(',
-            r'open\s*\(',
-            r'file\s*\(',
-            r'input\s*\(',
-            r'raw_input\s*\(',
-            r'compile\s*\(',
-            r'globals\s*\(',
-            r'locals\s*\(',
-            r'vars\s*\(',
-            r'dir\s*\(',
-            r'getattr\s*\(',
-            r'setattr\s*\(',
-            r'hasattr\s*\(',
-            r'delattr\s*\(',
-            r'callable\s*\(',
-            r'isinstance\s*\(',
-            r'issubclass\s*\(',
-            r'super\s*\(',
-            r'type\s*\(',
-            r'classmethod\s*\(',
-            r'staticmethod\s*\(',
-            r'property\s*\(',
-        ]
-        
-        for pattern in forbidden_patterns:
-            if re.search(pattern, expression, re.IGNORECASE):
-                return False
-        
-        return True
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "a": ("IMAGE",),
+                "expression": ("STRING", {"multiline": False, "default": "clamp(a * 1.2 - 0.1)"}),
+            },
+            "optional": {
+                "b": ("IMAGE",),
+                "c": ("IMAGE",),
+                "b_value": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+                "c_value": ("FLOAT", {"default": 0.0, "min": -999999, "max": 999999, "step": 0.01}),
+            }
+        }
+    
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("image",)
+    FUNCTION = "apply_expression"
+    CATEGORY = "popo-utility"
+    
+    def apply_expression(self, a, expression, b=None, c=None, b_value=0.0, c_value=0.0):
+        """逐像素计算表达式，未连接图片的b/c使用对应的数值输入"""
+        try:
+            values = (
+                a,
+                b if b is not None else b_value,
+                c if c is not None else c_value,
+            )
+            with profiler.measure("PopoImageExpressionNode", expression):
+                return (evaluate_image_expression(expression, values),)
+            
+        except Exception as e:
+            print(f"PopoImageExpressionNode error: {e}")
+            return (a,)
 
 
 # ComfyUI需要的映射
 NODE_CLASS_MAPPINGS = {
     "PopoImageSizeNode": PopoImageSizeNode,
     "PopoImageDimensionsNode": PopoImageDimensionsNode,
+    "PopoImageDimensionsListNode": PopoImageDimensionsListNode,
     "PopoImageAspectRatioNode": PopoImageAspectRatioNode,
+    "PopoImageFileDimensionsNode": PopoImageFileDimensionsNode,
+    "PopoImageDirectoryScanNode": PopoImageDirectoryScanNode,
+    "PopoAspectBucketNode": PopoAspectBucketNode,
+    "PopoResolutionPlannerNode": PopoResolutionPlannerNode,
+    "PopoLatentDimensionsNode": PopoLatentDimensionsNode,
+    "PopoMaskDimensionsNode": PopoMaskDimensionsNode,
+    "PopoVideoDimensionsNode": PopoVideoDimensionsNode,
+    "PopoImageStatisticsNode": PopoImageStatisticsNode,
+    "PopoImageFingerprintNode": PopoImageFingerprintNode,
+    "PopoImageGroupBySizeNode": PopoImageGroupBySizeNode,
+    "PopoImageRestoreOrderNode": PopoImageRestoreOrderNode,
+    "PopoContentBoundingBoxNode": PopoContentBoundingBoxNode,
     "PopoMathExpressionNode": PopoMathExpressionNode,
+    "PopoMathProgramNode": PopoMathProgramNode,
+    "PopoMathExpressionBatchNode": PopoMathExpressionBatchNode,
+    "PopoSweepNode": PopoSweepNode,
+    "PopoImageExpressionNode": PopoImageExpressionNode,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "PopoImageSizeNode": "Popo Image Size",
     "PopoImageDimensionsNode": "Popo Image Dimensions", 
+    "PopoImageDimensionsListNode": "Popo Image Dimensions (List)",
     "PopoImageAspectRatioNode": "Popo Image Aspect Ratio",
+    "PopoImageFileDimensionsNode": "Popo Image File Dimensions",
+    "PopoImageDirectoryScanNode": "Popo Image Directory Scan",
+    "PopoAspectBucketNode": "Popo Aspect Bucket",
+    "PopoResolutionPlannerNode": "Popo Resolution Planner",
+    "PopoLatentDimensionsNode": "Popo Latent Dimensions",
+    "PopoMaskDimensionsNode": "Popo Mask Dimensions",
+    "PopoVideoDimensionsNode": "Popo Video Dimensions",
+    "PopoImageStatisticsNode": "Popo Image Statistics",
+    "PopoImageFingerprintNode": "Popo Image Fingerprint",
+    "PopoImageGroupBySizeNode": "Popo Image Group By Size",
+    "PopoImageRestoreOrderNode": "Popo Image Restore Order",
+    "PopoContentBoundingBoxNode": "Popo Content Bounding Box",
     "PopoMathExpressionNode": "Popo Math Expression",
+    "PopoMathProgramNode": "Popo Math Program",
+    "PopoMathExpressionBatchNode": "Popo Math Expression (Batch)",
+    "PopoSweepNode": "Popo Sweep",
+    "PopoImageExpressionNode": "Popo Image Expression",
 }
 
 # 打印加载信息
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+测试图片文件头尺寸探测
+用 Pillow 生成各种格式的图片，对比探测结果和解码后的尺寸
+"""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# 添加当前目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from nodes.dimension_index import DimensionIndex
+from nodes.image_probe import ImageProbeError, probe_image_size, probe_stream
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+
+@unittest.skipUnless(HAS_PIL, "需要 Pillow 生成测试图片")
+class TestImageProbe(unittest.TestCase):
+    """测试各格式的文件头解析"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _save(self, name, size=(37, 21), mode="RGB", **params):
+        path = os.path.join(self.tmpdir, name)
+        Image.new(mode, size, (10, 20, 30) if mode == "RGB" else 0).save(path, **params)
+        return path
+
+    def test_formats(self):
+        """每种格式的探测结果与解码尺寸一致"""
+        cases = [
+            ("a.png", "PNG", {}),
+            ("a.jpg", "JPEG", {}),
+            ("progressive.jpg", "JPEG", {"progressive": True}),
+            ("a.gif", "GIF", {}),
+            ("a.bmp", "BMP", {}),
+            ("a.tif", "TIFF", {}),
+            ("lzw.tif", "TIFF", {"compression": "tiff_lzw"}),
+            ("lossy.webp", "WEBP", {"lossless": False}),
+            ("lossless.webp", "WEBP", {"lossless": True}),
+        ]
+        for name, fmt, params in cases:
+            with self.subTest(name=name):
+                path = self._save(name, **params)
+                info = probe_image_size(path)
+                with Image.open(path) as decoded:
+                    self.assertEqual((info.width, info.height), decoded.size)
+                self.assertEqual(info.format, fmt)
+
+    def test_webp_extended(self):
+        """带透明通道的WebP使用VP8X块"""
+        path = os.path.join(self.tmpdir, "alpha.webp")
+        Image.new("RGBA", (300, 17), (1, 2, 3, 128)).save(path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(16)[12:16], b"VP8X")
+        self.assertEqual(probe_image_size(path)[:2], (300, 17))
+
+    def test_exif_orientation(self):
+        """EXIF方向为旋转90度时交换宽高"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        path = self._save("rotated.jpg", size=(40, 10), exif=exif.tobytes())
+        self.assertEqual(probe_image_size(path)[:2], (10, 40))
+
+        exif[0x0112] = 3  # 旋转180度不改变宽高
+        path = self._save("flipped.jpg", size=(40, 10), exif=exif.tobytes())
+        self.assertEqual(probe_image_size(path)[:2], (40, 10))
+
+    def test_reads_only_header(self):
+        """大尺寸PNG只读取文件头"""
+        path = self._save("large.png", size=(2000, 1500))
+
+        class CountingFile(io.BufferedReader):
+            consumed = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                CountingFile.consumed += len(data)
+                return data
+
+        with CountingFile(io.FileIO(path, "rb")) as f:
+            self.assertEqual(probe_stream(f)[:2], (2000, 1500))
+        self.assertLess(CountingFile.consumed, 1024)
+
+    def test_cache_invalidation(self):
+        """文件被替换后重新探测"""
+        path = self._save("swap.png", size=(8, 8))
+        self.assertEqual(probe_image_size(path)[:2], (8, 8))
+        Image.new("RGB", (16, 9)).save(path, format="PNG")
+        os.utime(path, ns=(1, 1))
+        self.assertEqual(probe_image_size(path)[:2], (16, 9))
+
+    def test_invalid_files(self):
+        """不支持或截断的文件抛出 ImageProbeError"""
+        with self.assertRaises(ImageProbeError):
+            probe_stream(io.BytesIO(b"not an image at all"))
+        path = self._save("cut.jpg")
+        with open(path, "rb") as f:
+            data = f.read(40)
+        with self.assertRaises(ImageProbeError):
+            probe_stream(io.BytesIO(data))
+        with self.assertRaises(OSError):
+            probe_image_size(os.path.join(self.tmpdir, "missing.png"))
+
+    def test_file_dimensions_node(self):
+        """路径版尺寸节点输出长短边和宽高比"""
+        from nodes_direct import PopoImageFileDimensionsNode
+
+        path = self._save("wide.png", size=(1920, 1080))
+        node = PopoImageFileDimensionsNode()
+        width, height, long_side, short_side, ratio, name = node.get_file_dimensions(path)
+        self.assertEqual((width, height, long_side, short_side), (1920, 1080, 1920, 1080))
+        self.assertAlmostEqual(ratio, 1.778)
+        self.assertIn("16:9", name)
+        self.assertEqual(PopoImageFileDimensionsNode.IS_CHANGED(path=path),
+                         PopoImageFileDimensionsNode.IS_CHANGED(path=path))
+        self.assertEqual(node.get_file_dimensions(os.path.join(self.tmpdir, "missing.png"))[0], 0)
+
+
+@unittest.skipUnless(HAS_PIL, "需要 Pillow 生成测试图片")
+class TestDimensionIndex(unittest.TestCase):
+    """测试目录尺寸索引的增量扫描"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, "sub"))
+        self.sizes = {
+            "a.png": (640, 480),
+            "b.jpg": (1920, 1080),
+            os.path.join("sub", "c.webp"): (512, 512),
+        }
+        for name, size in self.sizes.items():
+            Image.new("RGB", size).save(os.path.join(self.tmpdir, name))
+        with open(os.path.join(self.tmpdir, "broken.png"), "wb") as f:
+            f.write(b"not a png")
+        with open(os.path.join(self.tmpdir, "notes.txt"), "w") as f:
+            f.write("ignored")
+        self.index = DimensionIndex(os.path.join(self.tmpdir, "index", "dimensions.sqlite"), workers=4)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_incremental_scan(self):
+        """第二次扫描只探测变化的文件"""
+        result = self.index.scan(self.tmpdir)
+        self.assertEqual((result.total, result.probed, result.failed), (4, 4, 1))
+
+        result = self.index.scan(self.tmpdir)
+        self.assertEqual((result.probed, result.unchanged, result.removed), (0, 4, 0))
+
+        path = os.path.join(self.tmpdir, "a.png")
+        Image.new("RGB", (100, 300)).save(path)
+        os.utime(path, ns=(1, 1))
+        os.remove(os.path.join(self.tmpdir, "b.jpg"))
+        result = self.index.scan(self.tmpdir)
+        self.assertEqual((result.total, result.probed, result.removed), (3, 1, 1))
+
+        images = {os.path.relpath(image.path, self.tmpdir): image[1:3] for image in self.index.query(self.tmpdir)}
+        self.assertEqual(images, {"a.png": (100, 300), os.path.join("sub", "c.webp"): (512, 512)})
+        self.assertEqual(len(self.index.errors(self.tmpdir)), 1)
+
+    def test_query_filters(self):
+        """按尺寸、比例和是否递归筛选"""
+        self.index.scan(self.tmpdir)
+        names = lambda images: sorted(os.path.basename(image.path) for image in images)
+        self.assertEqual(names(self.index.query(self.tmpdir, min_width=600)), ["a.png", "b.jpg"])
+        self.assertEqual(names(self.index.query(self.tmpdir, max_height=500)), ["a.png"])
+        self.assertEqual(names(self.index.query(self.tmpdir, ratio_name="16:9")), ["b.jpg"])
+        self.assertEqual(names(self.index.query(self.tmpdir, recursive=False)), ["a.png", "b.jpg"])
+        self.assertEqual(names(self.index.query(os.path.join(self.tmpdir, "sub"))), ["c.webp"])
+
+    def test_persistence(self):
+        """重新打开索引后不需要重新探测"""
+        self.index.scan(self.tmpdir)
+        self.index.close()
+        self.index = DimensionIndex(self.index.path)
+        self.assertEqual(self.index.scan(self.tmpdir).probed, 0)
+
+
+    def test_ratio_name_migration(self):
+        """从版本1、2升级时只重新生成比例名称"""
+        for version in (1, 2):
+            self.index.scan(self.tmpdir)
+            with self.index._conn:
+                self.index._conn.execute("UPDATE images SET ratio_name = '16:9 (宽屏)' WHERE error IS NULL")
+                self.index._conn.execute(f"PRAGMA user_version={version}")
+            self.index.close()
+            self.index = DimensionIndex(self.index.path)
+            self.assertEqual(self.index.query(self.tmpdir, ratio_name="宽屏"), [])
+            self.assertEqual([image.ratio_name for image in self.index.query(self.tmpdir, ratio_name="16:9")], ["16:9"])
+            self.assertEqual(self.index.scan(self.tmpdir).probed, 0)
+
+    def test_ratio_labels_per_node_set(self):
+        """索引只保存比例，两套节点各自添加说明文字并按其筛选"""
+        from nodes import dimension_index
+        from nodes.image_utils import identify_common_ratio
+        from nodes_direct import PopoImageDirectoryScanNode
+
+        self.index.scan(self.tmpdir)
+        ratios = {os.path.basename(image.path): image.ratio_name for image in self.index.query(self.tmpdir)}
+        self.assertEqual(ratios, {"a.png": "4:3", "b.jpg": "16:9", "c.webp": "1:1"})
+        images = self.index.query(self.tmpdir, ratio_name="宽屏", ratio_format=identify_common_ratio)
+        self.assertEqual([image.ratio_name for image in images], ["16:9 (宽屏)"])
+
+        dimension_index._index = self.index
+        try:
+            node = PopoImageDirectoryScanNode()
+            paths = node.scan_directory(self.tmpdir, True, 0, 0, 0, 0, ratio_name="Widescreen")[0]
+            self.assertEqual([os.path.basename(path) for path in paths], ["b.jpg"])
+            self.assertEqual(node.scan_directory(self.tmpdir, True, 0, 0, 0, 0, ratio_name="宽屏")[3], 0)
+        finally:
+            dimension_index._index = None
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,11 +13,28 @@ from unittest.mock import MagicMock
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# 模拟ComfyUI环境
-sys.modules['torch'] = MagicMock()
-sys.modules['numpy'] = MagicMock()
+# 模拟ComfyUI环境（仅在未安装torch/numpy时使用模拟模块）
+for _module_name in ('torch', 'numpy'):
+    try:
+        __import__(_module_name)
+    except ImportError:
+        sys.modules[_module_name] = MagicMock()
 
-from nodes_direct import PopoMathExpressionNode
+HAS_NUMPY = not isinstance(sys.modules['numpy'], MagicMock)
+HAS_TORCH = not isinstance(sys.modules['torch'], MagicMock)
+
+from nodes_direct import (
+    PopoMathExpressionNode,
+    PopoMathProgramNode,
+    PopoMathExpressionBatchNode,
+    PopoSweepNode,
+    PopoImageExpressionNode,
+    PopoLatentDimensionsNode,
+    PopoMaskDimensionsNode,
+    PopoVideoDimensionsNode,
+)
+from nodes.cache_utils import LRUCache
+from nodes import expression_engine
 
 
 class TestPopoMathExpressionNode(unittest.TestCase):
@@ -188,6 +205,689 @@ class TestPopoMathExpressionNode(unittest.TestCase):
             self.assertEqual(result_int, 0)
             self.assertEqual(result_float, 0.0)
 
+    def test_ast_validation(self):
+        """测试语法树白名单检查"""
+        # 白名单之外的语法和名称都会被拒绝
+        rejected = [
+            "a.real",
+            "(1).__class__",
+            "[a, b]",
+            "lambda: a",
+            "'text'",
+            "unknown_name + a",
+            "pi(a)",
+            "abs(**{})",
+        ]
+        for expr in rejected:
+            self.assertFalse(expression_engine.is_safe_expression(expr), expr)
+            self.assertEqual(self.node.calculate_expression(1, 2, 3, expr), (0, 0.0))
+        
+        # 合法表达式，包括条件表达式
+        self.assertTrue(expression_engine.is_safe_expression("max(a, b) if a > 0 else c"))
+        result_int, result_float = self.node.calculate_expression(-1, 2, 7, "max(a, b) if a > 0 else c")
+        self.assertEqual(result_float, 7.0)
+        
+        # 错误信息包含出错位置
+        with self.assertRaises(expression_engine.ExpressionError) as ctx:
+            expression_engine.parse_expression("a + b * foo")
+        self.assertEqual(ctx.exception.col_offset, 8)
+        self.assertIn("foo", str(ctx.exception))
+
+    def test_expression_optimizer(self):
+        """测试常量折叠、恒等式化简和公共子表达式消除"""
+        info = expression_engine.explain_expression("log(10) + a * 1 + 0")
+        self.assertEqual(info["optimized"], repr(math.log(10)) + " + a")
+        
+        info = expression_engine.explain_expression("sqrt(a*a + b*b) / sqrt(a*a + b*b) * (pi * 2)")
+        self.assertEqual(info["optimized"].count("sqrt"), 1)
+        self.assertLess(info["operations_after"], info["operations_before"])
+        
+        # 除零等折叠失败的子树保留到运行时
+        self.assertIn("1 / 0", expression_engine.explain_expression("a + 1 / 0")["optimized"])
+        
+        # 条件分支中的子表达式不会被提到分支之外
+        info = expression_engine.explain_expression("a*b if a > 0 else a*b + 1")
+        self.assertNotIn(":=", info["optimized"])
+    
+    def test_optimizer_preserves_results(self):
+        """优化前后的计算结果一致"""
+        expressions = [
+            "sqrt(a*a + b*b) / sqrt(a*a + b*b) * pi * 2",
+            "(a + b) * (a + b) - (a + b) / (c + 1)",
+            "max(a*2, b) + max(a*2, b) * (a*2)",
+            "a*a + a*a if a > b else b*b - b*b",
+            "(a - b) > 0 and (a - b) < 5 or c",
+            "1 < a*2 < a*2 + 1",
+            "-(-a) + 0 * 1 + pow(2, 3) + factorial(5) + a ** 1",
+        ]
+        inputs = [(3.0, 4.0, 5.0), (-2.5, 1.0, 0.0), (0.0, 1.0, 2.0), (7.0, -3.0, -0.5)]
+        for expression in expressions:
+            compiled = expression_engine.compile_expression(expression)
+            reference = compile(compiled.tree, "<reference>", "eval")
+            for a, b, c in inputs:
+                expected = eval(reference, dict(expression_engine.SAFE_FUNCTIONS), {"a": a, "b": b, "c": c})
+                self.assertEqual(compiled.evaluate(a, b, c), expected, msg=expression)
+        
+        # 浮点常量的恒等式保留整数到浮点数的转换
+        for expression in ["a * 1.0", "1.0 * a", "a + 0.0", "a - 0.0", "a / 1", "a ** 1.0"]:
+            result = expression_engine.compile_expression(expression).evaluate(3, 4, 5)
+            self.assertIs(type(result), float, msg=expression)
+        self.assertEqual(expression_engine.explain_expression("a * 1 + 0")["optimized"], "a")
+    
+    def test_evaluation_limits(self):
+        """测试计算量静态检查和运行时限制"""
+        # 常量参数在编译时即被拒绝
+        for expr in ["factorial(99999)", "pow(9, 999999)", "+".join(["a"] * 1500)]:
+            with self.assertRaises(expression_engine.ExpressionBudgetError):
+                expression_engine.compile_expression(expr)
+        
+        # 依赖输入值的运算在计算前被拒绝
+        with self.assertRaises(expression_engine.ExpressionBudgetError):
+            expression_engine.compile_expression("factorial(int(a))").evaluate(99999.0, 0.0, 0.0)
+        with self.assertRaises(expression_engine.ExpressionBudgetError):
+            expression_engine.compile_expression("int(a) ** int(b) ** int(c)").evaluate(9.0, 9.0, 9.0)
+        self.assertEqual(self.node.calculate_expression(99999, 0, 0, "factorial(int(a))"), (0, 0.0))
+
+        # 乘法和lcm同样在计算前检查整数位数，浮点乘法不受影响
+        big = "pow(int(a), 8000)"
+        for expr in [f"{big} * {big} * {big}", f"lcm({big}, {big} + 1, {big} + 3)"]:
+            with self.assertRaises(expression_engine.ExpressionBudgetError):
+                expression_engine.compile_expression(expr).evaluate(3.0, 0.0, 0.0)
+        self.assertIn("_mul", expression_engine.compile_expression("a * b").code.co_names)
+        self.assertNotIn("_mul", expression_engine.compile_expression("sqrt(a) * b * 0.5").code.co_names)
+        self.assertNotIn("_mul", expression_engine.compile_expression("a // 8 * 8").code.co_names)
+
+        # 限制以内的计算不受影响
+        result_int, result_float = self.node.calculate_expression(10, 0, 0, "factorial(int(a))")
+        self.assertEqual(result_int, 3628800)
+        result_int, result_float = self.node.calculate_expression(2, 10, 0, "int(a) ** int(b)")
+        self.assertEqual(result_int, 1024)
+        
+        # 超出时间预算时快速失败
+        limits = expression_engine.get_limits()
+        original_budget = limits.time_budget
+        try:
+            expression_engine.configure_limits(time_budget=-1.0)
+            self.assertEqual(self.node.calculate_expression(5, 0, 0, "factorial(int(a))"), (0, 0.0))
+        finally:
+            expression_engine.configure_limits(time_budget=original_budget)
+
+    def test_clamp_function(self):
+        """测试clamp函数"""
+        self.assertEqual(self.node.calculate_expression(1.5, 0, 0, "clamp(a)"), (1, 1.0))
+        self.assertEqual(self.node.calculate_expression(-3, 0, 0, "clamp(a, -1, 1)"), (-1, -1.0))
+
+    def test_result_memo(self):
+        """测试结果记忆化"""
+        expression_engine.clear_expression_cache()
+        self.node.calculate_expression(12345, 1, 0, "a * b + 7")
+        self.node.calculate_expression(12345, 1, 0, "a * b + 7")
+        # 第二次直接命中结果缓存，不再访问编译缓存
+        self.assertEqual(expression_engine.get_expression_cache_stats()["misses"], 1)
+        self.assertEqual(expression_engine.get_expression_cache_stats()["hits"], 0)
+    
+    def test_result_memo_signed_zero(self):
+        """-0.0 与 0.0 的结果分别缓存，负零不会命中正零的结果"""
+        for node_call in (
+            lambda a: self.node.calculate_expression(a, 0, 0, "atan2(a, -1)"),
+            lambda a: PopoMathProgramNode().run_program(a, 0, 0, "r = atan2(a, -1)")[:2],
+        ):
+            self.assertAlmostEqual(node_call(0.0)[1], math.pi)
+            self.assertAlmostEqual(node_call(-0.0)[1], -math.pi)
+            self.assertAlmostEqual(node_call(0.0)[1], math.pi)
+    
+    def test_result_memo_cleared_with_limits(self):
+        """修改计算量限制后结果缓存被清空，按新限制重新计算"""
+        limits = expression_engine.get_limits()
+        original = limits.max_factorial
+        self.assertEqual(self.node.calculate_expression(5, 0, 0, "factorial(int(a))"), (120, 120.0))
+        try:
+            expression_engine.configure_limits(max_factorial=3)
+            self.assertEqual(self.node.calculate_expression(5, 0, 0, "factorial(int(a))"), (0, 0.0))
+        finally:
+            expression_engine.configure_limits(max_factorial=original)
+        self.assertEqual(self.node.calculate_expression(5, 0, 0, "factorial(int(a))"), (120, 120.0))
+
+    def test_integer_fast_path(self):
+        """可证明保持整数的表达式在整数输入下使用精确的整数运算"""
+        integral = lambda expression: expression_engine.compile_expression(expression).integral
+        for expression in ["a // 8 * 8", "gcd(a, b)", "a ** 2 + b % 3", "max(a, b) if a > 0 else -c",
+                           "ceil(a / 64) * 64", "round(a / b)", "clamp(a, 0, 100)", "a ** abs(b)"]:
+            self.assertTrue(integral(expression), expression)
+        for expression in ["a / 2", "a ** b", "a ** -1", "sqrt(a)", "clamp(a)", "a * pi", "round(a, 1) + 0.5"]:
+            self.assertFalse(integral(expression), expression)
+        
+        # 超过2^53的整数不再因为转换为浮点数而丢失精度
+        big = 2 ** 53 + 1
+        self.assertEqual(self.node.calculate_expression(big, 3, 0, "a * b")[0], big * 3)
+        self.assertEqual(self.node.calculate_expression(1023.0, 0, 0, "a // 8 * 8"), (1016, 1016.0))
+        self.assertEqual(self.node.calculate_expression(12.0, 18.0, 0, "gcd(a, b)"), (6, 6.0))
+        # 非整数输入仍按浮点数计算
+        self.assertEqual(self.node.calculate_expression(1023.5, 0, 0, "a // 8 * 8"), (1016, 1016.0))
+        self.assertEqual(self.node.calculate_expression(2.0, -1.0, 0, "a ** b"), (0, 0.5))
+        # 超出浮点范围的整数结果按无穷处理
+        self.assertEqual(self.node.calculate_expression(1, 0, 0, "a * 10 ** 400"), (999999, 999999.0))
+
+    def test_expression_cache(self):
+        """测试表达式编译缓存"""
+        expression_engine.clear_expression_cache()
+        
+        for value in range(5):
+            result_int, result_float = self.node.calculate_expression(value, 2, 0, "a * b + 1")
+            self.assertEqual(result_float, value * 2 + 1.0)
+        
+        # 同一表达式只编译一次
+        stats = expression_engine.get_expression_cache_stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 4)
+        self.assertIs(
+            expression_engine.compile_expression("a * b + 1"),
+            expression_engine.compile_expression("a * b + 1"),
+        )
+    
+    def test_lru_cache_eviction(self):
+        """测试LRU缓存容量限制"""
+        cache = LRUCache(maxsize=2)
+        cache.put("x", 1)
+        cache.put("y", 2)
+        self.assertEqual(cache.get("x"), 1)  # x变为最近使用
+        cache.put("z", 3)  # 淘汰y
+        
+        self.assertIn("x", cache)
+        self.assertNotIn("y", cache)
+        self.assertIn("z", cache)
+        
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertIn("z", cache)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+
+@unittest.skipUnless(HAS_NUMPY, "需要安装numpy")
+class TestPopoMathProgramNode(unittest.TestCase):
+    """多行数学程序节点测试类"""
+    
+    def setUp(self):
+        self.node = PopoMathProgramNode()
+    
+    def test_shared_intermediates(self):
+        """后面的行引用前面的结果，默认按赋值顺序输出"""
+        program = "w = a // 8 * 8\nh = b // 8 * 8; long = max(w, h)\nscale = c / long"
+        result = self.node.run_program(1023.0, 515.0, 1024.0, program)
+        self.assertEqual(len(result), 8)
+        self.assertEqual(result[:6], (1016, 1016.0, 512, 512.0, 1016, 1016.0))
+        self.assertAlmostEqual(result[7], 1024 / 1016)
+    
+    def test_selected_outputs(self):
+        """outputs选择输出的名称和顺序，多余的输出槽为0"""
+        program = "w = a * 2\nh = b * 2\narea = w * h"
+        result = self.node.run_program(3.0, 4.0, 0.0, program, outputs="area, w")
+        self.assertEqual(result, (48, 48.0, 6, 6.0, 0, 0.0, 0, 0.0))
+    
+    def test_invalid_programs(self):
+        """不支持的语句、覆盖输入变量和未知的输出名称返回默认值"""
+        empty = (0, 0.0) * 4
+        for program in ["a = 1", "x = __import__('os')", "x == 1", "x = 1\nx = 2", "x = 1; y = x +"]:
+            self.assertEqual(self.node.run_program(1.0, 2.0, 3.0, program), empty, program)
+        self.assertEqual(self.node.run_program(1.0, 2.0, 3.0, "x = a", outputs="y"), empty)
+        
+        with self.assertRaises(expression_engine.ExpressionError) as context:
+            expression_engine.compile_program("x = a\ny = foo(x)")
+        self.assertIn("第2行", str(context.exception))
+
+    def test_statement_limits(self):
+        """每条语句之后检查时间预算，逐行平方的大整数在超出位数限制时失败"""
+        squares = "\n".join(f"y{i + 1} = y{i} * y{i}" for i in range(18))
+        with self.assertRaises(expression_engine.ExpressionBudgetError):
+            expression_engine.compile_program(f"y0 = pow(int(a), 8000)\n{squares}").evaluate(3.0, 0.0, 0.0)
+
+        compiled = expression_engine.compile_program("x = a + 1\ny = x - b")
+        limits = expression_engine.get_limits()
+        original_budget = limits.time_budget
+        try:
+            expression_engine.configure_limits(time_budget=-1.0)
+            with self.assertRaises(expression_engine.ExpressionBudgetError):
+                compiled.evaluate(1.0, 2.0, 3.0)
+        finally:
+            expression_engine.configure_limits(time_budget=original_budget)
+        self.assertEqual(compiled.evaluate(1.0, 2.0, 3.0), {"x": 2.0, "y": 0.0})
+
+
+class TestPopoMathExpressionBatchNode(unittest.TestCase):
+    """批量数学表达式节点测试类"""
+    
+    def setUp(self):
+        self.node = PopoMathExpressionBatchNode()
+    
+    def test_matches_scalar_node(self):
+        """批量结果与逐个标量计算一致"""
+        scalar_node = PopoMathExpressionNode()
+        a_values = [0.5, 1.0, 2.5, 4.0, 9.0]
+        expressions = [
+            "sqrt(a) * 2 + b",
+            "max(a, b, c) - min(a, c)",
+            "a if a > b else b * 2",
+            "floor(a / 2) + ceil(b) + round(a, 1)",
+            "log(a, 2) + atan2(a, b) + degrees(pi / 4)",
+            "1 < a < 3 and b > 0",
+        ]
+        for expression in expressions:
+            batch_int, batch_float = self.node.calculate_batch(a_values, [1.5], [3.0], [expression])
+            for i, a in enumerate(a_values):
+                expected_int, expected_float = scalar_node.calculate_expression(a, 1.5, 3.0, expression)
+                self.assertAlmostEqual(batch_float[i], expected_float, places=9, msg=expression)
+                self.assertEqual(batch_int[i], expected_int, msg=expression)
+    
+    def test_special_values(self):
+        """NaN和无穷值按标量节点的规则替换"""
+        result_int, result_float = self.node.calculate_batch([1.0, -1.0, 0.0], [0.0], [0.0], ["a / b"])
+        self.assertEqual(result_float, [999999.0, -999999.0, 0.0])
+        self.assertEqual(result_int, [999999, -999999, 0])
+    
+    def test_length_mismatch(self):
+        """长度不一致且无法广播时返回默认值"""
+        result = self.node.calculate_batch([1.0, 2.0], [1.0, 2.0, 3.0], [0.0], ["a + b"])
+        self.assertEqual(result, ([0], [0.0]))
+    
+    def test_large_integer_power(self):
+        """优化器未折叠的大整数幂在向量路径上同样按位数限制立即拒绝"""
+        import time
+        from nodes.expression_vector import evaluate_vectorized
+        
+        start = time.perf_counter()
+        with self.assertRaises(expression_engine.ExpressionBudgetError):
+            evaluate_vectorized("a + 9**9**9", ([1.0], [1.0], [1.0]))
+        with self.assertRaises(expression_engine.ExpressionBudgetError):
+            evaluate_vectorized("a + pow(9, 9**9)", ([1.0], [1.0], [1.0]))
+        self.assertEqual(self.node.calculate_batch([1.0], [1.0], [1.0], ["a + (2**16000)**16000"]), ([0], [0.0]))
+        if HAS_TORCH:
+            import torch
+            with self.assertRaises(expression_engine.ExpressionBudgetError):
+                evaluate_vectorized("a + 9**9**9", (torch.ones(2), [1.0], [1.0]))
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(self.node.calculate_batch([1.0], [1.0], [1.0], ["a + 2**3 + pow(2, 4)"]), ([25], [25.0]))
+    
+    def test_blocked_evaluation(self):
+        """分块并行计算与整体计算一致，寄存器在指令之间复用"""
+        import numpy as np
+        from nodes.expression_blocks import compile_block_program, evaluate_blocked
+        from nodes.expression_vector import compile_vector_expression, get_namespace
+        
+        rng = np.random.default_rng(0)
+        a, b, c = rng.random(10001), rng.random(10001), np.array([0.5])
+        namespace = get_namespace("numpy")
+        expressions = [
+            "sqrt(a*a + b*b) / sqrt(a*a + b*b) + c",
+            "a if a > b else b * c",
+            "round(a, 2) + max(a, b, c) + log(b + 1, 2)",
+            "0 < a < 0.5 and not b > 0.3",
+            "a % 0.3 // 0.1 + a ** 2 - a",
+            "gcd(int(a * 100), 6)",
+            "a",
+        ]
+        for expression in expressions:
+            compiled = compile_vector_expression(expression)
+            with np.errstate(all="ignore"):
+                expected = np.broadcast_to(compiled.evaluate(namespace, a, b, c), a.shape)
+            program = compile_block_program(("test", expression), compiled.tree, namespace, compiled.variables)
+            self.assertLessEqual(program.registers, 3, expression)
+            result = evaluate_blocked(program, [a, b, c], len(a), block=999, threads=4)
+            self.assertTrue(np.allclose(result, expected, equal_nan=True), expression)
+    
+    @unittest.skipUnless(HAS_TORCH, "需要安装torch")
+    def test_tensor_inputs(self):
+        """一维张量输入使用torch后端计算"""
+        import torch
+        a = torch.linspace(0, 1, 5)
+        result_int, result_float = self.node.calculate_batch([a], [2.0], [0.0], ["sin(a) * b + gcd(4, 6)"])
+        expected = [math.sin(float(x)) * 2 + 2 for x in a]
+        for actual, wanted in zip(result_float, expected):
+            self.assertAlmostEqual(actual, wanted, places=5)
+        self.assertEqual(len(result_int), 5)
+
+
+@unittest.skipUnless(HAS_NUMPY, "需要安装numpy")
+class TestPopoSweepNode(unittest.TestCase):
+    """参数扫描节点测试类"""
+    
+    def setUp(self):
+        self.node = PopoSweepNode()
+    
+    def test_step_and_count(self):
+        """按步长扫描时包含stop，按数量扫描时均匀取值"""
+        values, values_int, count = self.node.generate_sweep(0.0, 1.0, 0.1, 0, "x")
+        self.assertEqual(count, 11)
+        self.assertAlmostEqual(values[-1], 1.0)
+        
+        values, values_int, count = self.node.generate_sweep(4.0, 8.0, 0.0, 5, "0.3 + 0.05 * i")
+        self.assertEqual(count, 5)
+        for actual, wanted in zip(values, [0.3, 0.35, 0.4, 0.45, 0.5]):
+            self.assertAlmostEqual(actual, wanted)
+        
+        values, values_int, count = self.node.generate_sweep(4.0, 8.0, 0.0, 5, "x")
+        self.assertEqual(values_int, [4, 5, 6, 7, 8])
+        self.assertEqual(values[1:3], [5.0, 6.0])
+    
+    def test_lazy_chunks(self):
+        """大范围扫描只计算被访问的分块"""
+        from nodes.expression_sweep import make_sweep
+        sweep = make_sweep("i * 2 + n", 0.0, 0.0, 1.0, 10_000_000, chunk_size=1000)
+        self.assertEqual(len(sweep.float_values), 10_000_000)
+        self.assertEqual(sweep.float_values[-1], 2 * 9_999_999 + 10_000_000)
+        self.assertEqual(sweep.int_values[1234], 2468 + 10_000_000)
+        self.assertEqual(len(sweep._chunks), 2)
+    
+    def test_chunk_failure(self):
+        """分块计算失败时抛出异常，节点输出默认值而不是用0填充"""
+        from unittest.mock import patch
+        from nodes import expression_sweep
+        real = expression_sweep.evaluate_vectorized
+        
+        def fail_second_chunk(expression, values, variables):
+            if values[0][0] >= 4:
+                raise ValueError("chunk failed")
+            return real(expression, values, variables)
+        
+        sweep = expression_sweep.make_sweep("i", 0.0, 0.0, 1.0, 8, chunk_size=4)
+        with patch.object(expression_sweep, "evaluate_vectorized", fail_second_chunk):
+            self.assertEqual(sweep.int_values[3], 3)
+            with self.assertRaises(ValueError):
+                sweep.int_values[5]
+            with self.assertRaises(ValueError):
+                sweep.to_lists()
+            self.assertEqual(self.node.generate_sweep(0.0, 9999.0, 1.0, 0, "x"), ([0.0], [0], 1))
+    
+    def test_invalid_parameters(self):
+        """无效的范围或表达式返回默认值"""
+        self.assertEqual(self.node.generate_sweep(0.0, 1.0, 0.0, 0, "x"), ([0.0], [0], 1))
+        self.assertEqual(self.node.generate_sweep(0.0, 1.0, -0.1, 0, "x"), ([0.0], [0], 1))
+        self.assertEqual(self.node.generate_sweep(0.0, 1.0, 0.1, 0, "x + a"), ([0.0], [0], 1))
+
+
+@unittest.skipUnless(HAS_TORCH, "需要安装torch")
+class TestPopoImageExpressionNode(unittest.TestCase):
+    """逐像素图片表达式节点测试类"""
+    
+    def setUp(self):
+        self.node = PopoImageExpressionNode()
+    
+    def test_levels_expression(self):
+        """默认表达式等价于逐像素的线性调整加截断"""
+        import torch
+        image = torch.rand(2, 16, 12, 3)
+        (result,) = self.node.apply_expression(image, "clamp(a * 1.2 - 0.1)")
+        self.assertEqual(tuple(result.shape), (2, 16, 12, 3))
+        self.assertTrue(torch.allclose(result, (image * 1.2 - 0.1).clamp(0, 1)))
+    
+    def test_chunked_broadcast(self):
+        """分块计算与整体计算一致，单张图片和单通道输入会被广播"""
+        import torch
+        from nodes.expression_vector import evaluate_image_expression
+        a = torch.rand(3, 9, 7, 3)
+        b = torch.rand(1, 9, 7, 1)
+        expected = torch.where(a > b, a - b, b * 0.5)
+        
+        for chunk_elements in (1, 21, 10 ** 6):
+            result = evaluate_image_expression("a - b if a > b else b * c", (a, b, 0.5), chunk_elements=chunk_elements)
+            self.assertTrue(torch.allclose(result, expected, atol=1e-6), chunk_elements)
+    
+    def test_scalar_inputs_and_errors(self):
+        """未连接的图片输入使用数值，非法表达式返回原图"""
+        import torch
+        image = torch.rand(1, 4, 4, 3)
+        (result,) = self.node.apply_expression(image, "a * b_value_unused", b_value=2.0)
+        self.assertIs(result, image)
+        (result,) = self.node.apply_expression(image, "a * b + c", b_value=2.0, c_value=0.25)
+        self.assertTrue(torch.allclose(result, image * 2.0 + 0.25))
+    
+    def test_special_values(self):
+        """NaN、正负无穷和超出范围的值按标量节点的规则替换"""
+        import torch
+        from nodes.expression_vector import evaluate_image_expression
+        image = torch.tensor([[[[0.0], [1.0], [-1.0]]]])
+        expected = [0.0, 999999.0, -999999.0]
+        self.assertEqual(evaluate_image_expression("a / b", (image, 0.0, 0.0)).flatten().tolist(), expected)
+        self.assertEqual(evaluate_image_expression("a * 1e30", (image, 0.0, 0.0)).flatten().tolist(), expected)
+
+
+@unittest.skipUnless(HAS_TORCH, "需要torch")
+class TestTensorDimensionNodes(unittest.TestCase):
+    """LATENT / MASK / 视频尺寸节点测试，使用meta设备张量确保不访问数据"""
+    
+    def test_latent_dimensions(self):
+        import torch
+        latent = {"samples": torch.empty(2, 4, 128, 96, device="meta")}
+        node = PopoLatentDimensionsNode()
+        self.assertEqual(node.get_latent_dimensions(latent), (768, 1024, 96, 128, 2, 1))
+        self.assertEqual(node.get_latent_dimensions(latent, scale=16)[:2], (1536, 2048))
+        
+        video_latent = {"samples": torch.empty(1, 16, 21, 60, 104, device="meta")}
+        self.assertEqual(node.get_latent_dimensions(video_latent), (832, 480, 104, 60, 1, 21))
+        self.assertEqual(node.get_latent_dimensions({"samples": torch.empty(3, device="meta")}), (0,) * 6)
+    
+    def test_mask_dimensions(self):
+        import torch
+        node = PopoMaskDimensionsNode()
+        self.assertEqual(node.get_mask_dimensions(torch.empty(3, 480, 640, device="meta")), (640, 480, 3))
+        self.assertEqual(node.get_mask_dimensions(torch.empty(480, 640, device="meta")), (640, 480, 1))
+        self.assertEqual(node.get_mask_dimensions(torch.empty(2, 1, 480, 640, device="meta")), (640, 480, 2))
+    
+    def test_video_dimensions(self):
+        import torch
+        node = PopoVideoDimensionsNode()
+        self.assertEqual(node.get_video_dimensions(torch.empty(2, 49, 480, 832, 3, device="meta")), (832, 480, 49, 2))
+        self.assertEqual(node.get_video_dimensions(torch.empty(81, 480, 832, 3, device="meta")), (832, 480, 81, 1))
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "需要支持fork的系统")
+class TestExpressionSandbox(unittest.TestCase):
+    """隔离进程计算测试"""
+    
+    def setUp(self):
+        from nodes.expression_sandbox import SandboxPool
+        self.pool = SandboxPool(workers=2)
+    
+    def tearDown(self):
+        self.pool.close()
+    
+    def test_batched_results(self):
+        """批量请求分配给多个工作进程，结果顺序与请求一致，失败的位置为异常对象"""
+        requests = [("a * b + c", (i, 2, 3)) for i in range(100)]
+        requests.append(("factorial(a)", (5000, 0, 0)))
+        requests.append(("a / b", (1.0, 0.0, 0.0)))
+        results = self.pool.evaluate_many(requests)
+        self.assertEqual(results[:100], [i * 2 + 3 for i in range(100)])
+        self.assertIsInstance(results[100], expression_engine.ExpressionBudgetError)
+        self.assertIsInstance(results[101], expression_engine.ExpressionError)
+        self.assertEqual(self.pool.evaluate("sqrt(a)", (16.0, 0.0, 0.0)), 4.0)
+    
+    def test_recycle_crashed_and_timed_out_workers(self):
+        """异常退出或超时的工作进程被替换，进程池继续可用"""
+        import signal
+        from nodes.expression_sandbox import SandboxError
+        for pid in self.pool.pids():
+            os.kill(pid, signal.SIGKILL)
+        for worker in self.pool._workers:
+            worker.process.join(timeout=5)
+        self.assertEqual(self.pool.evaluate("a + 1", (1, 0, 0)), 2)
+        self.assertGreaterEqual(self.pool.recycled, 1)
+        
+        # 暂停工作进程模拟失控的计算
+        from nodes.expression_sandbox import SandboxPool
+        pool = SandboxPool(workers=1, timeout=0.2)
+        try:
+            (pid,) = pool.pids()
+            os.kill(pid, signal.SIGSTOP)
+            with self.assertRaises(SandboxError):
+                pool.evaluate("a + 1", (1, 0, 0))
+            self.assertEqual(pool.evaluate("a + 1", (1, 0, 0)), 2)
+            self.assertNotEqual(pool.pids(), [pid])
+        finally:
+            pool.close()
+    
+    def test_workers_returned_after_unexpected_errors(self):
+        """意外的异常不会让工作进程流失，没有空闲进程时等待有时间上限"""
+        from nodes.expression_sandbox import SandboxError, SandboxPool
+        with self.assertRaises(Exception):
+            self.pool.evaluate_many([("a + 1", (lambda: 0, 0, 0)), ("a + 2", (1, 0, 0))])
+        self.assertEqual(self.pool._idle.qsize(), 2)
+        self.assertEqual(self.pool.evaluate("a + 1", (1, 0, 0)), 2)
+        
+        pool = SandboxPool(workers=1, acquire_timeout=0.1)
+        try:
+            worker = pool._acquire(1)[0]
+            with self.assertRaises(SandboxError):
+                pool.evaluate("a + 1", (1, 0, 0))
+            pool._release(worker)
+            self.assertEqual(pool.evaluate("a + 1", (1, 0, 0)), 2)
+        finally:
+            pool.close()
+    
+    @unittest.skipUnless(hasattr(os, "fork") and sys.platform != "darwin", "需要支持forkserver的系统")
+    def test_forkserver_start_method(self):
+        """从多线程进程中启动时使用的forkserver方式同样可用"""
+        from nodes.expression_sandbox import SandboxPool
+        pool = SandboxPool(workers=1, start_method="forkserver")
+        try:
+            self.assertEqual(pool.evaluate("a * b", (6, 7, 0)), 42)
+        finally:
+            pool.close()
+    
+    @unittest.skipUnless(hasattr(os, "fork") and sys.platform != "darwin", "需要支持forkserver的系统")
+    def test_hyphenated_package_name(self):
+        """ComfyUI按目录名（不能导入的包名）加载时，forkserver/spawn 启动的工作进程同样可用"""
+        import importlib.util
+        package = "comfyui-popo-utility"
+        directory = os.path.dirname(os.path.abspath(__file__))
+        spec = importlib.util.spec_from_file_location(
+            package, os.path.join(directory, "__init__.py"), submodule_search_locations=[directory]
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[package] = module
+        try:
+            spec.loader.exec_module(module)
+            sandbox = sys.modules[f"{package}.nodes.expression_sandbox"]
+            node = module.NODE_CLASS_MAPPINGS["PopoMathExpressionNode"]()
+            for start_method in ("forkserver", "spawn"):
+                sandbox._pool = sandbox.SandboxPool(workers=1, start_method=start_method)
+                try:
+                    self.assertEqual(node.calculate_expression(6, 7, 1, "a * b + c", sandbox=True), (43, 43.0))
+                finally:
+                    sandbox.shutdown_sandbox_pool()
+        finally:
+            for name in [name for name in sys.modules if name.startswith(package)]:
+                del sys.modules[name]
+    
+    def test_node_sandbox_mode(self):
+        """节点在隔离模式下的结果与本进程计算一致"""
+        node = PopoMathExpressionNode()
+        import nodes_direct
+        original = nodes_direct.get_sandbox_pool
+        nodes_direct.get_sandbox_pool = lambda: self.pool
+        try:
+            self.assertEqual(node.calculate_expression(7919, 13, 0, "a % b * 3 + 1", sandbox=True), (7, 7.0))
+            self.assertEqual(node.calculate_expression(1, 2, 3, "().__class__", sandbox=True), (0, 0.0))
+        finally:
+            nodes_direct.get_sandbox_pool = original
+
+
+class TestExpressionProfiler(unittest.TestCase):
+    """表达式性能统计测试"""
+    
+    def test_counters_and_percentiles(self):
+        """记录调用次数、缓存命中、失败和耗时分位数"""
+        import json
+        import tempfile
+        from nodes.expression_profiler import ExpressionProfiler
+        profiler = ExpressionProfiler(max_expressions=2)
+        for elapsed in range(1, 101):
+            profiler.record("node", "a + b", elapsed * 1000)
+        profiler.record_hit("node", "a + b")
+        with self.assertRaises(ZeroDivisionError):
+            with profiler.measure("node", "a / b"):
+                1 / 0
+        
+        (row,) = profiler.stats("a + b")
+        self.assertEqual((row["calls"], row["cache_hits"], row["failures"]), (101, 1, 0))
+        self.assertEqual(row["p99_us"], 99.0)
+        self.assertEqual(row["max_us"], 100.0)
+        self.assertAlmostEqual(row["mean_us"], 50.5)
+        (failed,) = profiler.stats("a / b")
+        self.assertEqual(failed["failures"], 1)
+        self.assertIn("ZeroDivisionError", failed["last_error"])
+        
+        # 超出容量时淘汰最久未调用的表达式
+        profiler.record("node", "c", 1)
+        self.assertEqual(sorted(row["expression"] for row in profiler.stats()), ["a / b", "c"])
+        self.assertEqual(profiler.stats("a + b"), [])
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile.json")
+            profiler.dump(path)
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(len(json.load(f)["expressions"]), 2)
+        profiler.reset()
+        self.assertEqual(profiler.stats(), [])
+    
+    def test_sampled_timing(self):
+        """每 sample_every 次计算计时一次，其余调用只计数，失败总是记录"""
+        from nodes.expression_profiler import ExpressionProfiler
+        profiler = ExpressionProfiler(sample_every=4)
+        for _ in range(8):
+            with profiler.measure("node", "a"):
+                pass
+        for _ in range(3):
+            profiler.record_hit("node", "a")
+        with self.assertRaises(ValueError):
+            with profiler.measure("node", "a"):
+                raise ValueError("bad")
+        
+        (row,) = profiler.stats("a")
+        self.assertEqual((row["calls"], row["cache_hits"], row["failures"]), (12, 3, 1))
+        self.assertEqual(profiler._nodes["node"]["a"].timed, 3)
+        self.assertIn("ValueError", row["last_error"])
+        
+        disabled = ExpressionProfiler(enabled=False)
+        with disabled.measure("node", "a"):
+            disabled.record_hit("node", "a")
+        self.assertEqual(disabled.stats(), [])
+    
+    def test_node_records_stats(self):
+        """数学表达式节点记录实际计算、结果缓存命中和失败"""
+        from nodes.expression_profiler import get_expression_stats
+        node = PopoMathExpressionNode()
+        expression = "a * 3 + b * 0 + 17"
+        node.calculate_expression(1, 2, 0, expression)
+        node.calculate_expression(1, 2, 0, expression)
+        node.calculate_expression(1, 0, 0, "a % b + 17")
+        (row,) = get_expression_stats(expression, node="PopoMathExpressionNode")
+        self.assertEqual((row["calls"], row["cache_hits"], row["failures"]), (2, 1, 0))
+        (row,) = get_expression_stats("a % b + 17")
+        self.assertEqual(row["failures"], 1)
+
+
+class TestBenchmarkBaseline(unittest.TestCase):
+    """性能基准的回归判断测试"""
+    
+    def test_compare_results(self):
+        """超过阈值的指标被报告，未知表达式和缺失指标被忽略"""
+        from benchmark_math_node import compare_results
+        baseline = {
+            "thresholds": {"default": 0.3, "memo_ns": 0.5},
+            "results": {"sum": {"cold_ns": 1000, "warm_ns": 100, "memo_ns": 10, "peak_bytes": 0}},
+        }
+        results = {
+            "sum": {"cold_ns": 1200, "warm_ns": 140, "memo_ns": 14, "peak_bytes": 512},
+            "new": {"cold_ns": 1, "warm_ns": 1, "memo_ns": 1, "peak_bytes": 1},
+        }
+        regressions = compare_results(results, baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("sum.warm_ns"))
+        
+        # 命令行阈值覆盖基准文件中的配置
+        self.assertEqual(compare_results(results, baseline, threshold=0.5), [])
+        self.assertEqual(len(compare_results(results, baseline, threshold=0.1)), 3)
+
 
 if __name__ == "__main__":
     # 运行测试
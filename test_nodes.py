@@ -130,6 +130,430 @@ def test_image_nodes():
         print(f"❌ 图片处理节点测试失败: {e}")
         return False
 
+def test_shape_memo():
+    """测试尺寸类节点的形状记忆化"""
+    print("\n🧪 测试形状记忆化...")
+    
+    try:
+        from nodes.image_utils import ImageDimensionsNode
+        
+        small = MockTensor((1, 1080, 1920, 3))
+        same_shape = MockTensor((1, 1080, 1920, 3))
+        other = MockTensor((1, 1920, 1080, 3))
+        
+        # 相同形状命中记忆化结果，不同形状重新计算
+        dims_node = ImageDimensionsNode()
+        assert dims_node.get_dimensions(small) == (1920, 1080, 1920, 1080)
+        assert dims_node.get_dimensions(same_shape) == (1920, 1080, 1920, 1080)
+        assert dims_node.get_dimensions(other) == (1080, 1920, 1920, 1080)
+        
+        print("✅ 形状记忆化测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 形状记忆化测试失败: {e}")
+        return False
+
+def test_image_dimensions_list():
+    """测试列表尺寸节点"""
+    print("\n🧪 测试列表尺寸节点...")
+    
+    try:
+        from nodes.image_utils import ImageDimensionsListNode
+        
+        node = ImageDimensionsListNode()
+        images = [MockTensor((2, 1080, 1920, 3)), MockTensor((512, 768, 3)), MockTensor((1, 64, 64, 3))]
+        
+        # 批次展开：第一个张量占两项
+        width, height, long_side, short_side, count = node.get_dimensions_list(images, [True])
+        assert width == [1920, 1920, 768, 64]
+        assert height == [1080, 1080, 512, 64]
+        assert long_side == [1920, 1920, 768, 64]
+        assert short_side == [1080, 1080, 512, 64]
+        assert count == 4
+        
+        # 不展开批次时每个张量一项
+        width, height, _, _, count = node.get_dimensions_list(images, [False])
+        assert width == [1920, 768, 64] and height == [1080, 512, 64] and count == 3
+        
+        print("✅ 列表尺寸节点测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 列表尺寸节点测试失败: {e}")
+        return False
+
+def test_aspect_buckets():
+    """测试宽高比分桶"""
+    print("\n🧪 测试宽高比分桶...")
+    
+    try:
+        from nodes.aspect_buckets import AspectBucketNode, BucketTable, generate_area_buckets, get_bucket_table
+        
+        table = get_bucket_table("sdxl")
+        assert table.assign(1920, 1080) == (5, 1344, 768, 1365, 768, 10, 0)
+        assert table.assign(1000, 1000)[:3] == (0, 1024, 1024)
+        assert table.assign(1080, 1920)[1:3] == (768, 1344)
+        assert get_bucket_table("sdxl") is table
+        
+        # 面积桶横竖对称，面积不超过目标
+        buckets = generate_area_buckets(1024 * 1024, 64)
+        assert all((height, width) in buckets for width, height in buckets)
+        assert all(width * height <= 1024 * 1024 and width % 64 == 0 for width, height in buckets)
+        
+        # 批量分配与逐个分配结果一致
+        custom = BucketTable([(512, 512), (768, 512), (512, 768)])
+        sizes = [(100 + i * 37 % 900, 100 + i * 53 % 900) for i in range(500)]
+        assert custom.assign_many(sizes) == [custom.assign(width, height) for width, height in sizes]
+        
+        # 节点接收图片列表（批次展开）或宽高列表
+        node = AspectBucketNode()
+        result = node.assign_buckets(["sdxl"], [64], [""], image=[MockTensor((2, 1080, 1920, 3))])
+        assert result[0] == [5, 5] and result[5] == [10, 10]
+        result = node.assign_buckets(["custom"], [64], ["512x512, 768x512"], widths=[800, 500], heights=[500, 510])
+        assert result[0] == [1, 0]
+        
+        print("✅ 宽高比分桶测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 宽高比分桶测试失败: {e}")
+        return False
+
+def test_resolution_planner():
+    """测试分辨率规划"""
+    print("\n🧪 测试分辨率规划...")
+    
+    try:
+        from nodes.resolution_planner import ResolutionPlannerNode, plan_resolutions
+        
+        plan = plan_resolutions([(1920, 1080), (333, 777)], 1024, multiple=64)
+        assert (plan.width, plan.height) == ([1024, 448], [576, 1024])
+        assert plan.pad_width == [0, 9] and plan.resize_width == [1024, 439]
+        
+        # 按短边缩放、只缩小不放大
+        assert plan_resolutions([(1920, 1080)], 512, side="short").width == [912]
+        assert plan_resolutions([(500, 300)], 1024, upscale=False).scale == [1.0]
+        
+        # 像素上限：对齐后仍不超过上限
+        plan = plan_resolutions([(1920, 1080), (5000, 100)], 1024, multiple=64, max_pixels=500000, snap="ceil")
+        assert all(w * h <= 500000 and w % 64 == 0 and h % 64 == 0 for w, h in zip(plan.width, plan.height))
+        
+        node = ResolutionPlannerNode()
+        result = node.plan([1024], ["long"], [8], [0], ["round"], [True], image=[MockTensor((3, 768, 512, 3))])
+        assert result[0] == [680] * 3 and result[1] == [1024] * 3
+        
+        print("✅ 分辨率规划测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 分辨率规划测试失败: {e}")
+        return False
+
+def test_ratio_names():
+    """测试宽高比命名"""
+    print("\n🧪 测试宽高比命名...")
+    
+    try:
+        from nodes.aspect_ratio import describe_ratio, simplest_between
+        from nodes.image_utils import identify_common_ratio
+        from fractions import Fraction
+        
+        # 相近的常见比例不会混淆
+        assert describe_ratio(1920, 1200).text == "16:10"
+        assert describe_ratio(1500, 1000).text == "3:2"
+        assert describe_ratio(1920, 1088).text == "16:9"
+        assert describe_ratio(2560, 1097).text == "21:9"
+        
+        # 任意比例：精确的简单比例、误差内的最简分数、小数
+        assert describe_ratio(1400, 1000).text == "7:5"
+        assert describe_ratio(1, 1000).text == "1:1000"
+        assert describe_ratio(1520, 1000).text == "1.52:1"
+        assert describe_ratio(1520, 1000, max_denominator=25).text == "38:25"
+        assert describe_ratio(1000, 1520).text == "1:1.52"
+        assert simplest_between(Fraction(31, 10), Fraction(32, 10)) == Fraction(16, 5)
+        
+        # 同一约分比例共用缓存条目
+        assert describe_ratio(3840, 2160) is describe_ratio(1920, 1080)
+        
+        assert identify_common_ratio(1080, 1920) == "9:16 (竖屏宽屏)"
+        assert identify_common_ratio(1400, 1000) == "7:5 (横屏)"
+        
+        print("✅ 宽高比命名测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 宽高比命名测试失败: {e}")
+        return False
+
+def test_tensor_dimensions():
+    """测试LATENT / MASK / 视频尺寸节点"""
+    print("\n🧪 测试张量尺寸节点...")
+    
+    try:
+        from nodes.tensor_dimensions import LatentDimensionsNode, MaskDimensionsNode, VideoDimensionsNode
+        
+        latent = {"samples": MockTensor((1, 4, 64, 80))}
+        assert LatentDimensionsNode().get_latent_dimensions(latent) == (640, 512, 80, 64, 1, 1)
+        assert MaskDimensionsNode().get_mask_dimensions(MockTensor((2, 100, 200))) == (200, 100, 2)
+        assert VideoDimensionsNode().get_video_dimensions(MockTensor((16, 720, 1280, 3))) == (1280, 720, 16, 1)
+        
+        print("✅ 张量尺寸节点测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 张量尺寸节点测试失败: {e}")
+        return False
+
+def test_is_changed_widget_inputs():
+    """IS_CHANGED只能依赖控件输入：ComfyUI调用时不传入连线输入（IMAGE、LATENT等）"""
+    print("\n🧪 测试IS_CHANGED参数...")
+    
+    try:
+        import inspect
+        from nodes import auto_register_nodes
+        from nodes_direct import NODE_CLASS_MAPPINGS
+        
+        node_classes, _ = auto_register_nodes()
+        widget_types = ("INT", "FLOAT", "STRING", "BOOLEAN")
+        for name, node_class in list(NODE_CLASS_MAPPINGS.items()) + list(node_classes.items()):
+            if not hasattr(node_class, "IS_CHANGED"):
+                continue
+            inputs = node_class.INPUT_TYPES()
+            specs = {**inputs.get("required", {}), **inputs.get("optional", {})}
+            parameters = inspect.signature(node_class.IS_CHANGED).parameters.values()
+            for parameter in parameters:
+                if parameter.kind in (parameter.VAR_KEYWORD, parameter.VAR_POSITIONAL):
+                    continue
+                spec = specs.get(parameter.name)
+                assert spec is not None, f"{name}.IS_CHANGED 的参数 {parameter.name} 不是节点输入"
+                options = spec[1] if len(spec) > 1 else {}
+                is_widget = isinstance(spec[0], list) or (spec[0] in widget_types and not options.get("forceInput"))
+                assert is_widget, f"{name}.IS_CHANGED 依赖连线输入 {parameter.name}"
+        
+        print("✅ IS_CHANGED参数测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ IS_CHANGED参数测试失败: {e}")
+        return False
+
+def test_image_statistics():
+    """测试图片通道统计节点"""
+    print("\n🧪 测试图片通道统计...")
+    
+    try:
+        import json
+        import torch
+        from nodes.image_statistics import ImageStatisticsNode
+        from nodes_direct import PopoImageStatisticsNode
+        
+        torch.manual_seed(0)
+        image = torch.rand(3, 97, 61, 3)
+        node = ImageStatisticsNode()
+        # 很小的预算迫使每块只有几行
+        result = node.compute_statistics(image, 1.0, 99.0, chunk_megabytes=0.01)
+        stats_json, mean, std, low, high, p_low, p_high = result
+        stats = json.loads(stats_json)
+        assert len(stats) == 3 and len(mean) == 3
+        for b, item in enumerate(stats):
+            pixels = image[b].reshape(-1, 3).double()
+            np.testing.assert_allclose(item["mean"], pixels.mean(0).numpy(), rtol=1e-9)
+            np.testing.assert_allclose(item["std"], pixels.std(0, unbiased=False).numpy(), rtol=1e-6)
+            np.testing.assert_allclose(item["min"], pixels.amin(0).numpy())
+            np.testing.assert_allclose(item["max"], pixels.amax(0).numpy())
+            for c in range(3):
+                expected, _ = np.histogram(image[b, ..., c].numpy(), bins=256, range=(0, 1))
+                assert item["histogram"][c] == expected.tolist()
+            # 分位数误差不超过一个直方图区间
+            median = np.percentile(pixels.numpy(), 50, axis=0)
+            np.testing.assert_allclose(item["percentiles"]["50.0"], median, atol=1 / 256)
+            assert abs(mean[b] - pixels.mean().item()) < 1e-9
+            assert abs(std[b] - pixels.std(unbiased=False).item()) < 1e-6
+            assert abs(p_high[b] - np.percentile(pixels.numpy(), 99)) <= 1 / 256
+        assert PopoImageStatisticsNode().compute_statistics(image, 1.0, 99.0, chunk_megabytes=0.01) == result
+        
+        # 分块大小不影响结果
+        image = torch.linspace(0, 1, 2 * 50 * 40 * 4).reshape(2, 50, 40, 4)
+        small = json.loads(node.compute_statistics(image, 5.0, 95.0, chunk_megabytes=0.001)[0])
+        large = json.loads(node.compute_statistics(image, 5.0, 95.0)[0])
+        assert small[1]["histogram"] == large[1]["histogram"] and small[1]["min"] == large[1]["min"]
+        assert all(abs(a - b) < 1e-9 for a, b in zip(small[1]["mean"], large[1]["mean"]))
+        
+        # 超出0-1的值计入两端的区间，无效输入输出空结果
+        stats = json.loads(node.compute_statistics(torch.tensor([[[[-0.5], [2.0]]]]), 1.0, 99.0)[0])
+        assert stats[0]["min"] == [-0.5] and stats[0]["max"] == [2.0]
+        assert stats[0]["histogram"][0][0] == 1 and stats[0]["histogram"][0][255] == 1
+        assert node.compute_statistics(torch.zeros(5), 1.0, 99.0)[0] == "[]"
+        
+        print("✅ 图片通道统计测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 图片通道统计测试失败: {e}")
+        return False
+
+def test_image_fingerprint():
+    """测试图片内容指纹节点"""
+    print("\n🧪 测试图片内容指纹...")
+    
+    try:
+        import torch
+        from nodes.cache_utils import content_fingerprint
+        from nodes.image_fingerprint import ImageFingerprintNode
+        from nodes_direct import PopoImageFingerprintNode
+        
+        torch.manual_seed(0)
+        images = torch.rand(4, 130, 170, 3)
+        images[2] = images[0]
+        images[3] = images[0] * 0.95 + 0.02
+        
+        node = ImageFingerprintNode()
+        for mode in ("cheap", "exact"):
+            fingerprints, batch, _, duplicates = node.fingerprint(images, mode)
+            assert fingerprints[0] == fingerprints[2] and fingerprints[0] != fingerprints[1]
+            assert duplicates == [-1, -1, 0, -1]
+            assert node.fingerprint(images.clone(), mode)[1] == batch
+            assert PopoImageFingerprintNode().fingerprint(images, mode) == (fingerprints, batch, [""] * 4, duplicates)
+        
+        # 只改动一个未被抽样的像素：精确模式能区分，快速模式不能
+        changed = images.clone()
+        changed[1, 1, 1, 1] += 0.001
+        assert node.fingerprint(changed, "exact")[0][1] != node.fingerprint(images, "exact")[0][1]
+        assert node.fingerprint(changed, "cheap")[0][1] == node.fingerprint(images, "cheap")[0][1]
+        
+        # 快速模式下指纹相同的图片按全部像素确认，不会误判为重复
+        pair = torch.stack([images[1], changed[1], images[1]])
+        fingerprints, _, _, duplicates = node.fingerprint(pair, "cheap")
+        assert fingerprints[0] == fingerprints[1] == fingerprints[2]
+        assert duplicates == [-1, -1, 0]
+        
+        # 精确指纹与内存布局无关
+        image = images[1]
+        transposed = image.transpose(0, 1)
+        assert content_fingerprint(transposed, exact=True) == content_fingerprint(transposed.contiguous(), exact=True)
+        assert content_fingerprint(image, exact=True) == content_fingerprint(image.numpy(), exact=True)
+        assert content_fingerprint(image) != content_fingerprint(image.half())
+        
+        # 感知哈希：相似的图片在距离阈值内视为重复
+        _, _, hashes, duplicates = node.fingerprint(images, "cheap", perceptual=True, max_distance=4)
+        assert len(hashes[0]) == 16 and hashes[0] == hashes[2]
+        assert duplicates == [-1, -1, 0, 0]
+        assert node.fingerprint(images, "cheap")[2] == [""] * 4
+        assert node.fingerprint(images, "sha1") == ([""], "", [""], [-1])
+        
+        print("✅ 图片内容指纹测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 图片内容指纹测试失败: {e}")
+        return False
+
+def test_image_grouping():
+    """测试按尺寸分组与还原顺序节点"""
+    print("\n🧪 测试按尺寸分组...")
+    
+    try:
+        import torch
+        from nodes.image_grouping import ImageGroupBySizeNode, ImageRestoreOrderNode
+        from nodes_direct import PopoImageGroupBySizeNode, PopoImageRestoreOrderNode
+        
+        torch.manual_seed(0)
+        images = [
+            torch.rand(2, 64, 96, 3),
+            torch.rand(1, 96, 64, 3),
+            torch.rand(3, 64, 96, 3),
+            torch.rand(80, 120, 3),
+        ]
+        group_node, restore_node = ImageGroupBySizeNode(), ImageRestoreOrderNode()
+        
+        groups, order, batch_sizes, count = group_node.group(images, ["size"])
+        assert count == 3
+        assert [tuple(g.shape) for g in groups] == [(5, 64, 96, 3), (1, 96, 64, 3), (1, 80, 120, 3)]
+        assert all(g.is_contiguous() for g in groups)
+        assert order == [0, 1, 5, 2, 3, 4, 6] and batch_sizes == [2, 1, 3, 1]
+        direct = PopoImageGroupBySizeNode().group(images, ["size"])
+        assert direct[1:] == (order, batch_sizes, count)
+        
+        # 模拟下游节点逐组处理后还原
+        processed = [g * 0.5 for g in groups]
+        (restored,) = restore_node.restore(processed, order, batch_sizes)
+        for original, result in zip(images, restored):
+            original = original if original.dim() == 4 else original.unsqueeze(0)
+            assert torch.equal(result, original * 0.5)
+        (singles,) = PopoImageRestoreOrderNode().restore(processed, order)
+        assert len(singles) == 7 and torch.equal(singles[3][0], images[2][0] * 0.5)
+        
+        # 一组恰好是一个完整批次时不复制
+        groups, order, _, _ = group_node.group(images[:1], ["size"])
+        assert groups[0] is images[0] and order == [0, 1]
+        
+        # 按宽高比分桶
+        groups, order, batch_sizes, count = group_node.group(images, ["bucket"], ["custom"], [64], ["768x512, 512x768"])
+        assert count == 2
+        assert [tuple(g.shape) for g in groups] == [(6, 512, 768, 3), (1, 768, 512, 3)]
+        (restored,) = restore_node.restore(groups, order, batch_sizes)
+        assert [tuple(r.shape[:3]) for r in restored] == [(2, 512, 768), (1, 768, 512), (3, 512, 768), (1, 512, 768)]
+        
+        # 无效输入
+        _, order, _, count = group_node.group(images, ["unknown"])
+        assert (order, count) == ([], 0)
+        (result,) = restore_node.restore([torch.rand(2, 8, 8, 3)], [0, 1, 2])
+        assert len(result) == 1
+        
+        print("✅ 按尺寸分组测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 按尺寸分组测试失败: {e}")
+        return False
+
+def test_content_bbox():
+    """测试内容边界框 / 自动裁剪节点"""
+    print("\n🧪 测试内容边界框...")
+    
+    try:
+        import torch
+        from nodes.content_bbox import ContentBoundingBoxNode
+        from nodes_direct import PopoContentBoundingBoxNode
+        
+        # 宽度不是分块大小的整数倍，覆盖尾部像素的处理
+        images = torch.zeros(3, 100, 150, 4)
+        images[0, 10:20, 30:55, :3] = 0.8
+        images[0, 10:20, 30:55, 3] = 1.0
+        images[1, ..., :3] = 1.0
+        images[1, 50:60, 140:147] = 0.2
+        images[1, 50:60, 140:147, 3] = 1.0
+        expected = ([30, 140, 0], [10, 50, 0], [25, 7, 150], [10, 10, 100])
+        
+        node = ContentBoundingBoxNode()
+        cropped, batch, x, y, width, height = node.autocrop(images, "auto", 0.02, 0)
+        assert (x, y, width, height) == expected
+        assert PopoContentBoundingBoxNode().autocrop(images, "auto", 0.02, 0)[2:] == expected
+        assert tuple(cropped[0].shape) == (1, 10, 25, 4)
+        # 裁剪结果与原图片共享内存
+        assert cropped[1].data_ptr() == images[1, 50, 140].data_ptr()
+        assert batch.data_ptr() == images[0, 10, 30].data_ptr()
+        assert tuple(batch.shape) == (3, 50, 117, 4)
+        
+        # alpha 和指定背景色
+        assert node.autocrop(images, "alpha", 0.5, 0)[2:] == expected
+        _, _, x, y, width, height = node.autocrop(images, "color", 0.02, 5, background="#FFFFFF")
+        assert (x[1], y[1], width[1], height[1]) == (135, 45, 15, 20)
+        assert (x[0], width[0]) == (0, 150)
+        
+        # 无效输入：没有alpha通道、颜色格式错误
+        rgb = torch.zeros(1, 8, 8, 3)
+        assert node.autocrop(rgb, "alpha", 0.5, 0)[2:] == ([0], [0], [0], [0])
+        assert node.autocrop(rgb, "color", 0.5, 0, "#12")[2:] == ([0], [0], [0], [0])
+        
+        print("✅ 内容边界框测试通过")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 内容边界框测试失败: {e}")
+        return False
+
 def test_auto_registration():
     """测试自动注册功能"""
     print("\n🧪 测试自动注册功能...")
@@ -367,6 +791,17 @@ if __name__ == "__main__":
         ("节点注册系统", test_node_registry),
         ("基础节点类", test_base_node_functionality),
         ("图片处理节点", test_image_nodes),
+        ("形状记忆化", test_shape_memo),
+        ("列表尺寸", test_image_dimensions_list),
+        ("宽高比分桶", test_aspect_buckets),
+        ("分辨率规划", test_resolution_planner),
+        ("宽高比命名", test_ratio_names),
+        ("张量尺寸", test_tensor_dimensions),
+        ("IS_CHANGED参数", test_is_changed_widget_inputs),
+        ("图片通道统计", test_image_statistics),
+        ("图片内容指纹", test_image_fingerprint),
+        ("按尺寸分组", test_image_grouping),
+        ("内容边界框", test_content_bbox),
         ("自动注册功能", test_auto_registration),
         ("性能特征", test_performance_characteristics),
         ("旧版兼容性", test_image_size_node),